@@ -1,9 +1,20 @@
+import os
+import sys
+
 import pyglet
 import pymunk
 from pymunk.pyglet_util import DrawOptions
 from pymunk.vec2d import Vec2d
 import numpy as np
 
+try:
+    from gym_carsim.envs.scenario import load_scenario
+except ImportError:
+    # Not installed, straight from the sources of Step 3
+    ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    sys.path[:0] = [os.path.join(ROOT, 'dqncar-common'), os.path.join(ROOT, 'Step-3-DeepQLearning', 'gym-carsim')]
+    from gym_carsim.envs.scenario import load_scenario
+
 class UltrasonicSensor:
     def __init__(self, space, car, offset=0, angle=0, color=(0,255,0,255)):
         self.space = space
@@ -98,24 +109,17 @@ class Car:
 
 class Obstacle:
     def __init__(self, space, pos, radius):
-        body = space.static_body
-        body.position = pos
-        obs = pymunk.Circle(space.static_body, radius)
+        obs = pymunk.Circle(space.static_body, radius, offset=tuple(pos))
         obs.is_sensed = True
         space.add(obs)
 
-class FourLegsObstacle:
-    def __init__(self, space, pos, width, height, radius):
-        _pos = np.array(pos)
-        Obstacle(space, _pos + (0,     0),      radius)
-        Obstacle(space, _pos + (0,     height), radius)
-        Obstacle(space, _pos + (width, 0),      radius)
-        Obstacle(space, _pos + (width, height), radius)
-
 class CarSimulation:
-    def __init__(self):
-        self.width  = 1280
-        self.height = 720
+    def __init__(self, scenario='default'):
+        # Loaded like the gym environment does it, from the same compiled
+        # cache, so that both drive on the same map and pop at the same sites
+        self.scenario = load_scenario(scenario)
+        self.width  = self.scenario.width
+        self.height = self.scenario.height
         self.window = pyglet.window.Window(self.width, self.height, "Car Simulator", resizable=False)
         self.draw_options = DrawOptions()
 
@@ -125,15 +129,8 @@ class CarSimulation:
         self._create_boundaries()
         self.car = Car(self.space)
 
-        Obstacle(self.space, ( 300, 300), 50)
-        Obstacle(self.space, ( 250, 630), 80)
-        Obstacle(self.space, (1200, 600), 90)
-
-        FourLegsObstacle(self.space, ( 700, 400), 200, 200, 15)
-        
-        FourLegsObstacle(self.space, ( 800,  50), 100, 100, 10)
-        FourLegsObstacle(self.space, ( 920,  50), 100, 100, 10)
-        FourLegsObstacle(self.space, (1040,  50), 100, 100, 10)
+        for x, y, radius in self.scenario.circles:
+            Obstacle(self.space, (x, y), radius)
 
         def on_draw():
             self.window.clear()
@@ -167,12 +164,9 @@ class CarSimulation:
     
     def _create_boundaries(self):
         body = self.space.static_body
-        tickness = 1.0
         boundaries = []
-        boundaries.append(pymunk.Segment(body, (1.0, 1.0), (self.width-1, 1.0),  tickness))
-        boundaries.append(pymunk.Segment(body, (1.0, 1.0), (1.0, self.height-1), tickness))
-        boundaries.append(pymunk.Segment(body, (1.0, self.height-1), (self.width-1, self.height-1), tickness))
-        boundaries.append(pymunk.Segment(body, (self.width-1, 1.0),  (self.width-1, self.height-1), tickness))
+        for a_x, a_y, b_x, b_y, tickness in self.scenario.segments:
+            boundaries.append(pymunk.Segment(body, (a_x, a_y), (b_x, b_y), tickness))
         for boundarie in boundaries:
             boundarie.elasticity = 1.0
             boundarie.friction = 0.0
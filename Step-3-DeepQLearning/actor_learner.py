@@ -0,0 +1,291 @@
+import argparse
+import multiprocessing
+import time
+import traceback
+
+import numpy as np
+
+from dqncar_common.numpy_policy import QNetwork
+
+# Training with acting and learning in separate processes: each actor steps
+# its own headless CarSimEnv with a numpy copy of the Q-network (no Keras in
+# the actors) and writes its transitions to a shared memory ring, the
+# learner copies them into its NumpyMemory, trains the NumpyDQNAgent of main.py
+# and publishes its weights back every few updates. Nothing gets pickled
+# per step, the processes only share flat numpy buffers.
+
+ENV_NAME = 'carsim-v0'
+
+def _shared_array(ctx, dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return raw, dtype, shape
+
+def _as_array(buffer):
+    raw, dtype, shape = buffer
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+class TransitionRing:
+    # Transitions of one actor on their way to the learner. The actor writes
+    # ahead of counters[0] and only moves it past whole episodes, so that
+    # episodes of different actors never interleave in the learner's memory.
+    # The learner copies the entries between counters[1] and counters[0] and
+    # moves counters[1]. An episode must fit in the ring.
+    def __init__(self, ctx, capacity, obs_shape):
+        self.capacity = capacity
+        self.buffers = [_shared_array(ctx, np.float32, (capacity,) + tuple(obs_shape)),
+                        _shared_array(ctx, np.int32,   (capacity,)),
+                        _shared_array(ctx, np.float32, (capacity,)),
+                        _shared_array(ctx, np.bool_,   (capacity,)),
+                        _shared_array(ctx, np.int64,   (2,))]
+        self._attach()
+
+    def _attach(self):
+        self.observations, self.actions, self.rewards, self.terminals, self.counters = \
+            [_as_array(buffer) for buffer in self.buffers]
+        self.head = int(self.counters[0])
+        self.episode_reward = 0.0
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'buffers': self.buffers}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    # Actor side
+    def push(self, observation, action, stop):
+        # Writes the observation an action was chosen on, its reward and
+        # terminal flag follow with finish(). Waits while the ring is full,
+        # False once `stop` is set
+        while True:
+            if stop[0]:
+                return False
+            if self.head - self.counters[1] < self.capacity:
+                break
+            time.sleep(0.001)
+        i = self.head % self.capacity
+        self.observations[i] = observation
+        self.actions[i] = action
+        self.rewards[i] = 0.0
+        self.terminals[i] = False
+        self.head += 1
+        return True
+
+    def finish(self, reward, terminal):
+        i = (self.head - 1) % self.capacity
+        self.rewards[i] = reward
+        self.terminals[i] = terminal
+
+    def commit(self):
+        self.counters[0] = self.head
+
+    # Learner side
+    def drain(self, memory):
+        # Appends the committed entries to `memory`, returns the number of
+        # env steps and the rewards of the episodes they ended
+        read, written = int(self.counters[1]), int(self.counters[0])
+        steps, episodes = 0, []
+        after_terminal = False
+        for j in range(read, written):
+            i = j % self.capacity
+            terminal = bool(self.terminals[i])
+            memory.append(self.observations[i], int(self.actions[i]), float(self.rewards[i]), terminal)
+            if after_terminal:
+                # The last observation of an episode, not a step
+                after_terminal = False
+                continue
+            steps += 1
+            self.episode_reward += float(self.rewards[i])
+            if terminal:
+                episodes.append(self.episode_reward)
+                self.episode_reward = 0.0
+                after_terminal = True
+        self.counters[1] = written
+        return steps, episodes
+
+class WeightBoard:
+    # The learner's weights, flat in shared memory with a version number that
+    # is odd while they are being written. An actor takes a copy when the
+    # version moved and reads the same even number before and after copying.
+    def __init__(self, ctx, shapes):
+        self.shapes = [tuple(shape) for shape in shapes]
+        size = sum(int(np.prod(shape)) for shape in self.shapes)
+        self.buffers = [_shared_array(ctx, np.float32, (size,)), _shared_array(ctx, np.int64, (1,))]
+        self._attach()
+
+    def _attach(self):
+        self.flat, self.version = [_as_array(buffer) for buffer in self.buffers]
+        self.local = np.empty_like(self.flat)
+        self.weights, offset = [], 0
+        for shape in self.shapes:
+            size = int(np.prod(shape))
+            self.weights.append(self.local[offset:offset + size].reshape(shape))
+            offset += size
+
+    def __getstate__(self):
+        return {'shapes': self.shapes, 'buffers': self.buffers}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def publish(self, weights):
+        self.version[0] += 1
+        offset = 0
+        for w in weights:
+            self.flat[offset:offset + w.size] = w.ravel()
+            offset += w.size
+        self.version[0] += 1
+
+    def fetch(self, version):
+        # (version, weights) when newer weights than `version` are there,
+        # None otherwise. The weights are views reused by the next fetch
+        current = int(self.version[0])
+        if current == version or current % 2:
+            return None
+        self.local[:] = self.flat
+        if int(self.version[0]) != current:
+            return None
+        return current, self.weights
+
+def boltzmann(q_values, tau, rng):
+    # Same draw as keras-rl's BoltzmannQPolicy
+    exp_values = np.exp(np.clip(q_values.astype(np.float64) / tau, -500., 500.))
+    return int(rng.choice(len(q_values), p=exp_values / np.sum(exp_values)))
+
+def _actor(ring, board, stop, seed, tau, max_episode_steps, dueling_type):
+    from gym_carsim.envs.carsim_env import CarSimEnv
+    from wrappers import WrapThreeFrames
+    stop = _as_array(stop)
+    try:
+        env = WrapThreeFrames(CarSimEnv(headless=True))
+        env.seed(seed)
+        rng = np.random.RandomState(seed)
+        # Waits for the first weights without spinning a core, the learner
+        # may be busy building its model
+        update = board.fetch(-1)
+        while update is None:
+            if stop[0]:
+                return
+            time.sleep(0.01)
+            update = board.fetch(-1)
+        version, weights = update
+        network = QNetwork.from_weights(weights, dueling_type=dueling_type)
+        while not stop[0]:
+            observation = env.reset()
+            for episode_step in range(max_episode_steps):
+                update = board.fetch(version)
+                if update is not None:
+                    version, weights = update
+                    network.set_weights(weights)
+                action = boltzmann(network.predict(observation[None])[0], tau, rng)
+                if not ring.push(observation, action, stop):
+                    return
+                observation, reward, done, _ = env.step(action)
+                done = done or episode_step + 1 == max_episode_steps
+                ring.finish(reward, done)
+                if done:
+                    break
+            # The last observation goes in like fit() does it, as a state1 only
+            if not ring.push(observation, boltzmann(network.predict(observation[None])[0], tau, rng), stop):
+                return
+            ring.commit()
+        env.close()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Train main.py's DQN with actor processes feeding one learner")
+    parser.add_argument('--actors', type=int, default=max(1, multiprocessing.cpu_count() - 1))
+    parser.add_argument('--steps', type=int, default=None, help="env steps over all actors, CONFIG['nb_steps'] by default")
+    parser.add_argument('--replay-ratio', type=float, default=1.0,
+                        help="batches trained per env step, like fit() does, 0 to train as fast as possible")
+    parser.add_argument('--sync-interval', type=int, default=100, help="updates between two weight broadcasts")
+    parser.add_argument('--tau', type=float, default=1.0, help="temperature of the actors' Boltzmann policy")
+    parser.add_argument('--max-episode-steps', type=int, default=10000)
+    parser.add_argument('--test-episodes', type=int, default=5)
+    parser.add_argument('--render', action='store_true', help="render the test episodes")
+    parser.add_argument('--log-interval', type=float, default=10.0, help="seconds between two progress lines")
+    args = parser.parse_args()
+
+    import main as training
+
+    config = dict(training.CONFIG)
+    if args.steps:
+        config['nb_steps'] = args.steps
+    np.random.seed(config['seed'])
+    env = training.make_env(config['env_seed'], headless=not args.render)
+    dqn = training.build_agent(env, config)
+    dqn.training = True
+    dueling_type = dqn.dueling_type if dqn.enable_dueling_network else None
+
+    ctx = multiprocessing.get_context('spawn')
+    weights = dqn.model.get_weights()
+    board = WeightBoard(ctx, [w.shape for w in weights])
+    board.publish(weights)
+    stop_buffer = _shared_array(ctx, np.int64, (1,))
+    stop = _as_array(stop_buffer)
+    capacity = max(1 << 14, 2 * (args.max_episode_steps + 1))
+    rings = [TransitionRing(ctx, capacity, env.observation_space.shape) for _ in range(args.actors)]
+    actors = [ctx.Process(target=_actor, daemon=True,
+                          args=(rings[i], board, stop_buffer, config['env_seed'] + 1 + i, args.tau,
+                                args.max_episode_steps, dueling_type))
+              for i in range(args.actors)]
+    for actor in actors:
+        actor.start()
+
+    steps, updates, rewards = 0, 0, []
+    started = last_log = time.time()
+    logged_steps, logged_updates = 0, 0
+    try:
+        while steps < config['nb_steps']:
+            drained = 0
+            for ring in rings:
+                ring_steps, episodes = ring.drain(dqn.memory)
+                drained += ring_steps
+                rewards.extend(episodes)
+            steps += drained
+
+            learnable = steps > dqn.nb_steps_warmup and \
+                (not args.replay_ratio or updates < args.replay_ratio * (steps - dqn.nb_steps_warmup))
+            if learnable:
+                dqn.step = steps
+                dqn.train_batch()
+                updates += 1
+                if dqn.target_model_update >= 1 and updates % dqn.target_model_update == 0:
+                    dqn.update_target_model_hard()
+                if updates % args.sync_interval == 0:
+                    board.publish(dqn.model.get_weights())
+            elif not drained:
+                if not all(actor.is_alive() for actor in actors):
+                    raise RuntimeError("An actor died, see its traceback above")
+                time.sleep(0.001)
+
+            now = time.time()
+            if now - last_log >= args.log_interval:
+                recent = rewards[-100:]
+                print('{} steps ({:.0f}/s), {} updates ({:.0f}/s), {} episodes, mean reward {:.3f}'.format(
+                      steps, (steps - logged_steps) / (now - last_log), updates, (updates - logged_updates) / (now - last_log),
+                      len(rewards), np.mean(recent) if recent else float('nan')))
+                last_log, logged_steps, logged_updates = now, steps, updates
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop[0] = 1
+        for actor in actors:
+            actor.join(5)
+            if actor.is_alive():
+                actor.terminate()
+    print('{} steps and {} updates in {:.0f}s'.format(steps, updates, time.time() - started))
+
+    # After training is done, we save the final weights.
+    dqn.save_weights('actor_learner_dqn_{}_weights.h5f'.format(ENV_NAME), overwrite=True)
+    print(training.evaluate(dqn, env, nb_episodes=args.test_episodes, visualize=args.render))
+    env.close()
+
+if __name__ == "__main__":
+    main()
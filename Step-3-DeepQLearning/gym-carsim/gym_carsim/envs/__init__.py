@@ -1 +1,10 @@
-from gym_carsim.envs.carsim_env import CarSimEnv
\ No newline at end of file
+from dqncar_common.lazy import lazy_attributes
+
+# The envs are imported on first use, so that a worker process or a module
+# like raycast or scenario does not load pymunk and every env with them
+__all__ = ['CarSimEnv', 'CarSimVecEnv', 'CarSimSubprocVecEnv']
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    'CarSimEnv':           'gym_carsim.envs.carsim_env',
+    'CarSimVecEnv':        'gym_carsim.envs.vec_env',
+    'CarSimSubprocVecEnv': 'gym_carsim.envs.subproc_vec_env',
+})
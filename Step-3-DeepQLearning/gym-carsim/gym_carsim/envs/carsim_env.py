@@ -1,15 +1,45 @@
-import pyglet
+import math
+
 import pymunk
-from pymunk.pyglet_util import DrawOptions
 from pymunk.vec2d import Vec2d
 
 import numpy as np
-import random
 
 import gym
 from gym import error, spaces, utils
 from gym.utils import seeding
 
+from gym_carsim.envs.collision import DistanceField
+from dqncar_common.profiling import Profiler
+from gym_carsim.envs.raycast import RayCaster
+from gym_carsim.envs.scenario import load_scenario
+
+# Geometry of the car, shared with CarSimVecEnv which has no pymunk car
+CAR_HEIGHT = 50
+CAR_WIDTH = 38
+CAR_VELOCITY = 50.0
+CAR_STEERING_ANGLE = 0.2
+# (offset, angle, color) of the ultrasonic sensors, left to right
+SENSORS = ((-10,  45, (0, 255, 0, 200)),
+           (  0,   0, (255, 0, 0, 200)),
+           ( 10, -45, (0, 0, 255, 200)))
+SENSOR_FOV = 60
+SENSOR_SPREAD = 2
+SENSOR_RANGE = 100
+
+def ray_table(sensors, height=CAR_HEIGHT):
+    # Rays of the (offset, angle, fov, spread, range) sensors in the car
+    # frame: their origins, angles, ranges and the ray count of each sensor
+    origins, angles, ranges, counts = [], [], [], []
+    for offset, angle, fov, spread, range_ in sensors:
+        fov = int(fov/2)
+        ray_angles = np.radians(np.arange(-fov+angle, fov+angle, spread))
+        origins.append(np.tile((offset, height/2.0 + 1.0), (len(ray_angles), 1)))
+        angles.append(ray_angles)
+        ranges.append(np.full(len(ray_angles), float(range_)))
+        counts.append(len(ray_angles))
+    return np.concatenate(origins), np.concatenate(angles), np.concatenate(ranges), np.array(counts)
+
 class UltrasonicSensor:
     def __init__(self, space, car, offset=0, angle=0, color=(0,255,0,255)):
         self.space = space
@@ -17,9 +47,9 @@ class UltrasonicSensor:
         self.offset = offset
         self.angle = angle
         self.color = color
-        self.fov = 60
-        self.spread = 2
-        self.range = 100
+        self.fov = SENSOR_FOV
+        self.spread = SENSOR_SPREAD
+        self.range = SENSOR_RANGE
 
     def sense(self):
         fov = int(self.fov/2)
@@ -29,39 +59,34 @@ class UltrasonicSensor:
         car_x += car_top.x + offset.x
         car_y += car_top.y + offset.y
         distances = []
+        ends = []
         for angle in range(-fov+self.angle, fov+self.angle, self.spread):
-            ray, distance = self._create_ray(car_x, car_y, angle)
+            end, distance = self._cast_ray(car_x, car_y, angle)
             distances.append(distance)
-            self.space.add(ray)
+            ends.append((end.x, end.y))
+        # Only kept for rendering, the rays never enter the space
+        self.last_rays = (np.tile((car_x, car_y), (len(ends), 1)), np.array(ends))
         return np.min(distances)
     
-    def _create_ray(self, a_x, a_y, angle):
-        kinematic = pymunk.Body(body_type=pymunk.Body.KINEMATIC)
+    def _cast_ray(self, a_x, a_y, angle):
         b_x, b_y = Vec2d(0.0, self.range).rotated(self.car.body.angle).rotated_degrees(angle)
-        ray = pymunk.Segment(kinematic, (a_x, a_y), (a_x+b_x, a_y+b_y), 1.0)
-        ray.position = (a_x, a_y)
-        ray.color = self.color
-        ray.is_a_ray = True
-        hits = self.space.segment_query(ray.a, ray.b, 1.0, pymunk.ShapeFilter())
+        a = Vec2d(a_x, a_y)
+        b = Vec2d(a_x+b_x, a_y+b_y)
+        hits = self.space.segment_query(a, b, 1.0, pymunk.ShapeFilter())
         distance = [self.range]
         for hit in hits:
             if hasattr(hit.shape, 'is_sensed'):
-                x = abs(hit.point.x - ray.a.x)
-                y = abs(hit.point.y - ray.a.y)
+                x = abs(hit.point.x - a.x)
+                y = abs(hit.point.y - a.y)
                 distance.append(Vec2d(x, y).get_length())
-        return ray, np.min(distance) / self.range
-
-    def _clear_rays(self):
-        for shape in self.space.shapes:
-            if hasattr(shape, 'is_a_ray'):
-                self.space.remove(shape)
+        return b, np.min(distance) / self.range
 
 class Car:
-    def __init__(self, space, pop=(500, 200), angle=0):
-        self.height = 50
-        self.width = 38
-        self.velocity = 50.0
-        self.steering_angle = 0.2
+    def __init__(self, space, pop=(500, 200), angle=0, ray_caster=None):
+        self.height = CAR_HEIGHT
+        self.width = CAR_WIDTH
+        self.velocity = CAR_VELOCITY
+        self.steering_angle = CAR_STEERING_ANGLE
         self.is_crashed = False
         _size = (self.width,self.height)
         _mass = 1.0
@@ -77,23 +102,66 @@ class Car:
         self.collision_handler = self.space.add_default_collision_handler()       
         self.collision_handler.begin = self._handle_collision
 
-        self.sensors = []
-        self.sensors.append(UltrasonicSensor(self.space, self, -10,  45, (0, 255, 0, 200)))
-        self.sensors.append(UltrasonicSensor(self.space, self,   0,   0, (255, 0, 0, 200)))
-        self.sensors.append(UltrasonicSensor(self.space, self,  10, -45, (0, 0, 255, 200)))
-   
+        self.sensors = [UltrasonicSensor(self.space, self, offset, angle, color) for offset, angle, color in SENSORS]
+
+        # Without a ray caster the sensors query the pymunk space (reference mode)
+        self.ray_caster = ray_caster
+        self.build_ray_table()
+
+    def build_ray_table(self):
+        # Rays of all the sensors in the car frame, to be cast in one pass
+        sensors = [(s.offset, s.angle, s.fov, s.spread, s.range) for s in self.sensors]
+        self._ray_origins, self._ray_angles, self._ray_ranges, counts = ray_table(sensors, self.height)
+        self._ray_splits  = np.cumsum(counts)[:-1]
+        self._ray_starts  = np.concatenate([[0], self._ray_splits])
+        self.ray_colors   = np.repeat([s.color for s in self.sensors], counts, axis=0).astype(np.uint8)
+        self.last_rays = None
+        # read_sensors() writes the distances in place, the rays too
+        self.observation = np.zeros(len(self.sensors), dtype=np.float32)
+        self._ray_a = np.empty((len(self._ray_angles), 2))
+        self._ray_b = np.empty((len(self._ray_angles), 2))
+
     def reset_body(self, pop, angle):
         self.is_crashed = False
+        # Distance the car can still go before the sdf collision mode checks it
+        self.clearance = 0.0
         self.body.position = pop
         self.body.angle = angle
         self.body.velocity = Vec2d(0.0, self.velocity)
         self.body.angular_velocity = 0.0
     
+    def forget_contacts(self):
+        # Removing the shape drops its cached arbiters so begin() fires again
+        # on the next contact, and a zero length integration clears the bias
+        # velocity the solver left on the body after a crash
+        self.space.remove(self.shape)
+        self.space.add(self.shape)
+        pymunk.Body.update_position(self.body, 0.0)
+
     def read_sensors(self):
-        distances = []
-        for sensor in self.sensors:
-            distances.append(sensor.sense())
-        return distances
+        # The float32 `observation` buffer, overwritten by the next read
+        if self.ray_caster is not None:
+            return self._cast_rays()
+        for i, sensor in enumerate(self.sensors):
+            self.observation[i] = sensor.sense()
+        self.last_rays = tuple(np.concatenate(rays) for rays in zip(*[sensor.last_rays for sensor in self.sensors]))
+        return self.observation
+
+    def _cast_rays(self):
+        x, y = self.body.position
+        angle = self.body.angle
+        cos, sin = np.cos(angle), np.sin(angle)
+        o_x, o_y = self._ray_origins[:, 0], self._ray_origins[:, 1]
+        a, b = self._ray_a, self._ray_b
+        a[:, 0] = x + o_x*cos - o_y*sin
+        a[:, 1] = y + o_x*sin + o_y*cos
+        ray_angles = angle + self._ray_angles
+        b[:, 0] = a[:, 0] - self._ray_ranges*np.sin(ray_angles)
+        b[:, 1] = a[:, 1] + self._ray_ranges*np.cos(ray_angles)
+        distances = self.ray_caster.cast(a, b)
+        distances /= self._ray_ranges
+        self.last_rays = (a, b)
+        return np.minimum.reduceat(distances, self._ray_starts, out=self.observation)
 
     def cmd(self,cmd):
         if cmd == 0:    # Turn left.
@@ -110,9 +178,7 @@ class Car:
 
 class Obstacle:
     def __init__(self, space, pos, radius):
-        body = space.static_body
-        body.position = pos
-        obs = pymunk.Circle(space.static_body, radius)
+        obs = pymunk.Circle(space.static_body, radius, offset=tuple(pos))
         obs.is_sensed = True
         space.add(obs)
 
@@ -124,12 +190,45 @@ class FourLegsObstacle:
         Obstacle(space, _pos + (width, 0),      radius)
         Obstacle(space, _pos + (width, height), radius)
 
+class Wall:
+    def __init__(self, space, a, b, radius):
+        wall = pymunk.Segment(space.static_body, tuple(a), tuple(b), radius)
+        wall.elasticity = 1.0
+        wall.friction = 0.0
+        wall.is_sensed = True
+        space.add(wall)
+
+def create_world(space, scenario):
+    for a_x, a_y, b_x, b_y, radius in scenario.segments:
+        Wall(space, (a_x, a_y), (b_x, b_y), radius)
+    for x, y, radius in scenario.circles:
+        Obstacle(space, (x, y), radius)
+
+# Seconds the car drives between two decisions without action repeat
+FRAME_TIME = 0.1
+
+# Layout of the get_state() array: car pose, velocities, crash flag, then the
+# PCG64 state of the pop generator split in 32 bits words
+STATE_SIZE = 17
+_RNG_WORDS = slice(7, STATE_SIZE)
+
 class CarSimEnv(gym.Env):
-    def __init__(self):
-        self.width  = 1280
-        self.height = 720
-        self.window = pyglet.window.Window(self.width, self.height, "Car Simulator", resizable=False)
-        self.draw_options = DrawOptions()
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, sensing='numpy', headless=False, render_rays=True, collision='pymunk', sdf_resolution=2.0,
+                 scenario='default', substeps=1, action_repeat=1, copy_obs=False):
+        # Name of a bundled scenario, path to a json file or a loaded Scenario
+        self.scenario = load_scenario(scenario)
+        self.width  = self.scenario.width
+        self.height = self.scenario.height
+        # The window is only opened by the first render(), headless never imports pyglet
+        self.headless = headless
+        self.render_rays = render_rays
+        self.window = None
+        self.profiler = None
+        # Observations are the float32 buffer of the car, valid until the
+        # next step or reset. copy_obs returns a copy of it instead
+        self.copy_obs = copy_obs
 
         self.seed()
         self.action_space = spaces.Discrete(3)
@@ -138,56 +237,59 @@ class CarSimEnv(gym.Env):
         self.space = pymunk.Space()
         self.space.gravity = Vec2d(0.0, 0.0)
 
-        self._create_boundaries()
-        self.car = Car(self.space)
-
-        Obstacle(self.space, ( 300, 300), 50)
-        Obstacle(self.space, ( 250, 630), 80)
-        Obstacle(self.space, (1200, 600), 90)
-
-        FourLegsObstacle(self.space, ( 700, 400), 200, 200, 15)
-        
-        FourLegsObstacle(self.space, ( 800,  50), 100, 100, 10)
-        FourLegsObstacle(self.space, ( 920,  50), 100, 100, 10)
-        FourLegsObstacle(self.space, (1040,  50), 100, 100, 10)
+        create_world(self.space, self.scenario)
 
-        def on_key_press(symbol, modifiers):
-            #if symbol == pyglet.window.key.LEFT:
-            #    self.car.cmd(0)
-            #elif symbol == pyglet.window.key.RIGHT:
-            #    self.car.cmd(1)
-            #elif symbol == pyglet.window.key.UP:
-            #    self.car.cmd(2)
-            if symbol == pyglet.window.key.ESCAPE:
-                pyglet.app.exit()
-                quit()
-            #update(0.2)
-
-        #def on_draw():
-        #    self.window.clear()
-        #    self.space.debug_draw(self.draw_options)
+        # 'numpy' casts all the rays in one pass, 'pymunk' queries the space ray by ray
+        if sensing == 'numpy':
+            self.car = Car(self.space, ray_caster=RayCaster(self.scenario.circles, self.scenario.segments))
+        elif sensing == 'pymunk':
+            self.car = Car(self.space)
+        else:
+            raise error.Error("Unknown sensing mode: {}".format(sensing))
 
-        #def update(dt):
-        #    self.car.sensors[0]._clear_rays()
-        #    self.space.step(dt)
-        #    print(self.car.read_sensors())
-        #    if self.car.is_crashed:
-        #        self.reset_sim()
+        # 'sdf' tests the car box against a distance field of the static
+        # world and moves the car itself, the space is never stepped
+        self.collision = collision
+        if collision == 'sdf':
+            self.distance_field = DistanceField.for_scenario(self.scenario, sdf_resolution)
+            self.car.shape.filter = pymunk.ShapeFilter(categories=0, mask=0)
+        elif collision != 'pymunk':
+            raise error.Error("Unknown collision mode: {}".format(collision))
 
-        self.window.push_handlers(on_key_press)#,on_draw)
-        #pyglet.clock.schedule_interval(update, 1.0/30.0)
-        #pyglet.app.run()
+        # A step applies the action `action_repeat` times and sums their
+        # rewards, each time moving the car for FRAME_TIME in `substeps`
+        # physics steps checked for crashes. The sensors are only read at the
+        # end of the step, or on the crash that ends it
+        if substeps < 1 or action_repeat < 1:
+            raise error.Error("substeps and action_repeat must be at least 1")
+        self.substeps = substeps
+        self.action_repeat = action_repeat
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
+        self._pop_random = np.random.Generator(np.random.PCG64(seed))
         return [seed]
 
     def step(self, action):
-        self._pyglet_event_loop()
-        self.car.sensors[0]._clear_rays()
-        self.car.cmd(action)
-        self.space.step(0.1)
-        observation = self.car.read_sensors()
+        if self.window is not None:
+            self._pyglet_event_loop()
+        score, done = self._act(action)
+        observation = self._observe()
+        #print(observation, score, done)
+        return observation, score, done, {}
+
+    def _act(self, action):
+        score = 0.0
+        for _ in range(self.action_repeat):
+            self.car.cmd(action)
+            self._physics_step(FRAME_TIME)
+            frame_score, done = self._score(action)
+            score += frame_score
+            if done:
+                break
+        return score, done
+
+    def _score(self, action):
         done = self.car.is_crashed
         score = 0.0
         if done:
@@ -197,31 +299,197 @@ class CarSimEnv(gym.Env):
                 score -= 1
             else:
                 score += 1
-        #print(observation, score, done)
-        return observation, score, done, {}
+        return score, done
 
     def render(self, mode='human'):
+        if self.headless:
+            return
+        if self.window is None:
+            self._create_window()
         self.window.clear()
+        if self.collision == 'sdf':
+            # Without space steps the car shape still sits where pymunk last put it
+            self.space.reindex_shapes_for_body(self.car.body)
         self.space.debug_draw(self.draw_options)
+        if self.render_rays and self.car.last_rays is not None:
+            self.ray_renderer.update(*self.car.last_rays, colors=self.car.ray_colors)
+            self.ray_renderer.draw()
+
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+            self.window = None
 
     def reset(self):
-        self._pyglet_event_loop()
-        self.car.sensors[0]._clear_rays()
+        if self.window is not None:
+            self._pyglet_event_loop()
         rand_pop, rand_angle = self._random_pop()
         self.car.reset_body(rand_pop, rand_angle)
-        self.space.step(0.1)
-        return self.car.read_sensors()
+        # The crash that ended the last episode must not push the new one
+        self.car.forget_contacts()
+        self._physics_step(FRAME_TIME)
+        return self._observe()
     
+    def enable_profiling(self, profiler=None):
+        # Swaps step() and reset() for timed copies on this instance only,
+        # the class methods stay untouched and cost nothing when disabled
+        self.profiler = profiler or Profiler()
+        self.step = self._profiled_step
+        self.reset = self._profiled_reset
+        return self.profiler
+
+    def disable_profiling(self):
+        self.__dict__.pop('step', None)
+        self.__dict__.pop('reset', None)
+        self.profiler = None
+
+    def _profiled_step(self, action):
+        profiler = self.profiler
+        profiler.start()
+        if self.window is not None:
+            self._pyglet_event_loop()
+        profiler.lap('events')
+        score, done = self._act(action)
+        profiler.lap('physics')
+        observation = self._observe()
+        profiler.lap('sensing')
+        self._count_world(profiler)
+        return observation, score, done, {'profile': profiler.stop('step')}
+
+    def _profiled_reset(self):
+        profiler = self.profiler
+        profiler.start()
+        if self.window is not None:
+            self._pyglet_event_loop()
+        profiler.lap('events')
+        rand_pop, rand_angle = self._random_pop()
+        self.car.reset_body(rand_pop, rand_angle)
+        self.car.forget_contacts()
+        profiler.lap('pop')
+        self._physics_step(FRAME_TIME)
+        profiler.lap('physics')
+        observation = self._observe()
+        profiler.lap('sensing')
+        self._count_world(profiler)
+        profiler.stop('reset')
+        return observation
+
+    def _count_world(self, profiler):
+        profiler.count('shapes', len(self.space.shapes))
+        profiler.count('rays', len(self.car._ray_angles))
+        profiler.count('crashes', int(self.car.is_crashed))
+
+    def get_state(self):
+        # Everything a step depends on, in a small fixed-size array
+        body = self.car.body
+        state = np.empty(STATE_SIZE)
+        state[0:2] = body.position
+        state[2] = body.angle
+        state[3:5] = body.velocity
+        state[5] = body.angular_velocity
+        state[6] = self.car.is_crashed
+        state[_RNG_WORDS] = _pack_rng(self._pop_random.bit_generator.state)
+        return state
+
+    def set_state(self, state):
+        # Puts the world back in a get_state() state without any physics
+        # step, only the sensors are read again
+        body = self.car.body
+        body.position = tuple(state[0:2])
+        body.angle = state[2]
+        body.velocity = tuple(state[3:5])
+        body.angular_velocity = state[5]
+        self.car.is_crashed = bool(state[6])
+        self.car.clearance = 0.0
+        self._pop_random.bit_generator.state = _unpack_rng(state[_RNG_WORDS])
+        self.car.forget_contacts()
+        return self._observe()
+
+    def start_states(self, nb_states):
+        # Pool of (nb_states, STATE_SIZE) reset states to set_state() from,
+        # the current state is left untouched
+        current = self.get_state()
+        states = np.empty((nb_states, STATE_SIZE))
+        for i in range(nb_states):
+            self.reset()
+            states[i] = self.get_state()
+        self.set_state(current)
+        return states
+
+    def _observe(self):
+        observation = self.car.read_sensors()
+        return observation.copy() if self.copy_obs else observation
+
+    def _physics_step(self, dt):
+        # The car stops being integrated on its first crash
+        dt /= self.substeps
+        if self.collision == 'sdf':
+            self._move_car(dt)
+            return
+        for _ in range(self.substeps):
+            self.space.step(dt)
+            if self.car.is_crashed:
+                break
+
+    def _move_car(self, dt):
+        # Nothing collides with the car in sdf mode, so pymunk would only
+        # move it at its velocity: the same integration, without space steps
+        # and in plain floats until the body is written back. The field is
+        # only looked up again once the car has used up the clearance it had
+        # at the last lookup
+        car = self.car
+        body = car.body
+        field = self.distance_field
+        x, y = body.position
+        v_x, v_y = body.velocity
+        angle = body.angle
+        angular_velocity = body.angular_velocity
+        distance = math.hypot(v_x, v_y)*dt
+        for _ in range(self.substeps):
+            x += v_x*dt
+            y += v_y*dt
+            angle += angular_velocity*dt
+            if car.is_crashed:
+                break
+            car.clearance -= distance
+            if car.clearance > 0.0:
+                continue
+            car.clearance = field.clearance(x, y, car.width, car.height)
+            if car.clearance <= 0.0:
+                car.is_crashed = field.box_collides(x, y, angle, car.width, car.height)
+                if car.is_crashed:
+                    break
+        body.position = x, y
+        if angular_velocity:
+            body.angle = angle
+
     def _random_pop(self):
-        pop_sites = [[200,150],[200,450],[500,500],[550,150],[1100,350]]
-        pop_site = random.choice(pop_sites)
+        pop_site = self.scenario.pop_sites[self._pop_random.integers(0, len(self.scenario.pop_sites))]
+        spread = self.scenario.pop_spread
 
-        new_x = pop_site[0] + random.randrange(-100, +100, 1)
-        new_y = pop_site[1] + random.randrange(-100, +100, 1)
-        new_r = random.randrange(-31456, 31456) / 10000.0
+        new_x = pop_site[0] + self._pop_random.integers(-spread, spread)
+        new_y = pop_site[1] + self._pop_random.integers(-spread, spread)
+        new_r = self._pop_random.integers(-31456, 31456) / 10000.0
         return (new_x, new_y), new_r
 
+    def _create_window(self):
+        import pyglet
+        from pymunk.pyglet_util import DrawOptions
+        from gym_carsim.envs.rendering import RayRenderer
+
+        self.window = pyglet.window.Window(self.width, self.height, "Car Simulator", resizable=False)
+        self.draw_options = DrawOptions()
+        self.ray_renderer = RayRenderer()
+
+        def on_key_press(symbol, modifiers):
+            if symbol == pyglet.window.key.ESCAPE:
+                pyglet.app.exit()
+                quit()
+
+        self.window.push_handlers(on_key_press)
+
     def _pyglet_event_loop(self):
+        import pyglet
         pyglet.clock.tick()
         for window in pyglet.app.windows:
             window.switch_to()
@@ -229,19 +497,23 @@ class CarSimEnv(gym.Env):
             window.dispatch_event('on_draw')
             window.flip()
 
-    def _create_boundaries(self):
-        body = self.space.static_body
-        tickness = 1.0
-        boundaries = []
-        boundaries.append(pymunk.Segment(body, (1.0, 1.0), (self.width-1, 1.0),  tickness))
-        boundaries.append(pymunk.Segment(body, (1.0, 1.0), (1.0, self.height-1), tickness))
-        boundaries.append(pymunk.Segment(body, (1.0, self.height-1), (self.width-1, self.height-1), tickness))
-        boundaries.append(pymunk.Segment(body, (self.width-1, 1.0),  (self.width-1, self.height-1), tickness))
-        for boundarie in boundaries:
-            boundarie.elasticity = 1.0
-            boundarie.friction = 0.0
-            boundarie.is_sensed = True
-            self.space.add(boundarie)
+def _pack_rng(rng_state):
+    words = []
+    for value in (rng_state['state']['state'], rng_state['state']['inc']):
+        words += [(value >> shift) & 0xFFFFFFFF for shift in (96, 64, 32, 0)]
+    return words + [rng_state['has_uint32'], rng_state['uinteger']]
+
+def _unpack_rng(words):
+    words = [int(word) for word in words]
+    state = inc = 0
+    for word in words[0:4]:
+        state = (state << 32) | word
+    for word in words[4:8]:
+        inc = (inc << 32) | word
+    return {'bit_generator': 'PCG64',
+            'state': {'state': state, 'inc': inc},
+            'has_uint32': words[8],
+            'uinteger': words[9]}
 
 if __name__ == "__main__":
     simulation = CarSimEnv()
@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+# Fields already opened in this process, by scenario and resolution
+_FIELDS = {}
+
+class DistanceField:
+    # Signed distance to the closest static obstacle (negative inside it),
+    # sampled once on a grid of `resolution` pixels. A car box is in a crash
+    # when any point of it lies at a distance <= 0.
+    def __init__(self, field, width, height, resolution=2.0):
+        # A plain ndarray view of a mapped field, operations on np.memmap
+        # arrays go through the subclass
+        self.field = np.asarray(field)
+        self.width = width
+        self.height = height
+        self.resolution = float(resolution)
+        self._box_points = {}
+
+    @classmethod
+    def from_shapes(cls, circles, segments, width, height, resolution=2.0):
+        field = _sample_field(np.asarray(circles, dtype=np.float64).reshape(-1, 3),
+                              np.asarray(segments, dtype=np.float64).reshape(-1, 5),
+                              width, height, float(resolution))
+        return cls(field, width, height, resolution)
+
+    @classmethod
+    def for_scenario(cls, scenario, resolution=2.0):
+        # The field is stored in the scenario cache and mapped read-only
+        key = (scenario.key, float(resolution))
+        if key not in _FIELDS:
+            field = scenario.cached_array('sdf_{:g}'.format(resolution), lambda: _sample_field(
+                scenario.circles, scenario.segments, scenario.width, scenario.height, float(resolution)))
+            _FIELDS[key] = cls(field, scenario.width, scenario.height, resolution)
+        return _FIELDS[key]
+
+    def distance(self, x, y):
+        # Bilinear interpolation of the field, clamped to the grid
+        g_x = np.clip(np.asarray(x) / self.resolution, 0.0, self.field.shape[1] - 1.000001)
+        g_y = np.clip(np.asarray(y) / self.resolution, 0.0, self.field.shape[0] - 1.000001)
+        i, j = g_x.astype(np.intp), g_y.astype(np.intp)
+        f_x, f_y = g_x - i, g_y - j
+        # take() on the flat field, faster than indexing it with (j, i)
+        f = self.field.ravel()
+        top_left = j*self.field.shape[1] + i
+        bottom_left = top_left + self.field.shape[1]
+        top    = f.take(top_left)*(1.0 - f_x) + f.take(top_left + 1)*f_x
+        bottom = f.take(bottom_left)*(1.0 - f_x) + f.take(bottom_left + 1)*f_x
+        return top*(1.0 - f_y) + bottom*f_y
+
+    def point_distance(self, x, y):
+        # distance() of a single point in plain floats, numpy costs more than
+        # the interpolation itself for one point
+        g_x = min(max(x / self.resolution, 0.0), self.field.shape[1] - 1.000001)
+        g_y = min(max(y / self.resolution, 0.0), self.field.shape[0] - 1.000001)
+        i, j = int(g_x), int(g_y)
+        f_x, f_y = g_x - i, g_y - j
+        item = self.field.item
+        top    = item(j, i)*(1.0 - f_x) + item(j, i+1)*f_x
+        bottom = item(j+1, i)*(1.0 - f_x) + item(j+1, i+1)*f_x
+        return top*(1.0 - f_y) + bottom*f_y
+
+    def clearance(self, x, y, width, height):
+        # How far the box can go, turning included, before it may touch anything
+        return self.point_distance(x, y) - math.hypot(width, height) / 2.0 - self.resolution
+
+    def box_collides(self, x, y, angle, width, height):
+        # Far enough from everything, the box can not touch anything
+        if self.clearance(x, y, width, height) > 0.0:
+            return False
+        p_x, p_y = self._points(width, height)
+        cos, sin = np.cos(angle), np.sin(angle)
+        return bool(np.min(self.distance(x + p_x*cos - p_y*sin, y + p_x*sin + p_y*cos)) <= 0.0)
+
+    def _points(self, width, height):
+        # Grid of points covering the box, edges included, in the box frame
+        key = (width, height)
+        if key not in self._box_points:
+            xs = np.linspace(-width/2.0,  width/2.0,  int(np.ceil(width  / self.resolution)) + 1)
+            ys = np.linspace(-height/2.0, height/2.0, int(np.ceil(height / self.resolution)) + 1)
+            p_x, p_y = np.meshgrid(xs, ys)
+            self._box_points[key] = p_x.ravel(), p_y.ravel()
+        return self._box_points[key]
+
+def _sample_field(circles, segments, width, height, resolution, rows=64):
+    xs = np.arange(0.0, width + resolution, resolution)
+    ys = np.arange(0.0, height + resolution, resolution)
+    field = np.empty((len(ys), len(xs)), dtype=np.float32)
+    # A few rows at a time to keep the (points, shapes) temporaries small
+    for start in range(0, len(ys), rows):
+        p_x, p_y = np.meshgrid(xs, ys[start:start+rows])
+        p_x, p_y = p_x.ravel()[:, None], p_y.ravel()[:, None]
+        distance = np.full(p_x.shape[0], np.inf)
+        if len(circles):
+            d = np.hypot(p_x - circles[:, 0], p_y - circles[:, 1]) - circles[:, 2]
+            distance = np.minimum(distance, d.min(axis=1))
+        if len(segments):
+            a_x, a_y, b_x, b_y, r = segments.T
+            ab_x, ab_y = b_x - a_x, b_y - a_y
+            t = np.clip(((p_x - a_x)*ab_x + (p_y - a_y)*ab_y) / (ab_x*ab_x + ab_y*ab_y), 0.0, 1.0)
+            d = np.hypot(p_x - a_x - t*ab_x, p_y - a_y - t*ab_y) - r
+            distance = np.minimum(distance, d.min(axis=1))
+        field[start:start+rows] = distance.reshape(-1, len(xs))
+    return field
+
+def validate_against_pymunk(env, resolution=2.0, nb_poses=2000, seed=0, max_distance=None):
+    # Compares the field with pymunk's own overlap test of the car shape on
+    # random poses. Returns the fraction of poses where both agree.
+    # With max_distance, poses whose center is farther than that from every
+    # obstacle are drawn again, to test near the contacts
+    import pymunk
+    rng = np.random.RandomState(seed)
+    car = env.car
+    field = DistanceField.for_scenario(env.scenario, resolution)
+    shape_filter = car.shape.filter
+    car.shape.filter = pymunk.ShapeFilter()
+    agree = 0
+    for _ in range(nb_poses):
+        x, y = rng.uniform(0, env.width), rng.uniform(0, env.height)
+        while max_distance is not None and field.point_distance(x, y) > max_distance:
+            x, y = rng.uniform(0, env.width), rng.uniform(0, env.height)
+        angle = rng.uniform(-np.pi, np.pi)
+        car.body.position = (x, y)
+        car.body.angle = angle
+        env.space.reindex_shapes_for_body(car.body)
+        hits = [info for info in env.space.shape_query(car.shape) if hasattr(info.shape, 'is_sensed')]
+        agree += (len(hits) > 0) == field.box_collides(x, y, angle, car.width, car.height)
+    car.shape.filter = shape_filter
+    return agree / float(nb_poses)
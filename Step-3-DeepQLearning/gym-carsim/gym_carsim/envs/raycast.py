@@ -0,0 +1,135 @@
+import numpy as np
+
+# Same thickness as the pymunk.Segment used for the rays
+RAY_RADIUS = 1.0
+
+class RayCaster:
+    # Casts many rays at once against the static circles and segments of the
+    # world. Follows chipmunk's segment query (bounding box culling, rays
+    # starting inside a shape, rounded segment caps) so the distances match
+    # the pymunk path of UltrasonicSensor.sense ray for ray.
+    def __init__(self, circles, segments, ray_radius=RAY_RADIUS):
+        self.circles  = np.asarray(circles,  dtype=np.float64).reshape(-1, 3)
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 5)
+        self.ray_radius = ray_radius
+
+        c, r = self.circles[:, 0:2], self.circles[:, 2]
+        self._circles = c.T.copy(), r
+        self._circles_bb = np.concatenate([c - r[:, None], c + r[:, None]], axis=1).T.copy()
+
+        seg_a, seg_b, seg_r = self.segments[:, 0:2], self.segments[:, 2:4], self.segments[:, 4]
+        ab = seg_b - seg_a
+        tangent = ab / np.linalg.norm(ab, axis=1, keepdims=True)
+        self._segments = (seg_a.T.copy(), seg_b.T.copy(), seg_r,
+                          np.stack([tangent[:, 1], -tangent[:, 0]]), ab.T.copy(), np.sum(ab**2, axis=1))
+        self._segments_bb = np.concatenate([np.minimum(seg_a, seg_b) - seg_r[:, None],
+                                            np.maximum(seg_a, seg_b) + seg_r[:, None]], axis=1).T.copy()
+
+    @classmethod
+    def from_space(cls, space):
+        import pymunk
+        circles, segments = [], []
+        for shape in space.shapes:
+            if not hasattr(shape, 'is_sensed'):
+                continue
+            if isinstance(shape, pymunk.Circle):
+                x, y = shape.body.local_to_world(shape.offset)
+                circles.append((x, y, shape.radius))
+            elif isinstance(shape, pymunk.Segment):
+                a_x, a_y = shape.body.local_to_world(shape.a)
+                b_x, b_y = shape.body.local_to_world(shape.b)
+                segments.append((a_x, a_y, b_x, b_y, shape.radius))
+        return cls(circles, segments)
+
+    def cast(self, a, b):
+        # a, b: (K, 2) ray start and end points.
+        # Returns the (K,) distance from a to the closest hit, |b - a| if none.
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        a_x, a_y = a[:, 0], a[:, 1]
+        d_x, d_y = b[:, 0] - a_x, b[:, 1] - a_y
+        distances = np.hypot(d_x, d_y)
+        rays_bb = np.minimum(a_x, b[:, 0]), np.minimum(a_y, b[:, 1]), np.maximum(a_x, b[:, 0]), np.maximum(a_y, b[:, 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for shapes_bb, query in ((self._circles_bb, self._circles_query), (self._segments_bb, self._segments_query)):
+                # Only the pairs whose bounding boxes overlap can hit
+                ray, shape = np.nonzero((rays_bb[0][:, None] <= shapes_bb[2]) & (shapes_bb[0] <= rays_bb[2][:, None]) &
+                                        (rays_bb[1][:, None] <= shapes_bb[3]) & (shapes_bb[1] <= rays_bb[3][:, None]))
+                if len(ray) == 0:
+                    continue
+                hits = query(a_x[ray], a_y[ray], d_x[ray], d_y[ray], shape)
+                hits[~self._bb_query(a_x[ray], a_y[ray], d_x[ray], d_y[ray], shapes_bb[:, shape])] = np.inf
+                np.minimum.at(distances, ray, hits)
+        return distances
+
+    def _bb_query(self, a_x, a_y, d_x, d_y, bb):
+        # cpBBSegmentQuery: the thin ray has to cross the bounding box of a
+        # shape for the space index to query that shape at all.
+        t_min, t_max = -np.inf, np.inf
+        for a, d, low, high in ((a_x, d_x, bb[0], bb[2]), (a_y, d_y, bb[1], bb[3])):
+            t_1 = (low - a) / d
+            t_2 = (high - a) / d
+            flat = d == 0.0
+            outside = flat & ((a < low) | (high < a))
+            t_min = np.where(flat, np.where(outside, np.inf, t_min), np.maximum(t_min, np.minimum(t_1, t_2)))
+            t_max = np.where(flat, t_max, np.minimum(t_max, np.maximum(t_1, t_2)))
+        return (t_min <= t_max) & (t_max >= 0.0) & (t_min < 1.0)
+
+    def _circles_query(self, a_x, a_y, d_x, d_y, shape):
+        centers, radii = self._circles
+        return self._circle_query(a_x, a_y, d_x, d_y, centers[0, shape], centers[1, shape], radii[shape])
+
+    def _circle_query(self, a_x, a_y, d_x, d_y, c_x, c_y, radius):
+        # cpCircleSegmentQuery of each ray against its circle, inf when missed.
+        r2 = self.ray_radius
+        da_x = a_x - c_x
+        da_y = a_y - c_y
+        rsum = radius + r2
+        da_da = da_x*da_x + da_y*da_y
+        da_d  = da_x*d_x + da_y*d_y
+        qa = d_x*d_x + d_y*d_y
+        det = da_d*da_d - qa*(da_da - rsum*rsum)
+        t = (-da_d - np.sqrt(np.maximum(det, 0.0))) / qa
+        # A ray starting inside a shape is reported at its full length by chipmunk
+        hit = (det >= 0.0) & (t >= 0.0) & (t <= 1.0) & (da_da > rsum*rsum)
+        # The hit point is moved back on the shape by the ray thickness
+        n_x = da_x + t*d_x
+        n_y = da_y + t*d_y
+        n_len = np.hypot(n_x, n_y)
+        distance = np.hypot(t*d_x - n_x/n_len*r2, t*d_y - n_y/n_len*r2)
+        return np.where(hit, distance, np.inf)
+
+    def _segments_query(self, a_x, a_y, d_x, d_y, shape):
+        # cpSegmentShape segment query of each ray against its segment.
+        seg_a, seg_b, seg_r, seg_n, seg_ab, seg_ab_len2 = self._segments
+        r2 = self.ray_radius
+        s_a_x, s_a_y = seg_a[0, shape], seg_a[1, shape]
+        s_b_x, s_b_y = seg_b[0, shape], seg_b[1, shape]
+        s_r = seg_r[shape]
+        n_x, n_y = seg_n[0, shape], seg_n[1, shape]
+        d = (s_a_x - a_x)*n_x + (s_a_y - a_y)*n_y
+        r = s_r + r2
+        flip = np.where(d > 0.0, -1.0, 1.0)
+        off_x = flip*n_x*r - a_x
+        off_y = flip*n_y*r - a_y
+        cross_a = d_x*(s_a_y + off_y) - d_y*(s_a_x + off_x)
+        cross_b = d_x*(s_b_y + off_y) - d_y*(s_b_x + off_x)
+        across = cross_a*cross_b <= 0.0
+
+        # The ray crosses the thick segment between its two end points,
+        # otherwise it can only touch one of the rounded caps
+        d_offset = d + flip*r
+        ad = -d_offset
+        bd = d_x*n_x + d_y*n_y - d_offset
+        t = ad / (ad - bd)
+        distance = np.hypot(t*d_x - flip*n_x*r2, t*d_y - flip*n_y*r2)
+        caps = np.minimum(self._circle_query(a_x, a_y, d_x, d_y, s_a_x, s_a_y, s_r),
+                          self._circle_query(a_x, a_y, d_x, d_y, s_b_x, s_b_y, s_r))
+        hits = np.where(across, np.where(ad*bd < 0.0, distance, np.inf), caps)
+
+        # A ray starting inside a shape is reported at its full length by chipmunk
+        ab_x, ab_y = seg_ab[0, shape], seg_ab[1, shape]
+        along = np.clip(((a_x - s_a_x)*ab_x + (a_y - s_a_y)*ab_y) / seg_ab_len2[shape], 0.0, 1.0)
+        inside = np.hypot(a_x - s_a_x - along*ab_x, a_y - s_a_y - along*ab_y) <= r
+        hits[inside] = np.inf
+        return hits
@@ -0,0 +1,32 @@
+import numpy as np
+import pyglet
+
+class RayRenderer:
+    # Draws the sensor rays of the last read from a single vertex list that
+    # is refilled in place, the rays are not part of the physics space.
+    def __init__(self, batch=None):
+        self.batch = batch or pyglet.graphics.Batch()
+        self.vertex_list = None
+
+    def update(self, a, b, colors):
+        count = 2*len(a)
+        if self.vertex_list is None or self.vertex_list.get_size() != count:
+            if self.vertex_list is not None:
+                self.vertex_list.delete()
+            # Different usages keep the two attributes in separate, plain
+            # ctypes arrays that numpy can view
+            self.vertex_list = self.batch.add(count, pyglet.gl.GL_LINES, None, 'v2f/stream', 'c4B/static')
+            np.ctypeslib.as_array(self.vertex_list.colors).reshape(count, 4)[:] = np.repeat(colors, 2, axis=0)
+        # Reading .vertices marks the region for upload, the rays are then
+        # written straight into it
+        vertices = np.ctypeslib.as_array(self.vertex_list.vertices).reshape(len(a), 4)
+        vertices[:, 0:2] = a
+        vertices[:, 2:4] = b
+
+    def draw(self):
+        self.batch.draw()
+
+    def delete(self):
+        if self.vertex_list is not None:
+            self.vertex_list.delete()
+            self.vertex_list = None
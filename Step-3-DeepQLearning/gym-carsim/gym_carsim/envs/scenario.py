@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from gym import error
+
+# Bumped whenever the layout of the compiled files changes
+FORMAT_VERSION = 1
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scenarios')
+
+class Scenario:
+    # A compiled map: the static geometry and the pop sites are read-only
+    # arrays mapped from the cache, so every process using the same map
+    # shares the same pages.
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'scenario.json')) as f:
+            meta = json.load(f)
+        self.name       = meta['name']
+        self.key        = meta['key']
+        self.width      = meta['width']
+        self.height     = meta['height']
+        self.pop_spread = meta['pop_spread']
+        self.circles   = np.load(os.path.join(directory, 'circles.npy'),   mmap_mode='r')
+        self.segments  = np.load(os.path.join(directory, 'segments.npy'),  mmap_mode='r')
+        self.pop_sites = np.load(os.path.join(directory, 'pop_sites.npy'), mmap_mode='r')
+
+    def cached_array(self, name, build):
+        # Derived data (distance fields...) is built by the first process
+        # asking for it and stored next to the geometry for the others
+        path = os.path.join(self.directory, name + '.npy')
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, build())
+            os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+
+def cache_dir():
+    return os.environ.get('GYM_CARSIM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'gym_carsim'))
+
+def scenario_path(name):
+    # Either a path to a json file or the name of a bundled scenario
+    if os.path.isfile(name):
+        return name
+    path = os.path.join(SCENARIOS_DIR, name + '.json')
+    if not os.path.isfile(path):
+        raise error.Error("Unknown scenario: {}".format(name))
+    return path
+
+def load_scenario(scenario='default'):
+    if isinstance(scenario, Scenario):
+        return scenario
+    return Scenario(compile_scenario(scenario_path(scenario)))
+
+def compile_scenario(path):
+    # Compiles the json description once, keyed by its content, and returns
+    # the cache directory holding the arrays
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = hashlib.sha1(source + str(FORMAT_VERSION).encode()).hexdigest()
+    directory = os.path.join(cache_dir(), key)
+    if os.path.isdir(directory):
+        return directory
+
+    description = json.loads(source.decode())
+    circles = [tuple(circle) for circle in description.get('circles', [])]
+    for x, y, width, height, radius in description.get('four_legs', []):
+        circles += [(x, y, radius), (x, y + height, radius), (x + width, y, radius), (x + width, y + height, radius)]
+    segments = description.get('segments', [])
+    pop_sites = description['pop_sites']
+
+    os.makedirs(cache_dir(), exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(prefix=key + '.', dir=cache_dir())
+    np.save(os.path.join(tmp_directory, 'circles.npy'),   np.array(circles,   dtype=np.float64).reshape(-1, 3))
+    np.save(os.path.join(tmp_directory, 'segments.npy'),  np.array(segments,  dtype=np.float64).reshape(-1, 5))
+    np.save(os.path.join(tmp_directory, 'pop_sites.npy'), np.array(pop_sites, dtype=np.float64).reshape(-1, 2))
+    with open(os.path.join(tmp_directory, 'scenario.json'), 'w') as f:
+        json.dump({'name':       os.path.splitext(os.path.basename(path))[0],
+                   'key':        key,
+                   'width':      description['width'],
+                   'height':     description['height'],
+                   'pop_spread': int(description.get('pop_spread', 100))}, f)
+    # Another process may have compiled the same map in the meantime
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory)
+    return directory
+
+if __name__ == "__main__":
+    # Compiles a bank of maps ahead of the workers that will share it
+    for path in sys.argv[1:]:
+        print(path, compile_scenario(path))
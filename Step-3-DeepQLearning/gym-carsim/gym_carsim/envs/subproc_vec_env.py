@@ -0,0 +1,149 @@
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from gym import error, spaces
+from gym.utils import seeding
+
+def _shared_array(ctx, dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return raw, dtype, shape
+
+def _as_array(buffer):
+    raw, dtype, shape = buffer
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+def _worker(remote, parent_remote, index, env_kwargs, seed, buffers):
+    parent_remote.close()
+    from gym_carsim.envs.carsim_env import CarSimEnv
+    observations, rewards, dones, actions, terminals = [_as_array(buffer) for buffer in buffers]
+    try:
+        env = CarSimEnv(headless=True, **env_kwargs)
+        # Each worker draws its own pop sequence
+        env.seed(seed)
+        remote.send(None)
+        while True:
+            cmd = remote.recv()
+            if cmd == 'step':
+                obs, reward, done, _ = env.step(int(actions[index]))
+                if done:
+                    terminals[index] = obs
+                    obs = env.reset()
+                observations[index] = obs
+                rewards[index] = reward
+                dones[index] = done
+            elif cmd == 'reset':
+                observations[index] = env.reset()
+            elif cmd == 'close':
+                env.close()
+                remote.send(None)
+                break
+            remote.send(None)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        remote.send(traceback.format_exc())
+    finally:
+        remote.close()
+
+class CarSimSubprocVecEnv:
+    # K CarSimEnv, each one stepped in its own worker process. Actions,
+    # observations, rewards and done flags are exchanged through shared
+    # memory, the pipes only carry the commands.
+    def __init__(self, num_envs=None, env_kwargs=None, seed=None, start_method=None):
+        self.num_envs = num_envs or multiprocessing.cpu_count()
+        self.action_space = spaces.Discrete(3)
+        self.observation_space = spaces.Box(low=0.0, high=1.0, shape=(3,), dtype=np.float32)
+        self.waiting = False
+        self.closed = False
+
+        ctx = multiprocessing.get_context(start_method)
+        obs_shape = (self.num_envs,) + self.observation_space.shape
+        buffers = [_shared_array(ctx, np.float32, obs_shape),
+                   _shared_array(ctx, np.float64, (self.num_envs,)),
+                   _shared_array(ctx, np.bool_,   (self.num_envs,)),
+                   _shared_array(ctx, np.int64,   (self.num_envs,)),
+                   _shared_array(ctx, np.float32, obs_shape)]
+        self._observations, self._rewards, self._dones, self._actions, self._terminals = \
+            [_as_array(buffer) for buffer in buffers]
+
+        _, seed = seeding.np_random(seed)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_envs)])
+        self.processes = []
+        for index, (work_remote, remote) in enumerate(zip(work_remotes, self.remotes)):
+            args = (work_remote, remote, index, env_kwargs or {}, (seed + index) % 2**32, buffers)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+        self._wait_remotes()
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send('reset')
+        self._wait_remotes()
+        return self._observations.copy()
+
+    def step_async(self, actions):
+        if self.waiting:
+            raise error.Error("step_async called while a step is already running")
+        self._actions[:] = actions
+        for remote in self.remotes:
+            remote.send('step')
+        self.waiting = True
+
+    def step_wait(self):
+        self._wait_remotes()
+        self.waiting = False
+        dones = self._dones.copy()
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            infos[i]['terminal_observation'] = self._terminals[i].copy()
+        return self._observations.copy(), self._rewards.copy(), dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def render(self, mode='human'):
+        pass
+
+    def close(self, timeout=5.0):
+        # A worker that died already can not answer, it is only joined, and
+        # one that does not exit within `timeout` seconds is terminated
+        if self.closed:
+            return
+        self.closed = True
+        if self.waiting:
+            self._recv_all(self.remotes)
+            self.waiting = False
+        closing = []
+        for remote in self.remotes:
+            try:
+                remote.send('close')
+                closing.append(remote)
+            except (ConnectionError, EOFError):
+                pass
+        self._recv_all(closing)
+        for remote in self.remotes:
+            remote.close()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def _recv_all(self, remotes):
+        for remote in remotes:
+            try:
+                remote.recv()
+            except (ConnectionError, EOFError):
+                pass
+
+    def _wait_remotes(self):
+        errors = [remote.recv() for remote in self.remotes]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise error.Error("CarSimEnv worker failed:\n{}".format(errors[0]))
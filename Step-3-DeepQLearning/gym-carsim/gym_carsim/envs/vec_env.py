@@ -0,0 +1,195 @@
+import numpy as np
+
+from gym import error, spaces
+from gym.utils import seeding
+
+from gym_carsim.envs.carsim_env import (CAR_HEIGHT, CAR_STEERING_ANGLE, CAR_VELOCITY, CAR_WIDTH, SENSOR_FOV,
+                                        SENSOR_RANGE, SENSOR_SPREAD, SENSORS, ray_table)
+from gym_carsim.envs.raycast import RayCaster
+from gym_carsim.envs.scenario import load_scenario
+
+class CarSimVecEnv:
+    # N independent cars driving in the same static world. The cars do not
+    # see nor hit each other, their state is held in arrays and every step
+    # moves, crash-checks and senses all of them at once. `substeps` and
+    # `action_repeat` work like in CarSimEnv. The observations are a float32
+    # buffer reused by every step and reset, or copies of it with copy_obs.
+    def __init__(self, num_envs=256, dt=0.1, scenario='default', substeps=1, action_repeat=1, copy_obs=False):
+        self.num_envs = num_envs
+        self.scenario = load_scenario(scenario)
+        self.width  = self.scenario.width
+        self.height = self.scenario.height
+        self.dt = dt
+        if substeps < 1 or action_repeat < 1:
+            raise error.Error("substeps and action_repeat must be at least 1")
+        self.substeps = substeps
+        self.action_repeat = action_repeat
+        self.copy_obs = copy_obs
+
+        self.action_space = spaces.Discrete(3)
+        self.observation_space = spaces.Box(low=0.0, high=1.0, shape=(3,), dtype=np.float32)
+        self.seed()
+
+        self.ray_caster = RayCaster(self.scenario.circles, self.scenario.segments)
+        self._ray_origins, self._ray_angles, self._ray_ranges, counts = ray_table(
+            [(offset, angle, SENSOR_FOV, SENSOR_SPREAD, SENSOR_RANGE) for offset, angle, _ in SENSORS])
+
+        self.positions  = np.zeros((num_envs, 2))
+        self.angles     = np.zeros(num_envs)
+        self.velocities = np.zeros((num_envs, 2))
+        self.is_crashed = np.zeros(num_envs, dtype=bool)
+
+        self._sensor_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        self.observations = np.zeros((num_envs, len(self._sensor_starts)), dtype=np.float32)
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        self._pop_random = np.random.default_rng(seed)
+        return [seed]
+
+    def reset(self):
+        self._reset_cars(np.arange(self.num_envs))
+        self._read_sensors()
+        return self.observations.copy() if self.copy_obs else self.observations
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        turn_left  = actions == 0
+        turn_right = actions == 1
+        frame_rewards = np.where(turn_left | turn_right, -1.0, 1.0)
+        rewards = np.zeros(self.num_envs)
+        # Cars still driving in this step, a crash ends it for its car only
+        active = np.ones(self.num_envs, dtype=bool)
+        for _ in range(self.action_repeat):
+            self.angles[turn_left & active]  += CAR_STEERING_ANGLE
+            self.angles[turn_right & active] -= CAR_STEERING_ANGLE
+            self.velocities[active, 0] = -CAR_VELOCITY*np.sin(self.angles[active])
+            self.velocities[active, 1] =  CAR_VELOCITY*np.cos(self.angles[active])
+            self._move(active)
+            rewards[active] += np.where(self.is_crashed[active], -500.0, frame_rewards[active])
+            active &= ~self.is_crashed
+            if not active.any():
+                break
+
+        self._read_sensors()
+        observations = self.observations
+        dones = self.is_crashed.copy()
+        infos = [{} for _ in range(self.num_envs)]
+
+        # Crashed cars start a new episode right away, the last observation
+        # of the ended one is handed back in the info dict
+        crashed = np.flatnonzero(dones)
+        if len(crashed):
+            for i in crashed:
+                infos[i]['terminal_observation'] = observations[i].copy()
+            self._reset_cars(crashed)
+            self._read_sensors(crashed)
+        if self.copy_obs:
+            observations = observations.copy()
+        return observations, rewards, dones, infos
+
+    def render(self, mode='human'):
+        pass
+
+    def close(self):
+        pass
+
+    def _reset_cars(self, idx):
+        # Same draw as CarSimEnv._random_pop, then the single reset step
+        # taken with the unrotated starting velocity
+        sites = self.scenario.pop_sites
+        spread = self.scenario.pop_spread
+        pop = sites[self._pop_random.integers(0, len(sites), size=len(idx))]
+        pop += self._pop_random.integers(-spread, spread, size=(len(idx), 2))
+        self.angles[idx] = self._pop_random.integers(-31456, 31456, size=len(idx)) / 10000.0
+        self.velocities[idx] = (0.0, CAR_VELOCITY)
+        self.positions[idx] = pop
+        self.is_crashed[idx] = False
+        moving = np.zeros(self.num_envs, dtype=bool)
+        moving[idx] = True
+        self._move(moving)
+
+    def _move(self, moving):
+        # Drives the `moving` cars for dt in substeps, each car stops on its
+        # first crash
+        dt = self.dt / self.substeps
+        moving = moving.copy()
+        for _ in range(self.substeps):
+            idx = np.flatnonzero(moving)
+            if not len(idx):
+                break
+            self.positions[idx] += self.velocities[idx]*dt
+            self.is_crashed[idx] |= self._collide(self.positions[idx], self.angles[idx])
+            moving[idx] = ~self.is_crashed[idx]
+
+    def _read_sensors(self, idx=None):
+        # Writes the sensors of the cars `idx`, all of them by default, into
+        # self.observations
+        full = idx is None
+        if full:
+            idx = slice(None)
+        x, y = self.positions[idx, 0, None], self.positions[idx, 1, None]
+        angles = self.angles[idx, None]
+        cos, sin = np.cos(angles), np.sin(angles)
+        o_x, o_y = self._ray_origins[:, 0], self._ray_origins[:, 1]
+        ranges = self._ray_ranges
+        a_x = x + o_x*cos - o_y*sin
+        a_y = y + o_x*sin + o_y*cos
+        ray_angles = angles + self._ray_angles
+        b_x = a_x - ranges*np.sin(ray_angles)
+        b_y = a_y + ranges*np.cos(ray_angles)
+        a = np.stack([a_x.ravel(), a_y.ravel()], axis=1)
+        b = np.stack([b_x.ravel(), b_y.ravel()], axis=1)
+        distances = self.ray_caster.cast(a, b).reshape(a_x.shape) / ranges
+        if full:
+            np.minimum.reduceat(distances, self._sensor_starts, axis=1, out=self.observations)
+        else:
+            self.observations[idx] = np.minimum.reduceat(distances, self._sensor_starts, axis=1)
+
+    def _collide(self, positions, angles):
+        # Overlap of every car box with the static circles and thick segments,
+        # tested in the frame of each car
+        half_w, half_h = CAR_WIDTH/2.0, CAR_HEIGHT/2.0
+        cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+
+        def to_car(points):
+            r_x = points[:, 0] - positions[:, 0, None]
+            r_y = points[:, 1] - positions[:, 1, None]
+            return r_x*cos + r_y*sin, -r_x*sin + r_y*cos
+
+        def box_distance(p_x, p_y):
+            return np.hypot(np.maximum(np.abs(p_x) - half_w, 0.0), np.maximum(np.abs(p_y) - half_h, 0.0))
+
+        circles = self.ray_caster.circles
+        c_x, c_y = to_car(circles[:, 0:2])
+        crashed = np.any(box_distance(c_x, c_y) < circles[:, 2], axis=1)
+
+        segments = self.ray_caster.segments
+        if len(segments):
+            a_x, a_y = to_car(segments[:, 0:2])
+            b_x, b_y = to_car(segments[:, 2:4])
+            distance = np.minimum(box_distance(a_x, a_y), box_distance(b_x, b_y))
+            for corner_x, corner_y in ((-half_w, -half_h), (-half_w, half_h), (half_w, -half_h), (half_w, half_h)):
+                distance = np.minimum(distance, _point_segment_distance(corner_x, corner_y, a_x, a_y, b_x, b_y))
+            distance[_segment_crosses_box(a_x, a_y, b_x, b_y, half_w, half_h)] = 0.0
+            crashed |= np.any(distance < segments[:, 4], axis=1)
+        return crashed
+
+def _point_segment_distance(p_x, p_y, a_x, a_y, b_x, b_y):
+    ab_x, ab_y = b_x - a_x, b_y - a_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((p_x - a_x)*ab_x + (p_y - a_y)*ab_y) / (ab_x*ab_x + ab_y*ab_y)
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    return np.hypot(p_x - a_x - t*ab_x, p_y - a_y - t*ab_y)
+
+def _segment_crosses_box(a_x, a_y, b_x, b_y, half_w, half_h):
+    # Liang-Barsky clipping of the segments against the centered box
+    t_min = np.zeros(a_x.shape)
+    t_max = np.ones(a_x.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for a, d, half in ((a_x, b_x - a_x, half_w), (a_y, b_y - a_y, half_h)):
+            t_1 = (-half - a) / d
+            t_2 = ( half - a) / d
+            t_min = np.fmax(t_min, np.fmin(t_1, t_2))
+            t_max = np.fmin(t_max, np.fmax(t_1, t_2))
+    return t_min <= t_max
@@ -1,6 +1,9 @@
-from setuptools import setup
+from setuptools import setup, find_packages
 
 setup(name='gym_carsim',
       version='0.0.1',
-      install_requires=['gym']  # And any other dependencies foo needs
-)
\ No newline at end of file
+      packages=find_packages(),
+      # The bundled scenarios, CarSimEnv() loads scenarios/default.json
+      package_data={'gym_carsim': ['scenarios/*.json']},
+      install_requires=['gym', 'dqncar_common']  # And any other dependencies foo needs
+)
@@ -1,73 +1,127 @@
+import argparse
+import os
+
 import numpy as np
 import gym
 import gym_carsim
-from gym import spaces
 
 from keras.models import Sequential
 from keras.layers import Dense, Activation, Flatten
 from keras.optimizers import Adam
 
-from rl.agents.dqn import DQNAgent
 from rl.policy import BoltzmannQPolicy
-from rl.memory import SequentialMemory
+
+from dqncar_common.transition_log import TransitionRecorder
+from dqncar_common.checkpoint import Checkpoint
+from dqncar_common.memory import NumpyMemory, NumpyDQNAgent
+from dqncar_common.numpy_policy import NumpyAgent, QNetwork
+from wrappers import WrapThreeFrames
 
 ENV_NAME = 'carsim-v0'
 
-class WrapThreeFrames(gym.Wrapper):
-    def __init__(self, env):
-        gym.ObservationWrapper.__init__(self, env)
-        self.observation_space = spaces.Box(low=0.0, high=1.0, shape=(9,))
-        self.past_obs = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
-
-    def shift_past_obs(self, new_obs):
-        self.past_obs = self.past_obs[3:]+new_obs
-        return self.past_obs
-
-    def reset(self):
-        obs = self.env.reset()
-        return self.shift_past_obs(obs)
-
-    def step(self, action):
-        obs, reward, done, info = self.env.step(action)
-        return self.shift_past_obs(obs), reward, done, info
-
-# Get the environment and extract the number of actions.
-env = gym.make(ENV_NAME)
-env = WrapThreeFrames(env)
-np.random.seed(98283476)
-env.seed(87518645)
-nb_actions = env.action_space.n
-
-# Next, we build a very simple model regardless of the dueling architecture
-# if you enable dueling network in DQN , DQN will build a dueling network base on your model automatically
-# Also, you can build a dueling network by yourself and turn off the dueling network in DQN.
-model = Sequential()
-model.add(Flatten(input_shape=(1,) + env.observation_space.shape))
-model.add(Dense(16))
-model.add(Activation('relu'))
-model.add(Dense(16))
-model.add(Activation('relu'))
-model.add(Dense(nb_actions, activation='sigmoid'))
-print(model.summary())
-
-# Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
-# even the metrics!
-memory = SequentialMemory(limit=50000, window_length=1)
-policy = BoltzmannQPolicy()
-# enable the dueling network
-# you can specify the dueling_type to one of {'avg','max','naive'}
-dqn = DQNAgent(model=model, nb_actions=nb_actions, memory=memory, nb_steps_warmup=100,
-               enable_dueling_network=True, dueling_type='avg', target_model_update=1e-2, policy=policy)
-dqn.compile(Adam(lr=1e-3), metrics=['mae'])
-
-# Okay, now it's time to learn something! We visualize the training here for show, but this
-# slows down training quite a lot. You can always safely abort the training prematurely using
-# Ctrl + C.
-dqn.fit(env, nb_steps=50000, visualize=False, verbose=2)
-
-# After training is done, we save the final weights.
-dqn.save_weights('duel_dqn_{}_weights.h5f'.format(ENV_NAME), overwrite=True)
-#dqn.load_weights('duel_dqn_{}_weights.h5f'.format(ENV_NAME))
-
-# Finally, evaluate our algorithm for 5 episodes.
-print(dqn.test(env, nb_episodes=5, nb_max_episode_steps=10000, visualize=True))
\ No newline at end of file
+# Hyperparameters of a training run, sweep.py overrides them job by job
+CONFIG = {
+    'hidden': [16, 16],           # width of the relu layers
+    'nb_steps': 50000,
+    'nb_steps_warmup': 100,
+    'target_model_update': 1e-2,
+    'lr': 1e-3,
+    'dueling_type': 'avg',        # one of 'avg', 'max', 'naive', None turns the dueling network off
+    'memory_limit': 50000,
+    'seed': 98283476,
+    'env_seed': 87518645,
+}
+
+def make_env(seed, headless=False, transitions=None):
+    # Get the environment, every transition goes to the log `transitions` if given
+    env = gym.make(ENV_NAME, headless=headless)
+    if transitions:
+        env = TransitionRecorder(env, transitions, metadata={'env': ENV_NAME})
+    env = WrapThreeFrames(env)
+    env.seed(seed)
+    return env
+
+def build_agent(env, config, verbose=True, agent_class=NumpyDQNAgent):
+    nb_actions = env.action_space.n
+
+    # Next, we build a very simple model regardless of the dueling architecture
+    # if you enable dueling network in DQN , DQN will build a dueling network base on your model automatically
+    # Also, you can build a dueling network by yourself and turn off the dueling network in DQN.
+    model = Sequential()
+    model.add(Flatten(input_shape=(1,) + env.observation_space.shape))
+    for width in config['hidden']:
+        model.add(Dense(width))
+        model.add(Activation('relu'))
+    model.add(Dense(nb_actions, activation='sigmoid'))
+    if verbose:
+        print(model.summary())
+
+    # Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
+    # even the metrics!
+    # Same experiences as keras-rl's SequentialMemory out of numpy ring buffers, that
+    # NumpyDQNAgent samples a batch of arrays at a time. For prioritized replay use
+    # NumpyMemory(..., prioritized=True)
+    memory = NumpyMemory(limit=config['memory_limit'], window_length=1)
+    policy = BoltzmannQPolicy()
+    # enable the dueling network
+    # you can specify the dueling_type to one of {'avg','max','naive'}
+    dueling_type = config['dueling_type']
+    dqn = agent_class(model=model, nb_actions=nb_actions, memory=memory, nb_steps_warmup=config['nb_steps_warmup'],
+                      enable_dueling_network=dueling_type is not None, dueling_type=dueling_type or 'avg',
+                      target_model_update=config['target_model_update'], policy=policy)
+    dqn.compile(Adam(lr=config['lr']), metrics=['mae'])
+    return dqn
+
+def train(config, directory='.', headless=False, transitions=None, resume=False, checkpoint_interval=5000, keep=3,
+          callbacks=(), verbose=2):
+    # Trains an agent with `config` and returns it with its env and the
+    # keras-rl History of fit(). Checkpoints go to `directory`, every
+    # transition to the log `transitions` if given
+    np.random.seed(config['seed'])
+    env = make_env(config['env_seed'], headless=headless, transitions=transitions)
+    dqn = build_agent(env, config, verbose=verbose > 0)
+
+    # Weights, optimizer state, replay memory and counters are saved in the
+    # background every checkpoint_interval steps, resume picks the last one up
+    checkpoint = Checkpoint(os.path.join(directory, 'checkpoints_{}'.format(ENV_NAME)), interval=checkpoint_interval, keep=keep)
+    if resume:
+        step = checkpoint.resume(dqn)
+        if verbose:
+            print('Resuming from step {}'.format(step) if step is not None else 'No checkpoint to resume from')
+
+    # Okay, now it's time to learn something! We visualize the training here for show, but this
+    # slows down training quite a lot. You can always safely abort the training prematurely using
+    # Ctrl + C.
+    history = dqn.fit(env, nb_steps=config['nb_steps'], visualize=False, verbose=verbose,
+                      callbacks=[checkpoint] + list(callbacks))
+    return dqn, env, history
+
+def evaluate(dqn, env, nb_episodes=5, visualize=True, verbose=1):
+    # Evaluate our algorithm, acting with a numpy copy of the network instead
+    # of a Keras predict() per step
+    dueling_type = dqn.dueling_type if dqn.enable_dueling_network else None
+    agent = NumpyAgent(QNetwork.from_weights(dqn.model.get_weights(), dueling_type=dueling_type))
+    return agent.test(env, nb_episodes=nb_episodes, nb_max_episode_steps=10000, visualize=visualize, verbose=verbose)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help="start from the last checkpoint of checkpoints_<env>")
+    parser.add_argument('--checkpoint-interval', type=int, default=5000, help="steps between two checkpoints")
+    parser.add_argument('--keep', type=int, default=3, help="checkpoints kept on disk")
+    parser.add_argument('--transitions', metavar='PATH', help="log every transition to this directory")
+    args = parser.parse_args()
+
+    dqn, env, _ = train(CONFIG, transitions=args.transitions, resume=args.resume,
+                        checkpoint_interval=args.checkpoint_interval, keep=args.keep)
+
+    # After training is done, we save the final weights.
+    dqn.save_weights('duel_dqn_{}_weights.h5f'.format(ENV_NAME), overwrite=True)
+    dqn.memory.save('duel_dqn_{}_memory.npz'.format(ENV_NAME))
+    #dqn.load_weights('duel_dqn_{}_weights.h5f'.format(ENV_NAME))
+
+    # Finally, evaluate our algorithm for 5 episodes.
+    print(evaluate(dqn, env, nb_episodes=5))
+    env.close()
+
+if __name__ == "__main__":
+    main()
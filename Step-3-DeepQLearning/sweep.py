@@ -0,0 +1,213 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+# Runs the training of main.py once per job of a sweep, headless, in a pool
+# of processes. The spec is a json file overriding main.CONFIG:
+#
+#   {"grid": {"lr": [1e-3, 5e-4], "hidden": [[16, 16], [32, 32]]},
+#    "base": {"nb_steps": 20000}, "repeats": 2, "seed": 1}
+#
+# runs every combination of the grid, "repeats" times each with another seed.
+# With "random" instead of "grid", "samples" jobs draw each value from its
+# list or from {"uniform": [low, high]}, {"log_uniform": [low, high]} or
+# {"int": [low, high]}.
+#
+# Each job works in <sweep>/job-NNNN: its config, the curve.csv of its
+# episodes, its checkpoints and, once done, result.json. Running the same
+# sweep again skips the finished jobs and resumes the others from their last
+# checkpoint. The sweep ends by gathering results.csv (one row per job with
+# its final test scores) and curves.csv (every episode of every job).
+
+def _draw(rng, values):
+    if isinstance(values, list):
+        return values[rng.randint(len(values))]
+    (kind, (low, high)), = values.items()
+    if kind == 'uniform':
+        return float(rng.uniform(low, high))
+    if kind == 'log_uniform':
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+    if kind == 'int':
+        return int(rng.randint(low, high + 1))
+    raise ValueError("Unknown distribution: {}".format(kind))
+
+def expand(spec):
+    # [(job name, seed, parameters)] of a spec
+    rng = np.random.RandomState(spec.get('seed', 0))
+    if 'grid' in spec:
+        names = sorted(spec['grid'])
+        points = [dict(zip(names, values)) for values in itertools.product(*(spec['grid'][name] for name in names))]
+    elif 'random' in spec:
+        names = sorted(spec['random'])
+        points = [{name: _draw(rng, spec['random'][name]) for name in names} for _ in range(spec['samples'])]
+    else:
+        raise ValueError("The spec needs a 'grid' or a 'random' search")
+    jobs = []
+    for point in points:
+        for _ in range(spec.get('repeats', 1)):
+            params = dict(spec.get('base', {}), **point)
+            jobs.append(('job-{:04d}'.format(len(jobs)), int(rng.randint(2**31 - 1)), params))
+    return jobs
+
+def _write_json(path, value):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _init_worker(threads):
+    # Before Keras gets imported, one pool process per core is enough
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+
+def run_job(job):
+    name, seed, params, directory, options = job
+    try:
+        import main
+        from rl.callbacks import Callback
+    except ImportError:
+        return {'job': name, 'error': traceback.format_exc()}
+
+    class Curve(Callback):
+        # Appends one row per episode to curve.csv. A resumed job first drops
+        # the episodes past its checkpoint, they get played again
+        def __init__(self, path):
+            super(Curve, self).__init__()
+            self.path = path
+            self.file = None
+
+        def on_episode_begin(self, episode, logs={}):
+            if self.file is not None:
+                return
+            rows = []
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    rows = [row for row in csv.DictReader(f) if int(row['step']) <= self.model.step]
+            self.episode = len(rows)
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, ['episode', 'step', 'episode_reward', 'nb_episode_steps'])
+            self.writer.writeheader()
+            self.writer.writerows(rows)
+
+        def on_episode_end(self, episode, logs={}):
+            self.writer.writerow({'episode': self.episode, 'step': logs['nb_steps'],
+                                  'episode_reward': logs['episode_reward'], 'nb_episode_steps': logs['nb_episode_steps']})
+            self.file.flush()
+            self.episode += 1
+
+        def on_train_end(self, logs={}):
+            if self.file is not None:
+                self.file.close()
+
+    config = dict(main.CONFIG, **params)
+    config['seed'], config['env_seed'] = seed, seed + 1
+    _write_json(os.path.join(directory, 'config.json'), config)
+    started = time.time()
+    try:
+        dqn, env, _ = main.train(config, directory, headless=True, resume=True,
+                                 checkpoint_interval=options['checkpoint_interval'], keep=1,
+                                 callbacks=[Curve(os.path.join(directory, 'curve.csv'))], verbose=0)
+        test = main.evaluate(dqn, env, nb_episodes=options['test_episodes'], visualize=False, verbose=0)
+        env.close()
+    except Exception:
+        return {'job': name, 'error': traceback.format_exc()}
+    rewards = test['episode_reward']
+    result = {'job': name, 'seed': seed, 'duration': time.time() - started,
+              'test_reward_mean': float(np.mean(rewards)), 'test_reward_std': float(np.std(rewards)),
+              'test_steps_mean': float(np.mean(test['nb_steps'])), 'test_rewards': rewards}
+    _write_json(os.path.join(directory, 'result.json'), result)
+    return result
+
+def gather(directory, jobs):
+    # results.csv and curves.csv out of the finished jobs
+    params = sorted({key for _, _, p in jobs for key in p})
+    results, curves = [], []
+    for name, seed, p in jobs:
+        job_dir = os.path.join(directory, name)
+        if not os.path.exists(os.path.join(job_dir, 'result.json')):
+            continue
+        with open(os.path.join(job_dir, 'result.json')) as f:
+            result = json.load(f)
+        with open(os.path.join(job_dir, 'curve.csv')) as f:
+            curve = list(csv.DictReader(f))
+        last = [float(row['episode_reward']) for row in curve[-10:]]
+        row = {'job': name, 'seed': seed}
+        row.update({key: json.dumps(p[key]) if key in p else '' for key in params})
+        row.update({'episodes': len(curve), 'train_reward_last10': float(np.mean(last)) if last else '',
+                    'test_reward_mean': result['test_reward_mean'], 'test_reward_std': result['test_reward_std'],
+                    'test_steps_mean': result['test_steps_mean'], 'duration': round(result['duration'], 1)})
+        results.append(row)
+        curves.extend(dict(job=name, **episode) for episode in curve)
+    if results:
+        with open(os.path.join(directory, 'results.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        with open(os.path.join(directory, 'curves.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['job', 'episode', 'step', 'episode_reward', 'nb_episode_steps'])
+            writer.writeheader()
+            writer.writerows(curves)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Train main.py's DQN over a grid or random search of its CONFIG")
+    parser.add_argument('spec', help="json file of the search, see the top of sweep.py")
+    parser.add_argument('--directory', default='sweep', help="where the jobs and the tables go, run again to resume")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="jobs run at once")
+    parser.add_argument('--threads', type=int, default=1, help="BLAS threads of each job")
+    parser.add_argument('--test-episodes', type=int, default=5, help="greedy episodes scoring each trained job")
+    parser.add_argument('--checkpoint-interval', type=int, default=5000, help="steps between two checkpoints of a job")
+    parser.add_argument('--start-method', default='spawn', help="multiprocessing start method")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        jobs = expand(json.load(f))
+    os.makedirs(args.directory, exist_ok=True)
+    listing = os.path.join(args.directory, 'jobs.json')
+    if os.path.exists(listing):
+        with open(listing) as f:
+            if [list(job) for job in jobs] != json.load(f):
+                parser.error("{} holds another sweep, use another --directory".format(args.directory))
+    else:
+        _write_json(listing, jobs)
+
+    params = sorted({key for _, _, p in jobs for key in p})
+    options = {'test_episodes': args.test_episodes, 'checkpoint_interval': args.checkpoint_interval}
+    pending = []
+    for name, seed, point in jobs:
+        job_dir = os.path.join(args.directory, name)
+        if os.path.exists(os.path.join(job_dir, 'result.json')):
+            continue
+        os.makedirs(job_dir, exist_ok=True)
+        pending.append((name, seed, point, job_dir, options))
+    print('{} jobs, {} left, {} processes'.format(len(jobs), len(pending), args.processes))
+
+    # A fresh process per job, Keras keeps every model it built in memory
+    ctx = multiprocessing.get_context(args.start_method)
+    failed = 0
+    with ctx.Pool(min(args.processes, len(pending)) or 1, _init_worker, (args.threads,), maxtasksperchild=1) as pool:
+        for i, result in enumerate(pool.imap_unordered(run_job, pending)):
+            if 'error' in result:
+                failed += 1
+                print('[{}/{}] {} failed:\n{}'.format(i + 1, len(pending), result['job'], result['error']))
+            else:
+                print('[{}/{}] {} test reward {:.3f} +/- {:.3f} in {:.0f}s'.format(i + 1, len(pending), result['job'],
+                      result['test_reward_mean'], result['test_reward_std'], result['duration']))
+
+    results = gather(args.directory, jobs)
+    print('Best jobs, all of them in {}:'.format(os.path.join(args.directory, 'results.csv')))
+    for row in sorted(results, key=lambda row: -row['test_reward_mean'])[:5]:
+        print('{job} test reward {test_reward_mean:.3f} +/- {test_reward_std:.3f}'.format(**row),
+              ' '.join('{}={}'.format(name, row[name]) for name in params))
+    if failed:
+        raise SystemExit('{} jobs failed, run the sweep again to retry them'.format(failed))
+
+if __name__ == "__main__":
+    main()
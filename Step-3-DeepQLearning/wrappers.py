@@ -0,0 +1,61 @@
+import numpy as np
+from gym import spaces
+
+# FrameStack is shared with the car side, the vector version stays here
+from dqncar_common.wrappers import FrameStack
+
+class WrapThreeFrames(FrameStack):
+    # The last 3 observations, starting from "nothing in sight"
+    def __init__(self, env):
+        super(WrapThreeFrames, self).__init__(env, 3, fill=1.0)
+
+class VecFrameStack:
+    # FrameStack for the vector envs (CarSimVecEnv, CarSimSubprocVecEnv):
+    # one ring per env, an env that got done starts its history over with
+    # the first observation of its new episode and the stacked last frames
+    # of the ended one go to info['terminal_observation']
+    def __init__(self, venv, k=3, fill=None):
+        self.venv = venv
+        self.k = k
+        self.fill = fill
+        self.num_envs = venv.num_envs
+        self.action_space = venv.action_space
+        space = venv.observation_space
+        self.observation_space = spaces.Box(low=np.tile(space.low, k), high=np.tile(space.high, k), dtype=np.float32)
+        self.frames = np.empty((self.num_envs, 2*k) + space.shape, dtype=np.float32)
+        self.head = 0
+        self._views = [self.frames[:, h:h+k].reshape(self.num_envs, -1) for h in range(k)]
+
+    def __getattr__(self, name):
+        return getattr(self.venv, name)
+
+    def reset(self):
+        observations = self.venv.reset()
+        self.frames[:] = observations[:, None] if self.fill is None else self.fill
+        self.head = 0
+        return self._push(observations, None)
+
+    def step(self, actions):
+        return self._observe(*self.venv.step(actions))
+
+    def step_async(self, actions):
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        return self._observe(*self.venv.step_wait())
+
+    def _observe(self, observations, rewards, dones, infos):
+        return self._push(observations, dones, infos), rewards, dones, infos
+
+    def _push(self, observations, dones, infos=None):
+        k, head = self.k, self.head
+        if dones is not None and dones.any():
+            for i in np.flatnonzero(dones):
+                if 'terminal_observation' in infos[i]:
+                    last = self.frames[i, head+1:head+k].reshape(-1)
+                    infos[i]['terminal_observation'] = np.concatenate([last, infos[i]['terminal_observation']]).astype(np.float32)
+            self.frames[dones] = observations[dones][:, None] if self.fill is None else self.fill
+        self.frames[:, head] = observations
+        self.frames[:, head + k] = observations
+        self.head = (head + 1) % k
+        return self._views[self.head]
@@ -0,0 +1,365 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from dqncar_common.numpy_policy import QNetwork
+
+# Fixed-point export of the Q-network for the car. Weights are int8 and
+# biases int32, activations int16, each with a power of two scale per
+# layer so that the ATmega only multiplies and shifts:
+#
+#   acc = bias + sum(x * w)                     int32, scale 2^(in_frac + w_frac)
+#   y   = saturate16((acc + 2^(s-1)) >> s)      s = in_frac + w_frac - out_frac
+#
+# The scale of each activation comes from its largest value over a set of
+# calibration observations. QuantizedNetwork computes exactly what the code
+# of the generated header computes on the car, bit for bit.
+
+INPUT_FRAC = 14                 # measures in [0, 1] as int16
+INT16_MAX = 32767
+INT32_MAX = 2**31 - 1
+DUELING_TYPES = {None: 0, 'avg': 1, 'max': 2, 'naive': 3}
+AVR_HZ = 16e6
+AVR_CYCLES_PER_MAC = 24         # int16 x int8 into int32 plus the flash read, avr-gcc -Os
+
+def quantize_inputs(observations):
+    # (int16_t)(measure * 2^INPUT_FRAC + 0.5f) in single precision, like
+    # dqn_input() on the car
+    scaled = np.asarray(observations, dtype=np.float32) * np.float32(1 << INPUT_FRAC) + np.float32(0.5)
+    return np.trunc(scaled).astype(np.int64)
+
+def _frac_bits(largest, limit, most):
+    # Fractional bits fitting `largest` under `limit`
+    if largest <= 0.0:
+        return most
+    return int(min(most, np.floor(np.log2(limit / largest))))
+
+def _c_division(a, b):
+    # C truncates towards zero where numpy floors
+    return np.sign(a) * (np.abs(a) // b)
+
+class QuantizedNetwork:
+    def __init__(self, network, observations, headroom=2.0):
+        for activation in network.activations:
+            if activation not in ('relu', 'linear'):
+                raise ValueError("Only relu and linear layers can be exported, not {}".format(activation))
+        self.network = network
+        self.dueling_type = network.dueling_type
+        self.nb_actions = network.nb_actions
+        self.input_size = network.input_size
+        self.headroom = headroom
+
+        # Float activations of every layer over the calibration set
+        x = np.asarray(observations, dtype=np.float64).reshape(-1, self.input_size)
+        largest = []
+        for kernel, bias, activation in zip(network.kernels, network.biases, network.activations):
+            x = x.dot(kernel) + bias
+            if activation == 'relu':
+                x = np.maximum(x, 0.0)
+            largest.append(np.abs(x).max())
+
+        self.layers = []
+        in_frac = INPUT_FRAC
+        for kernel, bias, activation, top in zip(network.kernels, network.biases, network.activations, largest):
+            w_frac = _frac_bits(np.abs(kernel).max(), 127.0, 24)
+            out_frac = _frac_bits(top * headroom, INT16_MAX, in_frac + w_frac)
+            weights = np.clip(np.round(kernel.T * 2.0**w_frac), -127, 127).astype(np.int64)
+            biases = np.round(np.asarray(bias, dtype=np.float64) * 2.0**(in_frac + w_frac))
+            if np.abs(biases).max() > INT32_MAX:
+                raise ValueError("The biases do not fit in int32 at 2^{}".format(in_frac + w_frac))
+            self.layers.append({
+                'weights': weights,
+                'biases': biases.astype(np.int64),
+                'shift': in_frac + w_frac - out_frac,
+                'relu': activation == 'relu',
+                'w_frac': w_frac,
+                'out_frac': out_frac,
+            })
+            in_frac = out_frac
+        self.output_frac = in_frac
+        self.overflows = 0
+        self.saturations = 0
+
+    def forward(self, inputs):
+        # int16 outputs of the last layer for quantized inputs (n, input_size)
+        x = np.asarray(inputs, dtype=np.int64)
+        for layer in self.layers:
+            acc = x.dot(layer['weights'].T) + layer['biases']
+            shift = layer['shift']
+            if shift > 0:
+                acc = acc + (1 << (shift - 1))
+            self.overflows += int((np.abs(acc) > INT32_MAX).sum())
+            acc = acc >> shift
+            self.saturations += int(((acc > INT16_MAX) | (acc < -INT16_MAX - 1)).sum())
+            x = np.clip(acc, -INT16_MAX - 1, INT16_MAX)
+            if layer['relu']:
+                x = np.maximum(x, 0)
+        return x
+
+    def q_values(self, inputs):
+        # int32 Q-values at 2^output_frac, the dueling head combined like dqn_act()
+        out = self.forward(inputs)
+        if not self.dueling_type:
+            return out
+        value, advantages = out[:, :1], out[:, 1:]
+        if self.dueling_type == 'avg':
+            advantages = advantages - _c_division(advantages.sum(axis=1, keepdims=True), self.nb_actions)
+        elif self.dueling_type == 'max':
+            advantages = advantages - advantages.max(axis=1, keepdims=True)
+        return value + advantages
+
+    def predict(self, observations):
+        return self.q_values(quantize_inputs(observations).reshape(-1, self.input_size)) / 2.0**self.output_frac
+
+    def act(self, observations):
+        return np.argmax(self.q_values(quantize_inputs(observations).reshape(-1, self.input_size)), axis=1)
+
+    @property
+    def macs(self):
+        return sum(layer['weights'].size for layer in self.layers)
+
+    @property
+    def flash_bytes(self):
+        return sum(layer['weights'].size + 4*len(layer['biases']) for layer in self.layers)
+
+    def header(self, source=''):
+        units = max(len(layer['biases']) for layer in self.layers)
+        lines = [
+            '// Generated by export_arduino.py{}, do not edit.'.format(' from ' + source if source else ''),
+            '// {} MACs, {} bytes of flash, activations at 2^-{} on the output.'.format(
+                self.macs, self.flash_bytes, self.output_frac),
+            '#ifndef DQN_MODEL_H',
+            '#define DQN_MODEL_H',
+            '',
+            '#include <stdint.h>',
+            '#ifdef __AVR__',
+            '#include <avr/pgmspace.h>',
+            '#else',
+            '// Plain memory reads to check the model on a PC',
+            '#define PROGMEM',
+            '#define pgm_read_byte(p)  (*(const uint8_t *)(p))',
+            '#define pgm_read_dword(p) (*(const uint32_t *)(p))',
+            '#endif',
+            '',
+            '#define DQN_INPUTS      {}'.format(self.input_size),
+            '#define DQN_ACTIONS     {}'.format(self.nb_actions),
+            '#define DQN_INPUT_FRAC  {}'.format(INPUT_FRAC),
+            '#define DQN_OUTPUT_FRAC {}'.format(self.output_frac),
+            '#define DQN_DUELING     {}   // 0 none, 1 avg, 2 max, 3 naive'.format(DUELING_TYPES[self.dueling_type]),
+            '#define DQN_MAX_UNITS   {}'.format(units),
+            '',
+        ]
+        for i, layer in enumerate(self.layers):
+            n_out, n_in = layer['weights'].shape
+            lines.append('// Layer {}: {} -> {}, weights at 2^-{}{}'.format(
+                i, n_in, n_out, layer['w_frac'], ', relu' if layer['relu'] else ''))
+            lines.append('static const int8_t dqn_weights_{}[{}] PROGMEM = {{'.format(i, n_out*n_in))
+            for row in layer['weights']:
+                lines.append('  ' + ', '.join(str(v) for v in row) + ',')
+            lines.append('};')
+            lines.append('static const int32_t dqn_biases_{}[{}] PROGMEM = {{'.format(i, n_out))
+            lines.append('  ' + ', '.join('{}L'.format(v) for v in layer['biases']) + ',')
+            lines.append('};')
+            lines.append('')
+
+        lines += [
+            '// A measure in [0, 1] as an input of the network',
+            'static inline int16_t dqn_input(float measure) {',
+            '  return (int16_t)(measure * (float)(1L << DQN_INPUT_FRAC) + 0.5f);',
+            '}',
+            '',
+            'static void dqn_layer(const int16_t *x, int16_t *y, const int8_t *w, const int32_t *b,',
+            '                      uint8_t n_in, uint8_t n_out, uint8_t shift, uint8_t relu) {',
+            '  for(uint8_t o = 0; o < n_out; o++) {',
+            '    int32_t acc = (int32_t)pgm_read_dword(&b[o]);',
+            '    const int8_t *row = w + (uint16_t)o*n_in;',
+            '    for(uint8_t i = 0; i < n_in; i++)',
+            '      acc += (int32_t)x[i] * (int8_t)pgm_read_byte(&row[i]);',
+            '    if(shift > 0)',
+            '      acc = (acc + ((int32_t)1 << (shift - 1))) >> shift;',
+            '    if(acc > 32767) acc = 32767;',
+            '    if(acc < -32768) acc = -32768;',
+            '    if(relu && acc < 0) acc = 0;',
+            '    y[o] = (int16_t)acc;',
+            '  }',
+            '}',
+            '',
+            '// Greedy action for DQN_INPUTS quantized inputs, the Q-values at',
+            '// 2^-DQN_OUTPUT_FRAC go to q',
+            'static uint8_t dqn_act(const int16_t *inputs, int32_t *q) {',
+            '  int16_t a[DQN_MAX_UNITS], b[DQN_MAX_UNITS];',
+        ]
+        buffers = ['inputs', 'a', 'b']
+        for i, layer in enumerate(self.layers):
+            n_out, n_in = layer['weights'].shape
+            src = buffers[0] if i == 0 else buffers[1 + (i - 1) % 2]
+            dst = buffers[1 + i % 2]
+            lines.append('  dqn_layer({}, {}, dqn_weights_{}, dqn_biases_{}, {}, {}, {}, {});'.format(
+                src, dst, i, i, n_in, n_out, layer['shift'], int(layer['relu'])))
+        out = buffers[1 + (len(self.layers) - 1) % 2]
+        if not self.dueling_type:
+            lines.append('  for(uint8_t j = 0; j < DQN_ACTIONS; j++) q[j] = {}[j];'.format(out))
+        else:
+            # V then the advantages, less their mean or max
+            lines.append('  int32_t offset = 0;')
+            if self.dueling_type == 'avg':
+                lines.append('  for(uint8_t j = 1; j <= DQN_ACTIONS; j++) offset += {}[j];'.format(out))
+                lines.append('  offset /= DQN_ACTIONS;')
+            elif self.dueling_type == 'max':
+                lines.append('  offset = {}[1];'.format(out))
+                lines.append('  for(uint8_t j = 2; j <= DQN_ACTIONS; j++) if({0}[j] > offset) offset = {0}[j];'.format(out))
+            lines.append('  for(uint8_t j = 0; j < DQN_ACTIONS; j++) q[j] = (int32_t){0}[0] + {0}[j + 1] - offset;'.format(out))
+        lines += [
+            '  uint8_t best = 0;',
+            '  for(uint8_t j = 1; j < DQN_ACTIONS; j++)',
+            '    if(q[j] > q[best]) best = j;',
+            '  return best;',
+            '}',
+            '',
+            '#endif',
+            '',
+        ]
+        return '\n'.join(lines)
+
+def check_c(quantized, header, inputs, compiler='cc'):
+    # Builds the header on this machine and compares its actions and
+    # Q-values with the emulator, returns the number of mismatches
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'dqn_model.h'), 'w') as f:
+            f.write(header)
+        with open(os.path.join(directory, 'check.c'), 'w') as f:
+            f.write('\n'.join([
+                '#include <stdio.h>',
+                '#include "dqn_model.h"',
+                'int main(void) {',
+                '  int16_t inputs[DQN_INPUTS];',
+                '  int32_t q[DQN_ACTIONS];',
+                '  int value;',
+                '  for(;;) {',
+                '    for(int i = 0; i < DQN_INPUTS; i++) {',
+                '      if(scanf("%d", &value) != 1) return 0;',
+                '      inputs[i] = (int16_t)value;',
+                '    }',
+                '    printf("%d", dqn_act(inputs, q));',
+                '    for(int j = 0; j < DQN_ACTIONS; j++) printf(" %ld", (long)q[j]);',
+                '    printf("\\n");',
+                '  }',
+                '}',
+                '',
+            ]))
+        binary = os.path.join(directory, 'check')
+        subprocess.check_call([compiler, '-O2', '-o', binary, os.path.join(directory, 'check.c')])
+        stdin = '\n'.join(' '.join(str(v) for v in row) for row in inputs) + '\n'
+        output = subprocess.run([binary], input=stdin.encode('ascii'), stdout=subprocess.PIPE, check=True).stdout
+        results = np.array([line.split() for line in output.decode('ascii').splitlines()], dtype=np.int64)
+        q = quantized.q_values(inputs)
+        expected = np.column_stack([np.argmax(q, axis=1), q])
+        return int((results != expected).any(axis=1).sum())
+
+def report(quantized, observations):
+    floats = quantized.network.predict(np.asarray(observations, dtype=np.float32).reshape(-1, quantized.input_size)).astype(np.float64)
+    fixed = quantized.predict(observations)
+    error = np.abs(fixed - floats)
+    spread = np.ptp(floats) or 1.0
+    agreement = np.mean(np.argmax(floats, axis=1) == np.argmax(fixed, axis=1))
+    lines = ['{} observations'.format(len(floats))]
+    for i, layer in enumerate(quantized.layers):
+        n_out, n_in = layer['weights'].shape
+        lines.append('  layer {}: {:>3d} -> {:<3d} weights 2^-{:<2d} activations 2^-{:<2d} shift {}'.format(
+            i, n_in, n_out, layer['w_frac'], layer['out_frac'], layer['shift']))
+    lines += [
+        'Q-values: max error {:.4g}, mean error {:.4g} ({:.2%} of their range)'.format(error.max(), error.mean(), error.max() / spread),
+        'Greedy actions: {:.2%} agree'.format(agreement),
+        'Saturated activations: {}, accumulator overflows: {}'.format(quantized.saturations, quantized.overflows),
+        'Flash: {} bytes, {} MACs, about {:.2f} ms per action at 16 MHz'.format(
+            quantized.flash_bytes, quantized.macs, quantized.macs * AVR_CYCLES_PER_MAC / AVR_HZ * 1e3),
+    ]
+    return '\n'.join(lines)
+
+def logged_observations(paths, input_size):
+    # Observations of transition logs (dqncar_common.transition_log),
+    # stacked in frames when the network takes several of them
+    from dqncar_common.transition_log import TransitionLogReader
+    stacked = []
+    for path in paths:
+        records = TransitionLogReader(path).records()
+        stacked.append(_stack(records['obs'], records['action'] < 0, input_size))
+    return np.concatenate(stacked)
+
+def simulated_observations(network, input_size, steps, seed=0):
+    # Observations met by the network driving a SimulatedArduino car, in
+    # frames of 3 sensors or as the 5 values of the Step-4 car
+    from gym_arduino.envs import ArduinoEnv, SimulatedArduino
+    n_sensors = 5 if input_size == 5 else 3
+    env = ArduinoEnv(n_sensors=n_sensors, copy_obs=True)
+    env.connect_to(SimulatedArduino(n_sensors=n_sensors, seed=seed))
+    rng = np.random.RandomState(seed)
+    obs, starts = [env.reset()], [True]
+    history = _stack(np.array(obs), np.array(starts), input_size)[-1]
+    for _ in range(steps):
+        # Some random actions to also visit what the greedy policy avoids
+        action = rng.randint(3) if rng.rand() < 0.2 else int(network.act(history[None])[0])
+        o, _, done, _ = env.step(action)
+        obs.append(o)
+        starts.append(False)
+        history = np.concatenate([history[n_sensors:], o])
+        if done:
+            obs.append(env.reset())
+            starts.append(True)
+            history = _stack(np.array(obs[-1:]), np.array([True]), input_size)[-1]
+    env.close()
+    return _stack(np.array(obs), np.array(starts), input_size)
+
+def _stack(obs, starts, input_size):
+    # Frames of the last input_size / n observations, starting each episode
+    # from "nothing in sight" like WrapThreeFrames
+    n = obs.shape[1]
+    frames = input_size // n
+    if frames * n != input_size:
+        raise ValueError("The network takes {} inputs, not frames of {} sensors".format(input_size, n))
+    history = np.ones(input_size)
+    stacked = np.empty((len(obs), input_size))
+    for i, (o, start) in enumerate(zip(obs, starts)):
+        if start:
+            history[:] = 1.0
+        history = np.concatenate([history[n:], o])
+        stacked[i] = history
+    return stacked
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a Q-network to a fixed-point C header for the car")
+    parser.add_argument('weights', help="weights saved by DQNAgent.save_weights()")
+    parser.add_argument('--header', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                                         'Step-5-TrainingOverBLE-v2', 'dqn_model.h'))
+    parser.add_argument('--dueling', choices=['avg', 'max', 'naive'], help="dueling type the agent was built with")
+    parser.add_argument('--logs', nargs='*', default=[], help="transition logs to calibrate and check with")
+    parser.add_argument('--steps', type=int, default=5000, help="simulated steps to calibrate and check with, without logs")
+    parser.add_argument('--headroom', type=float, default=2.0, help="margin over the largest calibration activations")
+    parser.add_argument('--check-c', metavar='COMPILER', nargs='?', const='cc',
+                        help="also build the header with this compiler and compare it with the emulator")
+    args = parser.parse_args()
+
+    network = QNetwork.load(args.weights, dueling_type=args.dueling)
+    if args.logs:
+        observations = logged_observations(args.logs, network.input_size)
+    else:
+        observations = simulated_observations(network, network.input_size, args.steps)
+    quantized = QuantizedNetwork(network, observations, args.headroom)
+    header = quantized.header(os.path.basename(args.weights))
+    print(report(quantized, observations))
+    if args.check_c:
+        mismatches = check_c(quantized, header, quantize_inputs(observations))
+        print('C build: {} mismatches with the emulator'.format(mismatches))
+        if mismatches:
+            return 1
+    with open(args.header, 'w') as f:
+        f.write(header)
+    print('Wrote {}'.format(os.path.normpath(args.header)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
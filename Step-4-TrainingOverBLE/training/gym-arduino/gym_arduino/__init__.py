@@ -3,4 +3,9 @@ from gym.envs.registration import register
 register(
     id='arduino-v0',
     entry_point='gym_arduino.envs:ArduinoEnv',
-)
\ No newline at end of file
+)
+
+register(
+    id='arduino-replay-v0',
+    entry_point='gym_arduino.envs:ArduinoReplayEnv',
+)
@@ -1 +1,9 @@
-from gym_arduino.envs.arduino_env import ArduinoEnv
\ No newline at end of file
+from dqncar_common.lazy import lazy_attributes
+
+# Replaying logs or importing protocol does not need the serial env
+__all__ = ['ArduinoEnv', 'SimulatedArduino', 'ArduinoReplayEnv']
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    'ArduinoEnv':       'gym_arduino.envs.arduino_env',
+    'SimulatedArduino': 'gym_arduino.envs.simulated_arduino',
+    'ArduinoReplayEnv': 'gym_arduino.envs.replay_env',
+})
@@ -1,54 +1,276 @@
+import asyncio
+import queue
+import threading
+
 import gym
 from gym import error, spaces, utils
 from gym.utils import seeding
 import numpy as np
 
-import serial
+from gym_arduino.envs import protocol
+from dqncar_common.profiling import Profiler
 
 class ArduinoEnv(gym.Env):
     metadata = {'render.modes': ['human']}
 
-    def __init__(self):
-        self.arduino = serial.Serial()
-        self.obs   = [0.0, 0.0, 0.0, 0.0, 0.0]
+    def __init__(self, n_sensors=5, protocol=None, copy_obs=False):
+        # 5 values for the Step-4 car (3 ultrasonic, 2 infrared), 3 for Step-5
+        self.n_sensors = n_sensors
+        # 'auto' asks the firmware for binary frames and falls back on ASCII,
+        # 'binary' fails when the firmware can not, 'ascii' never asks. None
+        # picks what the firmware speaks: only the Step-5 one has binary
+        # frames, asking the Step-4 car would wait out the negotiation
+        if protocol is None:
+            protocol = 'auto' if n_sensors == 3 else 'ascii'
+        if protocol not in ('auto', 'binary', 'ascii'):
+            raise error.Error("Unknown protocol: {}".format(protocol))
+        self.protocol = protocol
+        self.codec = None
+        # Answers are decoded into float32 buffers returned as is, valid
+        # until the next step or reset. copy_obs returns copies of them
+        self.copy_obs = copy_obs
+        self._obs_buffer = np.zeros(n_sensors, dtype=np.float32)
+        # pyserial is only imported by connect_to() with a port name
+        self.arduino = None
+        self.obs   = self._obs_buffer
         self.score = 0.0
         self.done  = False
+        self.profiler = None
+        self._pending = False
+        self._reader = None
+        self._replies = None
 
-        low  = np.array([0.0, 0.0, 0.0, 0.0, 0.0])
-        high = np.array([1.0, 1.0, 1.0, 1.0, 1.0])
+        low  = np.zeros(n_sensors)
+        high = np.ones(n_sensors)
         self.action_space = spaces.Discrete(3)
         self.observation_space = spaces.Box(low, high, dtype=np.float32)
         self.seed()
 
     def connect_to(self, serial, baudrate=115200, timeout=5.0):
+        # A port name, or a device already speaking like pyserial (SimulatedArduino)
+        if isinstance(serial, str):
+            from serial import Serial
+            self.arduino = Serial()
+        else:
+            self.arduino = serial
         self.arduino.baudrate = baudrate
         self.arduino.timeout = timeout
-        self.arduino.port = serial
+        if isinstance(serial, str):
+            self.arduino.port = serial
         self.arduino.open()
         self.arduino.flush()
+        self.codec = None
+        if self.protocol != 'ascii':
+            self._negotiate()
+
+    def _negotiate(self, negotiation_timeout=0.5):
+        # Firmwares without binary frames ignore the command and never answer
+        timeout = self.arduino.timeout
+        self.arduino.timeout = negotiation_timeout
+        self.arduino.write(protocol.CMD_BINARY)
+        ack = protocol.parse_binary_ack(self.arduino.readline())
+        self.arduino.timeout = timeout
+        if ack is None:
+            if self.protocol == 'binary':
+                raise error.Error("The firmware does not answer in binary frames")
+            return
+        if ack != (protocol.VERSION, self.n_sensors):
+            raise error.Error("The firmware sends frames of version {} with {} sensors, "
+                              "expected version {} with {}".format(ack[0], ack[1], protocol.VERSION, self.n_sensors))
+        self.codec = protocol.FrameCodec(self.n_sensors)
+
+    def _read_answer(self):
+        if self.codec is not None:
+            return self.codec.read_frame(self.arduino)
+        return self.arduino.readline()
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
     def reset(self):
+        # An answer still on its way is collected first, not taken for the reset one
+        if self._pending:
+            self.step_wait()
+        if self.profiler is not None:
+            self.profiler.start()
         self.done = False
-        self.arduino.write(b'-1')
-        _answer = self.arduino.readline()
-        _answer = _answer.decode('ascii').strip().split(',')
-        return np.array(_answer)
+        self._write(b'-1')
+        obs = self._finish_reset(self._receive())
+        if self.profiler is not None:
+            self.profiler.stop('reset')
+        return obs
 
     def step(self, action):
+        self.step_async(action)
+        return self.step_wait()
+
+    def step_async(self, action):
+        # Sends the action and returns at once, the car answers after
+        # ANSWER_DELAY and its sensor reads: time the learner can spend on
+        # its own work before step_wait()
+        if self._pending:
+            raise error.AlreadyPendingCallError("Calling step_async while waiting for the previous answer", 'step')
+        if self.profiler is not None:
+            self.profiler.start()
         self.action = "{}".format(action).encode('ascii')
-        self.arduino.write(self.action)
-        _answer = self.arduino.readline()
+        self._write(self.action)
+        self._pending = True
+
+    def step_wait(self):
+        if not self._pending:
+            raise error.NoAsyncCallError("Calling step_wait without any step_async", 'step')
+        if self.profiler is not None:
+            # What the caller did between step_async() and step_wait()
+            self.profiler.lap('caller')
+        reply = self._receive()
+        self._pending = False
+        obs, score, done, info = self._finish_step(reply)
+        if self.profiler is not None:
+            info['profile'] = self.profiler.stop('step')
+        return obs, score, done, info
+
+    def _write(self, data):
+        written = self.arduino.write(data)
+        if self.profiler is not None:
+            self.profiler.count('bytes_written', written or 0)
+            self.profiler.lap('write')
+
+    async def step_coroutine(self, action):
+        # step() for an asyncio loop, the wait runs in the default executor
+        self.step_async(action)
+        return await asyncio.get_running_loop().run_in_executor(None, self.step_wait)
+
+    async def reset_coroutine(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.reset)
+
+    def start_reader(self, maxsize=4):
+        # Reads and decodes the answers of the car in a thread, step_wait()
+        # then only takes them out of a queue of `maxsize` replies. The
+        # thread blocks when the queue is full instead of buffering without
+        # bound
+        if self._reader is not None:
+            return
+        self._replies = queue.Queue(maxsize)
+        # Enough buffers for the queued replies, the one being decoded and
+        # the one the caller holds
+        buffers = np.zeros((maxsize + 2, self.n_sensors), dtype=np.float32)
+        stop = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, args=(stop, self._replies, buffers), daemon=True)
+        self._reader.stop = stop
+        self._reader.start()
+
+    def stop_reader(self):
+        if self._reader is None:
+            return
+        self._reader.stop.set()
+        # pyserial (POSIX) and SimulatedArduino can wake the thread up out of
+        # its read, elsewhere it stops at the read timeout
+        cancel_read = getattr(self.arduino, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
+        self._reader.join()
+        self._reader = None
+        self._replies = None
+
+    def _read_loop(self, stop, replies, buffers):
+        partial = b''
+        next_buffer = 0
+        while not stop.is_set():
+            try:
+                _answer = self._read_answer()
+            except error.Error:
+                # No frame within the timeout, the car is idle
+                continue
+            except Exception as e:
+                if not stop.is_set():
+                    self._put(stop, replies, e)
+                return
+            if self.codec is None:
+                # readline() hands out what it got when the timeout expires
+                if not _answer.endswith(b'\n'):
+                    partial += _answer
+                    continue
+                _answer, partial = partial + _answer, b''
+            try:
+                reply = (len(_answer), self._decode(_answer, buffers[next_buffer]))
+            except Exception as e:
+                self._put(stop, replies, e)
+                return
+            next_buffer = (next_buffer + 1) % len(buffers)
+            self._put(stop, replies, reply)
+
+    def _put(self, stop, replies, reply):
+        while not stop.is_set():
+            try:
+                replies.put(reply, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _receive(self):
+        # (observation, reward, done) of the next answer, from the reader
+        # thread when it runs. 'wait' is the time spent blocked on the
+        # serial line, or on the reader thread which then also decoded it
+        profiler = self.profiler
+        if self._replies is not None:
+            try:
+                reply = self._replies.get(timeout=self.arduino.timeout)
+            except queue.Empty:
+                raise error.Error("Timeout while waiting for an answer of the car")
+            if isinstance(reply, Exception):
+                raise reply
+            n_bytes, decoded = reply
+            if profiler is not None:
+                profiler.lap('wait')
+        else:
+            _answer = self._read_answer()
+            if profiler is not None:
+                profiler.lap('wait')
+            n_bytes, decoded = len(_answer), self._decode(_answer, self._obs_buffer)
+            if profiler is not None:
+                profiler.lap('parse')
+        if profiler is not None:
+            profiler.count('bytes_read', n_bytes)
+        return decoded
+
+    def _decode(self, _answer, obs):
+        # Writes the sensors into `obs`, the reward is None for the ASCII
+        # answer to a reset
+        if self.codec is not None:
+            # Straight from the frame into the buffer, no text to go through
+            reward, flags, _ = self.codec.decode(_answer, obs)
+            return obs, reward, bool(flags & protocol.FLAG_DONE)
         _answer = _answer.decode('ascii').strip().split(',')
-        self.obs   = np.array(_answer[:5],dtype=float)
-        self.score = float(_answer[5])
-        if self.score == -500.0:
-            self.done  = True
+        if len(_answer) < self.n_sensors:
+            raise error.Error("The car answered {} values, expected {}".format(len(_answer), self.n_sensors))
+        obs[:] = _answer[:self.n_sensors]
+        if len(_answer) == self.n_sensors:
+            return obs, None, False
+        reward = float(_answer[self.n_sensors])
+        return obs, reward, reward == -500.0
+
+    def _finish_reset(self, decoded):
+        self.obs = decoded[0].copy() if self.copy_obs else decoded[0]
+        return self.obs
+
+    def _finish_step(self, decoded):
+        obs, self.score, done = decoded
+        self.obs = obs.copy() if self.copy_obs else obs
+        if done:
+            self.done = True
         return self.obs, self.score, self.done, {}
 
+    def enable_profiling(self, profiler=None):
+        # Times the phases of the real reset() and step(), also when split
+        # in step_async() and step_wait() or fed by the reader thread. Off,
+        # it costs a few `is None` checks next to a serial round trip
+        self.profiler = profiler or Profiler()
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
     def render(self, mode='human'):
         print({
             'action':self.action,
@@ -58,7 +280,9 @@ class ArduinoEnv(gym.Env):
         })
 
     def close(self):
-        self.arduino.close()
+        self.stop_reader()
+        if self.arduino is not None:
+            self.arduino.close()
 
 if __name__ == "__main__":
     env = ArduinoEnv()
@@ -0,0 +1,105 @@
+import binascii
+import struct
+
+import numpy as np
+
+from gym import error
+
+# Binary answers of the firmware, little endian like the AVR:
+#
+#   magic       2 bytes  0xA5 0x5A
+#   version     uint8
+#   n_sensors   uint8
+#   seq         uint16   counts the frames sent since the car booted
+#   flags       uint8    FLAG_DONE, FLAG_RESET
+#   sensors     uint16 * n_sensors, the measure times SENSOR_SCALE
+#   reward      float32
+#   crc         uint16   CRC-16/CCITT-FALSE of version..reward (avr-libc
+#                        _crc_xmodem_update from 0xFFFF)
+#
+# 19 bytes for 3 sensors where the ASCII line takes about 53.
+MAGIC = b'\xa5\x5a'
+VERSION = 1
+FLAG_DONE  = 0x01
+FLAG_RESET = 0x02
+SENSOR_SCALE = 10000.0
+
+# Command asking the firmware to switch to binary answers, it answers with
+# a "BIN,<version>,<n_sensors>" line. Older firmwares ignore it.
+CMD_BINARY = b'-2'
+
+_HEADER = struct.Struct('<2sBBHB')
+_REWARD = struct.Struct('<f')
+_CRC = struct.Struct('<H')
+
+def crc16(data, crc=0xFFFF):
+    return binascii.crc_hqx(data, crc)
+
+def frame_size(n_sensors):
+    return _HEADER.size + 2*n_sensors + _REWARD.size + _CRC.size
+
+def encode_frame(seq, sensors, reward, flags=0):
+    sensors = np.clip(np.round(np.asarray(sensors, dtype=np.float64) * SENSOR_SCALE), 0, 0xFFFF)
+    body = (_HEADER.pack(MAGIC, VERSION, len(sensors), seq & 0xFFFF, flags) +
+            sensors.astype('<u2').tobytes() + _REWARD.pack(reward))
+    return body + _CRC.pack(crc16(body[2:]))
+
+class FrameCodec:
+    # Reads binary frames out of a serial port and decodes them in place
+    def __init__(self, n_sensors):
+        self.n_sensors = n_sensors
+        self.size = frame_size(n_sensors)
+        self._frame = struct.Struct('<2sBBHB{}HfH'.format(n_sensors))
+        self._scale = 1.0 / SENSOR_SCALE
+        self.expected_seq = None
+        self.frames_lost = 0
+        self.bytes_dropped = 0
+        self._buffer = b''
+
+    def read_frame(self, port):
+        # Returns the next valid frame, skipping garbage and corrupted frames.
+        # The bytes of a frame cut by a timeout are kept for the next call
+        buffer = self._buffer
+        while True:
+            start = buffer.find(MAGIC)
+            if start < 0:
+                # Keep a last byte that could start the next magic
+                start = len(buffer) - 1 if buffer.endswith(MAGIC[:1]) else len(buffer)
+            if start:
+                self.bytes_dropped += start
+                buffer = buffer[start:]
+            if len(buffer) >= self.size:
+                frame = buffer[:self.size]
+                if frame[3] == self.n_sensors and crc16(frame[2:-2]) == _CRC.unpack_from(frame, self.size - 2)[0]:
+                    self._buffer = buffer[self.size:]
+                    return frame
+                self.bytes_dropped += 1
+                buffer = buffer[1:]
+                continue
+            missing = self.size - len(buffer)
+            data = port.read(missing)
+            buffer += data
+            if len(data) < missing:
+                self._buffer = buffer
+                raise error.Error("Timeout while reading a frame from the car")
+
+    def decode(self, frame, observation):
+        # Writes the sensors into `observation`, returns (reward, flags, seq)
+        fields = self._frame.unpack(frame)
+        version, seq, flags = fields[1], fields[3], fields[4]
+        if version != VERSION:
+            raise error.Error("Unsupported frame version: {}".format(version))
+        scale = self._scale
+        for i in range(self.n_sensors):
+            observation[i] = fields[5 + i] * scale
+        if self.expected_seq is not None and seq != self.expected_seq:
+            self.frames_lost += (seq - self.expected_seq) & 0xFFFF
+        self.expected_seq = (seq + 1) & 0xFFFF
+        return fields[-2], flags, seq
+
+def parse_binary_ack(line):
+    # "BIN,<version>,<n_sensors>" or None when the firmware did not switch
+    fields = line.decode('ascii', 'replace').strip().split(',')
+    if len(fields) != 3 or fields[0] != 'BIN':
+        return None
+    return int(fields[1]), int(fields[2])
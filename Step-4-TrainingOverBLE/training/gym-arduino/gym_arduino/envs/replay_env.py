@@ -0,0 +1,131 @@
+import gym
+from gym import error, spaces
+from gym.utils import seeding
+import numpy as np
+
+from dqncar_common.transition_log import TransitionLogReader
+
+class ArduinoReplayEnv(gym.Env):
+    # Plays back the episodes recorded by TransitionRecorder around an
+    # ArduinoEnv, straight from the memory-mapped logs. The car is not
+    # there to answer, so step() ignores the action it is given: the next
+    # recorded transition comes back, with the action the car actually
+    # took in info['action'].
+    #
+    # 'shuffle' plays the episodes in a new random order after each pass
+    # over the logs, 'sequential' plays them in the order of the logs.
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, logs='transitions_arduino-v0', mode='shuffle', copy_obs=False):
+        if mode not in ('shuffle', 'sequential'):
+            raise error.Error("Unknown replay mode: {}".format(mode))
+        self.mode = mode
+        if isinstance(logs, str):
+            logs = [logs]
+        self.readers = [TransitionLogReader(path) for path in logs]
+        shapes = set(reader.dtype['obs'].shape for reader in self.readers)
+        if len(shapes) != 1:
+            raise error.Error("The logs hold observations of different shapes: {}".format(sorted(shapes)))
+        self.n_sensors, = shapes.pop()
+        self.episodes = [episode for reader in self.readers for episode in self._split(reader)]
+        if not self.episodes:
+            raise error.Error("No episode in {}".format(', '.join(logs)))
+
+        # Like ArduinoEnv, one float32 buffer unless copy_obs
+        self.copy_obs = copy_obs
+        self._obs_buffer = np.zeros(self.n_sensors, dtype=np.float32)
+        self.obs   = self._obs_buffer
+        self.score = 0.0
+        self.done  = False
+        self.action = None
+        self._order = []
+        self._records = None
+        self._index = 0
+
+        low  = np.zeros(self.n_sensors)
+        high = np.ones(self.n_sensors)
+        self.action_space = spaces.Discrete(3)
+        self.observation_space = spaces.Box(low, high, dtype=np.float32)
+        self.seed()
+
+    def _split(self, reader):
+        # (reader, chunk, start, stop) pieces of each episode: from a reset up
+        # to its first done, or up to the next reset when the run was cut short
+        if not reader.chunks:
+            return []
+        actions = np.concatenate([chunk['action'] for chunk in reader.chunks])
+        dones = np.concatenate([chunk['done'] for chunk in reader.chunks])
+        offsets = np.cumsum([0] + [len(chunk) for chunk in reader.chunks])
+        starts = np.flatnonzero(actions < 0)
+        episodes = []
+        for start, end in zip(starts, list(starts[1:]) + [len(actions)]):
+            done = np.flatnonzero(dones[start:end])
+            stop = start + done[0] + 1 if len(done) else end
+            if stop - start < 2:
+                # A reset without any step
+                continue
+            pieces = []
+            for c in range(np.searchsorted(offsets, start, side='right') - 1, len(reader.chunks)):
+                if offsets[c] >= stop:
+                    break
+                pieces.append((reader, c, max(start, offsets[c]) - offsets[c], min(stop, offsets[c+1]) - offsets[c]))
+            episodes.append(pieces)
+        return episodes
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def _next_episode(self):
+        if not self._order:
+            if self.mode == 'shuffle':
+                self._order = list(self.np_random.permutation(len(self.episodes)))
+            else:
+                self._order = list(range(len(self.episodes)))
+            self._order.reverse()
+        pieces = [reader.chunks[c][start:stop] for reader, c, start, stop in self.episodes[self._order.pop()]]
+        # Views on the map, unless the episode straddles two chunks
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+    def reset(self):
+        self._records = self._next_episode()
+        self._obs = self._records['obs']
+        self._rewards = self._records['reward']
+        self._dones = self._records['done']
+        self._actions = self._records['action']
+        self._index = 0
+        self.done = False
+        return self._observe(0)
+
+    def step(self, action):
+        if self._records is None or self._index + 1 >= len(self._records):
+            raise error.ResetNeeded("The recorded episode is over, call reset()")
+        self.action = action
+        self._index += 1
+        i = self._index
+        self._observe(i)
+        self.score = float(self._rewards[i])
+        info = {'action': int(self._actions[i])}
+        if self._dones[i]:
+            self.done = True
+        elif i + 1 == len(self._records):
+            # The recording stopped before the car crashed
+            self.done = True
+            info['TimeLimit.truncated'] = True
+        return self.obs, self.score, self.done, info
+
+    def _observe(self, i):
+        self._obs_buffer[:] = self._obs[i]
+        self.obs = self._obs_buffer.copy() if self.copy_obs else self._obs_buffer
+        return self.obs
+
+    def render(self, mode='human'):
+        print({
+            'action':self.action,
+            'obs':self.obs,
+            'score':self.score,
+            'done':self.done
+        })
+
+    def close(self):
+        pass
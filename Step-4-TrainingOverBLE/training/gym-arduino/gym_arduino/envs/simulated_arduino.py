@@ -0,0 +1,186 @@
+import re
+import threading
+import time
+
+from gym_arduino.envs import protocol
+
+# Same constants as Step-5-TrainingOverBLE-v2.ino
+PENALTY_TURN  = -0.8
+PENALTY_CRASH = -500.0
+BONUS_MOVE    = 0.5
+ANSWER_DELAY  = 0.250
+BACKWARD_DELAY = 2.0
+CRASH_DISTANCE = 0.1
+
+class SimulatedArduino:
+    # In-process stand-in for the serial link to the car, to be handed to
+    # ArduinoEnv.connect_to(). It answers the commands of the firmware (-1
+    # to reset, 0/1/2 to act) with the same CSV lines, the car being a
+    # headless CarSimEnv. With n_sensors=3 it speaks like the Step-5 car,
+    # with n_sensors=5 it adds the two infrared flags of the Step-4 car.
+    # `binary` lets it accept the switch to binary frames (protocol.py), off
+    # it behaves like a firmware that only speaks ASCII.
+    #
+    # `latency` is the one way delay of the link, `answer_delay` the wait of
+    # the firmware between an action and its measure and `reset_delay` the
+    # time it backs up after a crash, all in seconds. They default to 0 to
+    # run at full speed, ANSWER_DELAY and BACKWARD_DELAY are the firmware
+    # values.
+    def __init__(self, n_sensors=3, latency=0.0, answer_delay=0.0, reset_delay=0.0,
+                 crash_distance=CRASH_DISTANCE, binary=True, env=None, seed=None):
+        if n_sensors not in (3, 5):
+            raise ValueError("n_sensors must be 3 (Step-5) or 5 (Step-4)")
+        if env is None:
+            try:
+                from gym_carsim.envs import CarSimEnv
+            except ImportError:
+                raise ImportError("SimulatedArduino drives a CarSimEnv, install gym_carsim "
+                                  "(pip install -e Step-3-DeepQLearning/gym-carsim) or pass env=")
+            env = CarSimEnv(headless=True)
+        self.env = env
+        self.env.seed(seed)
+        self.n_sensors = n_sensors
+        self.latency = latency
+        self.answer_delay = answer_delay
+        self.reset_delay = reset_delay
+        self.crash_distance = crash_distance
+        self.binary = binary
+        self.binary_mode = False
+        self.frame_seq = 0
+
+        # pyserial attributes set by ArduinoEnv.connect_to()
+        self.port = None
+        self.baudrate = 115200
+        self.timeout = None
+        self.is_open = False
+
+        self.car_is_crashed = False
+        self.measures = self.env.reset()
+        self._input = b''
+        self._output = []           # (time the line reaches the host, line)
+        self._busy_until = 0.0      # the firmware handles one command at a time
+        self._cancelled = False
+        # _lock guards the bytes in flight, the reader waits on it. The
+        # commands are simulated under _command_lock only, which keeps them
+        # in order without holding the reader back
+        self._lock = threading.Condition()
+        self._command_lock = threading.Lock()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.cancel_read()
+
+    def cancel_read(self):
+        # Makes a read blocked in another thread return what it got so far
+        with self._lock:
+            self._cancelled = True
+            self._lock.notify_all()
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._output = []
+
+    @property
+    def in_waiting(self):
+        now = time.time()
+        with self._lock:
+            return sum(len(line) for ready, line in self._output if ready <= now)
+
+    def write(self, data):
+        now = time.time()
+        with self._command_lock:
+            # Serial.parseInt() reads the integers out of the stream
+            self._input += bytes(data)
+            commands = re.findall(br'-?\d+', self._input)
+            self._input = re.sub(br'^.*\d', b'', self._input, flags=re.S)
+            answers = [self._handle(int(command)) for command in commands]
+            with self._lock:
+                for line, duration in answers:
+                    if line is None:
+                        continue
+                    start = max(now + self.latency, self._busy_until)
+                    self._busy_until = start + duration
+                    self._output.append((self._busy_until + self.latency, line))
+                self._lock.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        return self._receive(lambda data: len(data) >= size, size)
+
+    def readline(self):
+        return self._receive(lambda data: data.endswith(b'\n'), None)
+
+    def _receive(self, complete, size):
+        # Hands out the bytes that reached the host, like pyserial returns
+        # what it got so far once the timeout expires
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        data = b''
+        with self._lock:
+            while True:
+                now = time.time()
+                while self._output and self._output[0][0] <= now and not complete(data):
+                    ready, chunk = self._output.pop(0)
+                    if size is not None:
+                        take = size - len(data)
+                    else:
+                        take = chunk.find(b'\n') + 1 or len(chunk)
+                    data += chunk[:take]
+                    if take < len(chunk):
+                        self._output.insert(0, (ready, chunk[take:]))
+                if complete(data):
+                    return data
+                if self._cancelled:
+                    self._cancelled = False
+                    return data
+                wait = self._output[0][0] - now if self._output else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return data
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._lock.wait(wait)
+
+    def _handle(self, command):
+        # Returns the answer line and the time the firmware takes to send it
+        if command == -2 and self.binary:
+            self.binary_mode = True
+            return 'BIN,{},{}\r\n'.format(protocol.VERSION, self.n_sensors).encode('ascii'), 0.0
+        if command == -1:
+            duration = 0.0
+            if self.car_is_crashed:
+                self.measures = self.env.reset()
+                duration = self.reset_delay
+            self.car_is_crashed = False
+            return self._format(self.measures, flags=protocol.FLAG_RESET), duration
+        if command not in (0, 1, 2):
+            return None, 0.0
+        if self.car_is_crashed:
+            return self._format(self.measures, PENALTY_CRASH, protocol.FLAG_DONE), 0.0
+        self.measures, _, done, _ = self.env.step(command)
+        reward = PENALTY_TURN if command in (0, 1) else BONUS_MOVE
+        line = self._format(self.measures, reward)
+        # The safety check runs between two commands, the crash is only
+        # reported by the next step
+        self.car_is_crashed = done or (self.crash_distance is not None and
+                                       min(self.measures) <= self.crash_distance)
+        return line, self.answer_delay
+
+    def _format(self, measures, reward=None, flags=0):
+        values = list(measures)
+        if self.n_sensors == 5:
+            # The infrared sensors of the Step-4 car only tell "close or not"
+            values += [int(measures[0] <= CRASH_DISTANCE), int(measures[2] <= CRASH_DISTANCE)]
+        if self.binary_mode:
+            frame = protocol.encode_frame(self.frame_seq, values, 0.0 if reward is None else reward, flags)
+            self.frame_seq += 1
+            return frame
+        # Serial.print(float, DEC) prints 10 decimals
+        fields = ['{:.10f}'.format(value) for value in values[:3]] + [str(value) for value in values[3:]]
+        if reward is not None:
+            fields.append('{:.10f}'.format(reward))
+        return ','.join(fields).encode('ascii') + b'\r\n'
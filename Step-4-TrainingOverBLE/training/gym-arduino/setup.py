@@ -2,5 +2,6 @@ from setuptools import setup
 
 setup(name='gym_arduino',
       version='0.0.1',
-      install_requires=['gym']  # And any other dependencies foo needs
+      install_requires=['gym', 'dqncar_common'],  # And any other dependencies foo needs
+      extras_require={'simulated': ['gym_carsim']}  # SimulatedArduino drives a CarSimEnv
 )
\ No newline at end of file
@@ -1,3 +1,5 @@
+import argparse
+
 import numpy as np
 import gym
 import gym_arduino
@@ -6,15 +8,28 @@ from keras.models import Sequential
 from keras.layers import Dense, Activation, Flatten
 from keras.optimizers import Adam
 
-from rl.agents.dqn import DQNAgent
 from rl.policy import BoltzmannQPolicy
-from rl.memory import SequentialMemory
+
+from dqncar_common.transition_log import TransitionRecorder
+from dqncar_common.checkpoint import Checkpoint
+from dqncar_common.memory import NumpyMemory, NumpyDQNAgent
+from dqncar_common.numpy_policy import NumpyAgent, QNetwork
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resume', action='store_true', help="start from the last checkpoint of checkpoints_<env>")
+parser.add_argument('--checkpoint-interval', type=int, default=100, help="steps between two checkpoints")
+parser.add_argument('--keep', type=int, default=3, help="checkpoints kept on disk")
+parser.add_argument('--transitions', metavar='PATH', help="log every transition of the car to this directory")
+args = parser.parse_args()
 
 ENV_NAME = 'arduino-v0'
 
 # Get the environment and extract the number of actions.
 env = gym.make(ENV_NAME)
 env.connect_to('/dev/tty.HC-06-DevB')
+# With --transitions every transition of the car is kept, each run appends to the same log
+if args.transitions:
+    env = TransitionRecorder(env, args.transitions, metadata={'env': ENV_NAME})
 np.random.seed(3927513)
 env.seed(9340062)
 nb_actions = env.action_space.n
@@ -34,19 +49,33 @@ print(model.summary())
 
 # Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
 # even the metrics!
-memory = SequentialMemory(limit=50000, window_length=1)
+# Same experiences as keras-rl's SequentialMemory out of numpy ring buffers, that
+# NumpyDQNAgent samples a batch of arrays at a time. For prioritized replay use
+# NumpyMemory(..., prioritized=True)
+memory = NumpyMemory(limit=50000, window_length=1)
 policy = BoltzmannQPolicy()
-dqn = DQNAgent(model=model, nb_actions=nb_actions, memory=memory, nb_steps_warmup=25,
-               target_model_update=1e-2, policy=policy)
+dqn = NumpyDQNAgent(model=model, nb_actions=nb_actions, memory=memory, nb_steps_warmup=25,
+                    target_model_update=1e-2, policy=policy)
 dqn.compile(Adam(lr=1e-3), metrics=['mae'])
 
+# Weights, optimizer state, replay memory and counters are saved in the
+# background every --checkpoint-interval steps, --resume picks the last one up
+checkpoint = Checkpoint('checkpoints_{}'.format(ENV_NAME), interval=args.checkpoint_interval, keep=args.keep)
+if args.resume:
+    step = checkpoint.resume(dqn)
+    print('Resuming from step {}'.format(step) if step is not None else 'No checkpoint to resume from')
+
 # Okay, now it's time to learn something! We visualize the training here for show, but this
 # slows down training quite a lot. You can always safely abort the training prematurely using
 # Ctrl + C.
-dqn.fit(env, nb_steps=1000, visualize=True, verbose=2)
+dqn.fit(env, nb_steps=1000, visualize=True, verbose=2, callbacks=[checkpoint])
 
 # After training is done, we save the final weights.
 dqn.save_weights('dqn_{}_weights.h5f'.format(ENV_NAME), overwrite=True)
+memory.save('dqn_{}_memory.npz'.format(ENV_NAME))
 
-# Finally, evaluate our algorithm for 5 episodes.
-dqn.test(env, nb_episodes=5, visualize=True)
\ No newline at end of file
+# Finally, evaluate our algorithm for 5 episodes, acting with a numpy copy of the
+# network instead of a Keras predict() per step.
+agent = NumpyAgent(QNetwork.from_weights(dqn.model.get_weights()))
+agent.test(env, nb_episodes=5, visualize=True)
+env.close()
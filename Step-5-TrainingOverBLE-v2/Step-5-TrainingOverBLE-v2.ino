@@ -1,4 +1,5 @@
 #include <L298N.h>                   // https://github.com/AndreaLombardo/L298N
+#include <util/crc16.h>
 
 // Ultrasonic Settings
 #define UTRASONIC_LEFT_TRIG_PIN     A2
@@ -38,6 +39,34 @@ L298N motor_left(MOTOR_LEFT_ENB,   MOTOR_LEFT_IN3,  MOTOR_LEFT_IN4);
 
 bool car_is_crashed;
 
+// Binary frames (see gym_arduino/envs/protocol.py), asked by the command -2
+#define CMD_BINARY        -2
+#define FRAME_VERSION     1
+#define FRAME_FLAG_DONE   0x01
+#define FRAME_FLAG_RESET  0x02
+#define FRAME_SENSORS     3
+#define FRAME_SIZE        (7 + 2*FRAME_SENSORS + 4 + 2)
+#define SENSOR_SCALE      10000.0
+
+bool binary_mode = false;
+uint16_t frame_seq = 0;
+
+// On-board inference, with the dqn_model.h of export_arduino.py next to
+// this sketch. The command -3 lets the network drive, any other command
+// hands the car back to the host.
+#define CMD_AUTOPILOT     -3
+
+#if __has_include("dqn_model.h")
+#include "dqn_model.h"
+#define HAS_DQN_MODEL
+#if DQN_INPUTS % FRAME_SENSORS != 0
+#error "dqn_model.h does not take frames of FRAME_SENSORS measures"
+#endif
+
+int16_t dqn_inputs[DQN_INPUTS];     // Last DQN_INPUTS / FRAME_SENSORS frames, oldest first
+bool autopilot = false;
+#endif
+
 void car_turn_left() {
   motor_right.stop();                                // Stop Right Motor
   motor_left.setSpeed(MOTOR_SPEED);                  // Move Left Motor at medium speed
@@ -99,10 +128,49 @@ void reset_car() {
   car_stop();                              
   car_is_crashed  = false;
   do_ultrasonic_measures();
+  if(binary_mode) {
+    send_frame(0.0, FRAME_FLAG_RESET);
+    return;
+  }
   print_sensors();
   Serial.println("");
 }
 
+void send_frame(float reward, uint8_t flags) {
+  uint8_t frame[FRAME_SIZE];
+  uint8_t i = 0;
+  frame[i++] = 0xA5;                                 // Magic
+  frame[i++] = 0x5A;
+  frame[i++] = FRAME_VERSION;
+  frame[i++] = FRAME_SENSORS;
+  frame[i++] = frame_seq & 0xFF;                     // Little endian like the host expects
+  frame[i++] = frame_seq >> 8;
+  frame[i++] = flags;
+  for(uint8_t s = 0; s < FRAME_SENSORS; s++) {
+    float measure = constrain(ultrasonic_measures[s], 0.0, 1.0);
+    uint16_t value = (uint16_t)(measure * SENSOR_SCALE + 0.5);
+    frame[i++] = value & 0xFF;
+    frame[i++] = value >> 8;
+  }
+  memcpy(&frame[i], &reward, 4);                     // AVR floats are little endian IEEE 754
+  i += 4;
+  uint16_t crc = 0xFFFF;
+  for(uint8_t j = 2; j < i; j++)
+    crc = _crc_xmodem_update(crc, frame[j]);
+  frame[i++] = crc & 0xFF;
+  frame[i++] = crc >> 8;
+  Serial.write(frame, i);
+  frame_seq++;
+}
+
+void switch_to_binary() {
+  binary_mode = true;
+  Serial.print("BIN,");
+  Serial.print(FRAME_VERSION);
+  Serial.print(",");
+  Serial.println(FRAME_SENSORS);
+}
+
 void print_sensors() {
   Serial.print(ultrasonic_measures[0],DEC);
   Serial.print(',');
@@ -127,15 +195,7 @@ void do_ultrasonic_measures() {
   ultrasonic_measures[1] = measure_ultrasonic_distance(UTRASONIC_MIDDLE_TRIG_PIN, UTRASONIC_MIDDLE_ECHO_PIN);
 }
 
-void step(int action) {
-  if(car_is_crashed) {
-    print_sensors();
-    Serial.print(",");
-    Serial.println(PENALTY_CRASH,DEC);
-    car_stop();
-    return;  
-  }
-  
+float do_action(int action) {
   float reward = 0.0 ;
 
   switch(action) {
@@ -152,9 +212,57 @@ void step(int action) {
       car_go_forward();
     break;
   }
+  return reward;
+}
+
+#ifdef HAS_DQN_MODEL
+void push_dqn_frame() {
+  memmove(dqn_inputs, dqn_inputs + FRAME_SENSORS, (DQN_INPUTS - FRAME_SENSORS) * sizeof(int16_t));
+  for(uint8_t s = 0; s < FRAME_SENSORS; s++)
+    dqn_inputs[DQN_INPUTS - FRAME_SENSORS + s] = dqn_input(constrain(ultrasonic_measures[s], 0.0, 1.0));
+}
+
+void start_autopilot() {
+  // The history starts from "nothing in sight" like WrapThreeFrames
+  for(uint8_t i = 0; i < DQN_INPUTS; i++)
+    dqn_inputs[i] = dqn_input(1.0);
+  do_ultrasonic_measures();
+  push_dqn_frame();
+  autopilot = true;
+}
+
+void autopilot_step() {
+  // Same pace as under the host: act, wait ANSWER_DELAY, measure
+  int32_t q[DQN_ACTIONS];
+  do_action(dqn_act(dqn_inputs, q));
+  delay(ANSWER_DELAY);
+  do_ultrasonic_measures();
+  push_dqn_frame();
+  update_cmd_time();
+}
+#endif
+
+void step(int action) {
+  if(car_is_crashed) {
+    if(binary_mode) {
+      send_frame(PENALTY_CRASH, FRAME_FLAG_DONE);
+    } else {
+      print_sensors();
+      Serial.print(",");
+      Serial.println(PENALTY_CRASH,DEC);
+    }
+    car_stop();
+    return;  
+  }
+  
+  float reward = do_action(action);
 
   delay(ANSWER_DELAY);
   do_ultrasonic_measures();
+  if(binary_mode) {
+    send_frame(reward, 0);
+    return;
+  }
   print_sensors();
   Serial.print(",");
   Serial.println(reward,DEC);
@@ -164,7 +272,19 @@ void handle_serial_cmd() {
   if (Serial.available() > 0) {
     update_cmd_time();
     int _cmd = Serial.parseInt();
+#ifdef HAS_DQN_MODEL
+    autopilot = false;
+#endif
     switch(_cmd) {
+      case CMD_BINARY:
+        switch_to_binary();
+      break;
+#ifdef HAS_DQN_MODEL
+      case CMD_AUTOPILOT:
+        if(!car_is_crashed)
+          start_autopilot();
+      break;
+#endif
       case -1:
         reset_car();
       break;
@@ -196,4 +316,10 @@ void setup() {
 void loop() {
   do_security_check();
   handle_serial_cmd();
+#ifdef HAS_DQN_MODEL
+  if(autopilot && car_is_crashed)
+    autopilot = false;                     // The car waits for a reset by the host
+  if(autopilot)
+    autopilot_step();
+#endif
 }
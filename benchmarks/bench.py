@@ -0,0 +1,415 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+import numpy as np
+
+# The packages of this checkout come first, installed or not
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'dqncar-common'),
+                os.path.join(ROOT, 'Step-3-DeepQLearning', 'gym-carsim'),
+                os.path.join(ROOT, 'Step-4-TrainingOverBLE', 'training', 'gym-arduino'),
+                os.path.join(ROOT, 'Step-3-DeepQLearning')]
+
+from gym_carsim.envs import CarSimEnv
+from wrappers import WrapThreeFrames
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Maps: (width, height, number of random circles), None for the bundled one
+MAPS = {
+    'default': None,
+    'dense':   (1280, 720, 150),
+    'large':   (5120, 2880, 600),
+}
+# Angle between two rays of a sensor, in degrees (30 rays per sensor at 2)
+RAY_SPREADS = [4, 2, 1]
+
+def random_scenario(directory, name, width, height, nb_circles, seed=0):
+    rng = np.random.RandomState(seed)
+    circles = np.column_stack([rng.uniform(0, width, nb_circles),
+                               rng.uniform(0, height, nb_circles),
+                               rng.uniform(5, 40, nb_circles)]).round(1)
+    description = {
+        'width': width,
+        'height': height,
+        'circles': circles.tolist(),
+        'segments': [[1, 1, width-1, 1, 1], [1, 1, 1, height-1, 1],
+                     [1, height-1, width-1, height-1, 1], [width-1, 1, width-1, height-1, 1]],
+        'pop_sites': np.column_stack([rng.uniform(100, width-100, 8), rng.uniform(100, height-100, 8)]).round().tolist(),
+        'pop_spread': 50,
+    }
+    path = os.path.join(directory, name + '.json')
+    with open(path, 'w') as f:
+        json.dump(description, f)
+    return path
+
+def make_env(scenario, spread=2, **kwargs):
+    env = CarSimEnv(headless=True, scenario=scenario, **kwargs)
+    env.seed(0)
+    for sensor in env.car.sensors:
+        sensor.spread = spread
+    env.car.build_ray_table()
+    env.reset()
+    return env
+
+def spread(medians):
+    # Interquartile range of the round medians relative to the fastest one,
+    # how much the machine moved the timings during the run
+    return (np.percentile(medians, 75) - np.percentile(medians, 25)) / np.min(medians)
+
+def measure(call, duration, rounds=3, min_calls=50, setup=None):
+    # Times each call on its own, `setup` runs untimed between two calls.
+    # The statistics of the round with the fastest median are kept, the
+    # other rounds mostly measure the noise of the machine
+    for _ in range(5):
+        call()
+        if setup is not None:
+            setup()
+    best = None
+    medians = []
+    for _ in range(rounds):
+        latencies = []
+        started = time.perf_counter()
+        while len(latencies) < min_calls or time.perf_counter() - started < duration / rounds:
+            t = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t)
+            if setup is not None:
+                setup()
+        latencies = np.array(latencies)
+        medians.append(np.median(latencies))
+        if best is None or medians[-1] < np.median(best):
+            best = latencies
+    return {
+        'calls':   len(best),
+        'per_sec': len(best) / best.sum(),
+        'p50_us':  np.percentile(best, 50) * 1e6,
+        'p90_us':  np.percentile(best, 90) * 1e6,
+        'p99_us':  np.percentile(best, 99) * 1e6,
+        'spread':  spread(medians),
+    }
+
+class Stepper:
+    # Steps an env with random actions, resets it untimed after a crash
+    def __init__(self, env, seed=0):
+        self.env = env
+        self.rng = np.random.RandomState(seed)
+        self.done = False
+
+    def step(self):
+        _, _, self.done, _ = self.env.step(self.rng.randint(3))
+
+    def reset_if_done(self):
+        if self.done:
+            self.env.reset()
+            self.done = False
+
+class FakeArduino:
+    # Firmware stand-in on the master side of a pseudo terminal: answers
+    # every command with 5 sensor values and a reward, like the Step-4 car
+    def __init__(self, answer=b'0.42,0.13,0.99,0,1,0.5\r\n'):
+        self.answer = answer
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                if not os.read(self.master, 64):
+                    break
+                os.write(self.master, self.answer)
+            except OSError:
+                break
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+def cases(scenarios):
+    # name -> function returning (call, setup, cleanup)
+    catalogue = {}
+
+    for map_name, scenario in scenarios.items():
+        for spread in RAY_SPREADS:
+            rays = len(range(-30, 30, spread))
+
+            # A single sensor, then the three of the car
+            def sense(scenario=scenario, spread=spread):
+                env = make_env(scenario, spread, sensing='pymunk')
+                return env.car.sensors[1].sense, None, env.close
+            catalogue['sense/pymunk/{}/rays{}'.format(map_name, rays)] = sense
+
+            for mode in ('numpy', 'pymunk'):
+                def read_sensors(scenario=scenario, spread=spread, mode=mode):
+                    env = make_env(scenario, spread, sensing=mode)
+                    return env.car.read_sensors, None, env.close
+                catalogue['read_sensors/{}/{}/rays{}'.format(mode, map_name, 3*rays)] = read_sensors
+
+        for collision in ('pymunk', 'sdf'):
+            def env_step(scenario=scenario, collision=collision):
+                stepper = Stepper(make_env(scenario, collision=collision))
+                return stepper.step, stepper.reset_if_done, stepper.env.close
+            catalogue['env_step/{}/{}'.format(collision, map_name)] = env_step
+
+        # Four crash checks per frame and three frames per decision, sensed once
+        def env_step_substeps(scenario=scenario):
+            stepper = Stepper(make_env(scenario, substeps=4, action_repeat=3))
+            return stepper.step, stepper.reset_if_done, stepper.env.close
+        catalogue['env_step/substeps4_repeat3/{}'.format(map_name)] = env_step_substeps
+
+        def env_reset(scenario=scenario):
+            env = make_env(scenario)
+            return env.reset, None, env.close
+        catalogue['env_reset/{}'.format(map_name)] = env_reset
+
+    def wrapper_step():
+        stepper = Stepper(WrapThreeFrames(make_env(scenarios['default'])))
+        return stepper.step, stepper.reset_if_done, stepper.env.close
+    catalogue['wrapper_step/three_frames'] = wrapper_step
+
+    def arduino_step():
+        from gym_arduino.envs import ArduinoEnv
+        arduino = FakeArduino()
+        env = ArduinoEnv()
+        env.connect_to(arduino.port)
+        actions = np.random.RandomState(0).randint(3, size=1024)
+        index = [0]
+        def step():
+            env.step(actions[index[0] % len(actions)])
+            index[0] += 1
+        def cleanup():
+            env.close()
+            arduino.close()
+        return step, None, cleanup
+    catalogue['arduino_step/fake_serial'] = arduino_step
+
+    def simulated_arduino_step():
+        from gym_arduino.envs import ArduinoEnv, SimulatedArduino
+        env = ArduinoEnv()
+        env.connect_to(SimulatedArduino(n_sensors=5, env=make_env(scenarios['default']), seed=0))
+        stepper = Stepper(env)
+        return stepper.step, stepper.reset_if_done, env.close
+    catalogue['arduino_step/simulated'] = simulated_arduino_step
+
+    def replay_step():
+        env, cleanup = replay_env()
+        env.reset()
+        stepper = Stepper(env)
+        return stepper.step, stepper.reset_if_done, cleanup
+    catalogue['replay_step/arduino'] = replay_step
+
+    return catalogue
+
+def replay_env(**kwargs):
+    from gym_arduino.envs import ArduinoReplayEnv
+    from dqncar_common.transition_log import TransitionLog
+    # 200 random episodes of 5 to 100 steps
+    directory = tempfile.mkdtemp()
+    log = TransitionLog(directory, (5,))
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        log.append(rng.rand(5), -1, 0.0, False, 0.0, 0.0)
+        steps = rng.randint(5, 100)
+        for i in range(steps):
+            log.append(rng.rand(5), rng.randint(3), 0.5, i == steps - 1, 0.0, 0.0)
+    log.close()
+    env = ArduinoReplayEnv(directory, **kwargs)
+    env.seed(0)
+    def cleanup():
+        env.close()
+        shutil.rmtree(directory)
+    return env, cleanup
+
+# Cold starts, each timed in a fresh interpreter: the imports, then the
+# imports with the construction, reset and first step of an env, what a new
+# worker process pays before it gets anything done
+STARTUP = {
+    'startup/import/gym_carsim': "import gym_carsim",
+    'startup/import/carsim_env': "from gym_carsim.envs import CarSimEnv",
+    'startup/import/arduino_env': "from gym_arduino.envs import ArduinoEnv",
+    'startup/first_step/carsim/pymunk':
+        "from gym_carsim.envs import CarSimEnv\n"
+        "env = CarSimEnv(headless=True)\nenv.reset()\nenv.step(0)",
+    'startup/first_step/carsim/sdf':
+        "from gym_carsim.envs import CarSimEnv\n"
+        "env = CarSimEnv(headless=True, collision='sdf')\nenv.reset()\nenv.step(0)",
+    'startup/first_step/arduino/simulated':
+        "from gym_carsim.envs import CarSimEnv\nfrom gym_arduino.envs import ArduinoEnv, SimulatedArduino\n"
+        "env = ArduinoEnv()\nenv.connect_to(SimulatedArduino(n_sensors=5, env=CarSimEnv(headless=True), seed=0))\n"
+        "env.reset()\nenv.step(0)",
+}
+
+STARTUP_RUNNER = '''import sys, time
+started = time.perf_counter()
+try:
+{}
+except ImportError as e:
+    sys.stderr.write(str(e))
+    sys.exit(2)
+print('startup', time.perf_counter() - started)
+'''
+
+def measure_startup(code, runs):
+    # Times `code` in `runs` new interpreters, without the start of the
+    # interpreter itself. A first untimed run warms the disk caches up
+    script = STARTUP_RUNNER.format('\n'.join('    ' + line for line in code.split('\n')))
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    latencies = []
+    for _ in range(runs + 1):
+        run = subprocess.run([sys.executable, '-c', script], env=environ, capture_output=True, text=True)
+        if run.returncode == 2:
+            raise ImportError(run.stderr.strip().splitlines()[-1])
+        if run.returncode != 0:
+            raise RuntimeError(run.stderr)
+        line, = [line for line in run.stdout.splitlines() if line.startswith('startup ')]
+        latencies.append(float(line.split()[1]))
+    latencies = np.array(latencies[1:])
+    return {
+        'calls':   len(latencies),
+        'per_sec': len(latencies) / latencies.sum(),
+        'p50_us':  np.percentile(latencies, 50) * 1e6,
+        'p90_us':  np.percentile(latencies, 90) * 1e6,
+        'p99_us':  np.percentile(latencies, 99) * 1e6,
+        'spread':  spread(latencies),
+    }
+
+def machine():
+    return {
+        'python':    platform.python_version(),
+        'numpy':     np.__version__,
+        'platform':  platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+# How many times its spread a case may slow down, the noisy ones (pseudo
+# terminals, new processes, calls of a few microseconds) spread the most
+SPREAD_FACTOR = 2.0
+
+def allowed_slowdown(result, baseline, tolerance):
+    # `tolerance`, or more when either run spread more than that
+    return max(tolerance, SPREAD_FACTOR * max(result.get('spread', 0.0), baseline.get('spread', 0.0)))
+
+def is_slower(result, baseline, tolerance):
+    speed = baseline['p50_us'] / result['p50_us']
+    return speed < 1.0 - allowed_slowdown(result, baseline, tolerance)
+
+def compare(results, baseline, tolerance):
+    # A case regresses when its median call gets slower than the baseline by
+    # more than its allowed slow down (a fraction of the speed), the median
+    # being less noisy than the mean throughput
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print('{:<40s} {:>9.1f}us   (no baseline)'.format(name, result['p50_us']))
+            continue
+        speed = baseline[name]['p50_us'] / result['p50_us']
+        allowed = allowed_slowdown(result, baseline[name], tolerance)
+        flag = ''
+        if speed < 1.0 - allowed:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<40s} {:>9.1f}us   x{:.2f} speed vs baseline (min x{:.2f}){}'.format(
+            name, result['p50_us'], speed, 1.0 - allowed, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and latency of the simulator, sensors, wrappers and serial env")
+    parser.add_argument('--filter', default='', help="only run the cases whose name contains this string")
+    parser.add_argument('--duration', type=float, default=1.0, help="seconds spent on each case")
+    parser.add_argument('--rounds', type=int, default=5, help="rounds per case, the fastest one is kept")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--baseline', default=BASELINE, help="json results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slow down of the median call before failing")
+    parser.add_argument('--retries', type=int, default=2, help="times a case that looks slower is measured again")
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--startup-runs', type=int, default=10, help="fresh interpreters timed for each startup case")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        scenarios = {}
+        for name, size in MAPS.items():
+            scenarios[name] = 'default' if size is None else random_scenario(directory, name, *size)
+        catalogue = cases(scenarios)
+
+        def run(name):
+            # The results of one case, None when it can not run here
+            if name in STARTUP:
+                try:
+                    return measure_startup(STARTUP[name], args.startup_runs)
+                except ImportError as e:
+                    print('{:<40s} skipped: {}'.format(name, e))
+                    return None
+            try:
+                call, setup, cleanup = catalogue[name]()
+            except ImportError as e:
+                print('{:<40s} skipped: {}'.format(name, e))
+                return None
+            try:
+                return measure(call, args.duration, args.rounds, setup=setup)
+            finally:
+                cleanup()
+
+        results = {}
+        for name in list(catalogue) + list(STARTUP):
+            if args.filter not in name:
+                continue
+            result = run(name)
+            if result is None:
+                continue
+            results[name] = result
+            if name in STARTUP:
+                print('{:<40s} {:>9.1f}ms   p90 {:>9.1f}ms   p99 {:>9.1f}ms'.format(
+                    name, result['p50_us'] / 1e3, result['p90_us'] / 1e3, result['p99_us'] / 1e3))
+            else:
+                print('{:<40s} {:>12.1f}/s   p50 {:>9.1f}us   p90 {:>9.1f}us   p99 {:>9.1f}us'.format(
+                    name, result['per_sec'], result['p50_us'], result['p90_us'], result['p99_us']))
+
+        report = {'machine': machine(), 'results': results}
+        if args.update_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        if args.update_baseline or not os.path.exists(args.baseline):
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2, sort_keys=True)
+            return 0
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        # A real slow down shows up every time, a busy machine rarely twice in a row
+        for _ in range(args.retries):
+            slower = [name for name, result in results.items() if name in baseline['results'] and
+                      is_slower(result, baseline['results'][name], args.tolerance)]
+            if not slower:
+                break
+            print('Measuring {} case(s) again: {}'.format(len(slower), ', '.join(sorted(slower))))
+            for name in slower:
+                result = run(name)
+                if result is not None and result['p50_us'] < results[name]['p50_us']:
+                    results[name] = result
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    print()
+    print('Compared with {} ({})'.format(args.baseline, baseline['machine']['processor']))
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+        print('{} case(s) slower than the baseline'.format(len(regressions)))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from rl.callbacks import Callback
+
+# A checkpoint is one checkpoint-<step>.npz holding the weights of the
+# model and of the target model, the state of the optimizer, the replay
+# memory (NumpyMemory), numpy's random state and a json 'meta' entry with
+# the step and episode counters.
+PATTERN = 'checkpoint-{:09d}.npz'
+
+def checkpoints(directory):
+    # Paths of the checkpoints in `directory`, oldest first
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if name.startswith('checkpoint-') and name.endswith('.npz'))
+    return [os.path.join(directory, name) for name in names]
+
+def _optimizer(agent):
+    # keras-rl wraps the optimizer in AdditionalUpdatesOptimizer for soft
+    # target updates, the state lives in the wrapped one
+    optimizer = agent.trainable_model.optimizer
+    return getattr(optimizer, 'optimizer', optimizer)
+
+class Checkpoint(Callback):
+    # Saves the agent every `interval` steps, when training ends and when it
+    # is interrupted. The arrays are copied on the training thread, which
+    # takes a few milliseconds, and written by a background thread. A
+    # checkpoint coming while the previous one is still being written is
+    # skipped rather than waited for. Only the last `keep` are kept.
+    def __init__(self, directory, interval=1000, keep=3):
+        super(Checkpoint, self).__init__()
+        if keep < 1:
+            raise ValueError("keep must be at least 1, the checkpoint just written is one of them")
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.episode = 0
+        self.skipped = 0
+        self._resume_step = None
+        self._pending = queue.Queue(maxsize=1)
+        self._writer = None
+
+    def resume(self, agent, path=None):
+        # Loads the last checkpoint, or `path`, into a compiled agent. fit()
+        # starts counting from 0, the step is put back on the first episode
+        # so that nb_steps keeps counting the whole run. Returns the step or
+        # None without any checkpoint
+        if path is None:
+            found = checkpoints(self.directory)
+            if not found:
+                return None
+            path = found[-1]
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            agent.model.set_weights([data['model_{}'.format(i)] for i in range(meta['model'])])
+            agent.target_model.set_weights([data['target_{}'.format(i)] for i in range(meta['target'])])
+            if meta['optimizer']:
+                if hasattr(agent.trainable_model, '_make_train_function'):
+                    # Keras creates the optimizer weights with its train function
+                    agent.trainable_model._make_train_function()
+                _optimizer(agent).set_weights([data['optimizer_{}'.format(i)] for i in range(meta['optimizer'])])
+            if meta['memory']:
+                agent.memory.set_state({key[len('memory_'):]: data[key] for key in data.files if key.startswith('memory_')})
+            kind, keys, pos, has_gauss, gauss = (data['random_{}'.format(i)] for i in range(5))
+            np.random.set_state((str(kind), keys, int(pos), int(has_gauss), float(gauss)))
+        self._resume_step = meta['step']
+        self.episode = meta['episode']
+        return meta['step']
+
+    def on_episode_begin(self, episode, logs={}):
+        if self._resume_step is not None:
+            self.model.step = self._resume_step
+            self._resume_step = None
+
+    def on_episode_end(self, episode, logs={}):
+        self.episode += 1
+
+    def on_step_end(self, step, logs={}):
+        # agent.step counts the steps before this one
+        if (self.model.step + 1) % self.interval == 0:
+            self.save(self.model.step + 1)
+
+    def on_train_end(self, logs={}):
+        self.save(self.model.step, wait=True)
+        self.close()
+
+    def save(self, step, wait=False):
+        agent = self.model
+        arrays = {}
+        meta = {'step': int(step), 'episode': self.episode, 'time': time.time()}
+        for name, weights in (('model', agent.model.get_weights()),
+                              ('target', agent.target_model.get_weights()),
+                              ('optimizer', _optimizer(agent).get_weights())):
+            meta[name] = len(weights)
+            for i, w in enumerate(weights):
+                arrays['{}_{}'.format(name, i)] = w
+        meta['memory'] = hasattr(agent.memory, 'get_state')
+        if meta['memory']:
+            for key, value in agent.memory.get_state().items():
+                arrays['memory_' + key] = value
+        for i, value in enumerate(np.random.get_state()):
+            arrays['random_{}'.format(i)] = np.asarray(value)
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        if self._writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        try:
+            if wait:
+                self._pending.put((step, arrays))
+            else:
+                self._pending.put_nowait((step, arrays))
+        except queue.Full:
+            self.skipped += 1
+
+    def close(self):
+        # Waits for the checkpoint being written
+        if self._writer is None:
+            return
+        self._pending.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            step, arrays = item
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, os.path.join(self.directory, PATTERN.format(step)))
+            found = checkpoints(self.directory)
+            for path in found[:max(0, len(found) - self.keep)]:
+                os.remove(path)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from gym import error
+
+# What the agents rely on: every observation an env hands out is an ndarray
+# of the dtype and shape of its observation_space, so that nothing has to
+# be converted in the agent loop.
+
+def check_observation(space, observation, origin='observation'):
+    if not isinstance(observation, np.ndarray):
+        raise error.Error("{} is a {}, not an ndarray".format(origin, type(observation).__name__))
+    if observation.dtype != space.dtype:
+        raise error.Error("{} is {}, the observation space is {}".format(origin, observation.dtype, space.dtype))
+    if observation.shape != space.shape:
+        raise error.Error("{} has the shape {}, the observation space {}".format(origin, observation.shape, space.shape))
+
+def check_env(env, steps=100, seed=0):
+    # Resets and steps `env` with random actions, checking every observation
+    # it returns. With copy_obs, two observations must not share memory
+    rng = np.random.RandomState(seed)
+    space = env.observation_space
+    observation = env.reset()
+    check_observation(space, observation, 'reset()')
+    for _ in range(steps):
+        previous = observation
+        observation, _, done, _ = env.step(rng.randint(env.action_space.n))
+        check_observation(space, observation, 'step()')
+        if getattr(env, 'copy_obs', False) and np.shares_memory(previous, observation):
+            raise error.Error("step() returned the buffer of the previous observation with copy_obs")
+        if done:
+            observation = env.reset()
+            check_observation(space, observation, 'reset()')
+    return steps
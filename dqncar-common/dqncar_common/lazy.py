@@ -0,0 +1,19 @@
+import importlib
+import sys
+
+def lazy_attributes(package, attributes):
+    # __getattr__ and __dir__ for the __init__ of `package`: the attribute
+    # `name` is imported from the module attributes[name] on first access
+    module = sys.modules[package]
+
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError("module {!r} has no attribute {!r}".format(package, name))
+        value = getattr(importlib.import_module(attributes[name]), name)
+        setattr(module, name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(module)) | set(attributes))
+
+    return __getattr__, __dir__
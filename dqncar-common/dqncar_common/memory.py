@@ -0,0 +1,302 @@
+import os
+import tempfile
+
+import numpy as np
+
+from rl.agents.dqn import DQNAgent
+from rl.memory import Memory, Experience
+
+class SumTree:
+    # Binary tree of priorities in one array, leaves at [capacity,
+    # 2*capacity) and each node holding the sum of its two children.
+    # Updates and searches run on whole batches, one level at a time
+    def __init__(self, size):
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, slots):
+        return self.tree[np.asarray(slots) + self.capacity]
+
+    def update(self, slots, priorities):
+        nodes = np.asarray(slots) + self.capacity
+        self.tree[nodes] = priorities
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+
+    def find(self, values):
+        # Slots whose cumulated priorities bracket each value
+        values = np.array(values, dtype=float)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = self.tree[2*nodes]
+            right = values >= left
+            values -= left * right
+            nodes = 2*nodes + right
+        return nodes - self.capacity
+
+class NumpyMemory(Memory):
+    # Drop-in replacement for keras-rl's SequentialMemory: the same
+    # experiences, with the same episode boundaries, out of preallocated
+    # ring buffers sampled a batch at a time.
+    #
+    # With prioritized=True transitions are drawn in proportion to
+    # (|TD error| + epsilon)^alpha (Schaul et al., 2015), new ones with the
+    # highest priority seen so far. sample_batch() then also returns the
+    # importance sampling weights, with beta annealed to 1 over
+    # `beta_steps` batches, and the learner hands the TD errors back to
+    # update_priorities(), which is what NumpyDQNAgent does.
+    def __init__(self, limit, prioritized=False, alpha=0.6, beta=0.4, beta_steps=None, epsilon=1e-6, **kwargs):
+        super(NumpyMemory, self).__init__(**kwargs)
+        self.limit = limit
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_start = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.observations = None
+        self.actions = np.zeros(limit, dtype=np.int32)
+        self.rewards = np.zeros(limit, dtype=np.float32)
+        self.terminals = np.zeros(limit, dtype=bool)
+        self.start = 0
+        self.length = 0
+        self.batches = 0
+        self.max_priority = 1.0
+        self.tree = SumTree(limit) if prioritized else None
+        self.last_slots = None
+
+    @property
+    def nb_entries(self):
+        return self.length
+
+    def _slots(self, idxs):
+        # Ring slots of positions counted from the oldest entry
+        return (self.start + idxs) % self.limit
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super(NumpyMemory, self).append(observation, action, reward, terminal, training=training)
+        if not training:
+            return
+        if self.observations is None:
+            observation = np.asarray(observation)
+            self.observations = np.zeros((self.limit,) + observation.shape, dtype=np.float32)
+        if self.length < self.limit:
+            slot = self.length
+            self.length += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.limit
+        self.observations[slot] = observation
+        self.actions[slot] = action
+        self.rewards[slot] = reward
+        self.terminals[slot] = terminal
+        if self.prioritized:
+            self._prioritize_last()
+
+    def _prioritize_last(self):
+        # The newest transition waits for its next observation, the one
+        # before is now complete, and the oldest ones lack the history for
+        # a full window
+        n = self.length
+        slots = [self._slots(n - 1)]
+        priorities = [0.0]
+        if n >= 2 and n - 2 >= self.window_length:
+            previous = self._slots(n - 2)
+            slots.append(previous)
+            # keras-rl skips the action taken on the observation that ended an episode
+            priorities.append(0.0 if self.terminals[self._slots(n - 3)] else self.max_priority ** self.alpha)
+        if self.length == self.limit:
+            slots.append(self._slots(self.window_length - 1))
+            priorities.append(0.0)
+        self.tree.update(slots, priorities)
+
+    def _draw(self, batch_size):
+        # Positions idx of the sampled transitions (idx - 1 -> idx) and their
+        # weights, with the same valid range as SequentialMemory
+        low = self.window_length + 1
+        if self.length <= low:
+            raise ValueError("Not enough entries in the memory to sample from")
+        if not self.prioritized:
+            idxs = np.random.randint(low, self.length, size=batch_size)
+            bad = self.terminals[self._slots(idxs - 2)]
+            while bad.any():
+                idxs[bad] = np.random.randint(low, self.length, size=bad.sum())
+                bad = self.terminals[self._slots(idxs - 2)]
+            return idxs, np.ones(batch_size, dtype=np.float32)
+
+        if self.beta_steps:
+            self.beta = min(1.0, self.beta_start + (1.0 - self.beta_start) * self.batches / self.beta_steps)
+        self.batches += 1
+        total = self.tree.total
+        # One draw in each of batch_size equal slices of the priorities
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * (total / batch_size)
+        slots = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        bad = self.tree[slots] <= 0.0
+        while bad.any():
+            # Rounding landed on an empty leaf
+            slots[bad] = self.tree.find(np.random.uniform(0, total, size=bad.sum()))
+            bad = self.tree[slots] <= 0.0
+        probabilities = self.tree[slots] / total
+        weights = (self.length * probabilities) ** -self.beta
+        idxs = (slots - self.start) % self.limit + 1
+        return idxs, (weights / weights.max()).astype(np.float32)
+
+    def sample_batch(self, batch_size):
+        # (state0, actions, rewards, state1, terminal1, weights) arrays
+        idxs, weights = self._draw(batch_size)
+        self.last_slots = self._slots(idxs - 1)
+        window = self.window_length
+        state0 = np.zeros((batch_size, window) + self.observations.shape[1:], dtype=np.float32)
+        state0[:, -1] = self.observations[self.last_slots]
+        # Older observations until the start of the episode, zeros before
+        keep = np.ones(batch_size, dtype=bool)
+        for offset in range(window - 1):
+            current = idxs - 2 - offset
+            if not self.ignore_episode_boundaries:
+                keep &= ~self.terminals[self._slots(current - 1)]
+            state0[keep, -2 - offset] = self.observations[self._slots(current[keep])]
+        state1 = np.empty_like(state0)
+        state1[:, :-1] = state0[:, 1:]
+        state1[:, -1] = self.observations[self._slots(idxs)]
+        return (state0, self.actions[self.last_slots], self.rewards[self.last_slots], state1,
+                self.terminals[self.last_slots], weights)
+
+    def sample(self, batch_size, batch_idxs=None):
+        # keras-rl interface, one Experience per transition for the stock
+        # DQNAgent, NumpyDQNAgent goes through sample_batch() instead
+        if batch_idxs is not None:
+            raise ValueError("NumpyMemory draws its own batch indexes")
+        state0, actions, rewards, state1, terminal1, _ = self.sample_batch(batch_size)
+        return [Experience(state0=state0[i], action=actions[i], reward=rewards[i],
+                           state1=state1[i], terminal1=terminal1[i]) for i in range(batch_size)]
+
+    def update_priorities(self, td_errors, slots=None):
+        # Priorities of the last sampled batch, unless told otherwise
+        slots = self.last_slots if slots is None else slots
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(slots, priorities ** self.alpha)
+
+    def get_state(self):
+        # Copies of the buffers, to be saved while the memory keeps filling
+        state = {
+            'actions': self.actions.copy(),
+            'rewards': self.rewards.copy(),
+            'terminals': self.terminals.copy(),
+            'state': np.array([self.limit, self.start, self.length, self.batches]),
+            'max_priority': np.array(self.max_priority),
+        }
+        if self.observations is not None:
+            state['observations'] = self.observations.copy()
+        if self.prioritized:
+            state['tree'] = self.tree.tree.copy()
+        return state
+
+    def set_state(self, state):
+        limit, start, length, batches = state['state']
+        if limit != self.limit:
+            raise ValueError("The state holds a memory of {} entries, this one has {}".format(limit, self.limit))
+        self.actions[:] = state['actions']
+        self.rewards[:] = state['rewards']
+        self.terminals[:] = state['terminals']
+        self.observations = np.array(state['observations']) if 'observations' in state else None
+        self.start, self.length, self.batches = int(start), int(length), int(batches)
+        self.max_priority = float(state['max_priority'])
+        if self.prioritized:
+            if 'tree' in state:
+                self.tree.tree[:] = state['tree']
+            else:
+                # Saved without priorities, every transition starts equal
+                self.tree.tree[:] = 0.0
+                self._prioritize_all()
+        if self.beta_steps:
+            self.beta = min(1.0, self.beta_start + (1.0 - self.beta_start) * self.batches / self.beta_steps)
+
+    def save(self, path):
+        # One .npz file, written next to its destination then moved in place
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **self.get_state())
+        os.replace(tmp, path)
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.set_state(data)
+
+    def _prioritize_all(self):
+        idxs = np.arange(self.window_length + 1, self.length)
+        priorities = np.where(self.terminals[self._slots(idxs - 2)], 0.0, self.max_priority ** self.alpha)
+        if len(idxs):
+            self.tree.update(self._slots(idxs - 1), priorities)
+
+    def get_config(self):
+        config = super(NumpyMemory, self).get_config()
+        config['limit'] = self.limit
+        config['prioritized'] = self.prioritized
+        config['alpha'] = self.alpha
+        config['beta'] = self.beta_start
+        config['beta_steps'] = self.beta_steps
+        config['epsilon'] = self.epsilon
+        return config
+
+class NumpyDQNAgent(DQNAgent):
+    # DQNAgent learning from NumpyMemory.sample_batch(): the batch stays in
+    # arrays from the memory to train_on_batch. With a prioritized memory the
+    # loss is weighted by the importance sampling weights and the TD errors go
+    # back to the memory, otherwise the weights are all ones
+    def backward(self, reward, terminal):
+        if self.step % self.memory_interval == 0:
+            self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
+                               training=self.training)
+
+        metrics = [np.nan for _ in self.metrics_names]
+        if not self.training:
+            return metrics
+
+        if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            metrics = self.train_batch()
+
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.update_target_model_hard()
+
+        return metrics
+
+    def train_batch(self):
+        # One gradient step on a batch of the memory, returns the metrics
+        state0, actions, rewards, state1, terminal1, weights = self.memory.sample_batch(self.batch_size)
+        state0 = self.process_state_batch(state0)
+        state1 = self.process_state_batch(state1)
+        batch = np.arange(self.batch_size)
+
+        if self.enable_double_dqn:
+            best = np.argmax(self.model.predict_on_batch(state1), axis=1)
+            q_batch = self.target_model.predict_on_batch(state1)[batch, best]
+        else:
+            q_batch = np.max(self.target_model.predict_on_batch(state1), axis=1).flatten()
+        Rs = rewards + self.gamma * q_batch * ~terminal1
+
+        targets = np.zeros((self.batch_size, self.nb_actions), dtype=np.float32)
+        masks = np.zeros((self.batch_size, self.nb_actions), dtype=np.float32)
+        targets[batch, actions] = Rs
+        masks[batch, actions] = 1.
+        dummy_targets = Rs.astype(np.float32)
+
+        if self.memory.prioritized:
+            q_values = self.model.predict_on_batch(state0)
+            self.memory.update_priorities(Rs - q_values[batch, actions])
+
+        ins = [state0] if type(self.model.input) is not list else state0
+        metrics = self.trainable_model.train_on_batch(ins + [targets, masks], [dummy_targets, targets],
+                                                      sample_weight=[weights, weights])
+        metrics = [metric for idx, metric in enumerate(metrics) if idx not in (1, 2)]
+        metrics += self.policy.metrics
+        if self.processor is not None:
+            metrics += self.processor.metrics
+        return metrics
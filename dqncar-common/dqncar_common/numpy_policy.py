@@ -0,0 +1,176 @@
+import argparse
+import importlib
+
+import numpy as np
+
+# Q-networks of the training scripts evaluated with numpy alone: the dense
+# layers of a Sequential model, optionally topped by the dueling head
+# keras-rl adds (enable_dueling_network). Nothing here imports Keras, the
+# weights come from the .h5f files of DQNAgent.save_weights() or from
+# model.get_weights().
+
+ACTIVATIONS = ('relu', 'linear', 'sigmoid', 'tanh')
+
+def load_weights(path):
+    # [(kernel, bias)] of the layers holding weights, in the order of the model
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading Keras weights needs h5py (pip install h5py)")
+    layers = []
+    with h5py.File(path, 'r') as f:
+        if 'layer_names' not in f.attrs and 'model_weights' in f:
+            # A whole model saved with model.save()
+            f = f['model_weights']
+        for name in f.attrs['layer_names']:
+            group = f[name]
+            weights = [np.array(group[weight_name]) for weight_name in group.attrs['weight_names']]
+            if weights:
+                if len(weights) != 2:
+                    raise ValueError("Layer {} holds {} arrays, only Dense layers are supported".format(name, len(weights)))
+                layers.append((weights[0], weights[1]))
+    return layers
+
+class QNetwork:
+    # Dense layers with `activation` between them and `output_activation`
+    # after the last one. With a `dueling_type` ('avg', 'max' or 'naive')
+    # the last layer outputs V and the advantages, combined like keras-rl's
+    # dueling Lambda layer. Activations live in buffers allocated once per
+    # batch size.
+    def __init__(self, layers, activation='relu', output_activation='linear', dueling_type=None):
+        for name in (activation, output_activation):
+            if name not in ACTIVATIONS:
+                raise ValueError("Unsupported activation: {}".format(name))
+        if dueling_type not in (None, 'avg', 'max', 'naive'):
+            raise ValueError("Unknown dueling type: {}".format(dueling_type))
+        self.kernels = [np.ascontiguousarray(kernel, dtype=np.float32) for kernel, _ in layers]
+        self.biases = [np.asarray(bias, dtype=np.float32) for _, bias in layers]
+        self.activations = [activation] * (len(layers) - 1) + [output_activation]
+        self.dueling_type = dueling_type
+        self.input_size = self.kernels[0].shape[0]
+        self.nb_actions = self.kernels[-1].shape[1] - (1 if dueling_type else 0)
+        self._buffers = {}
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(load_weights(path), **kwargs)
+
+    @classmethod
+    def from_weights(cls, weights, **kwargs):
+        # The list of model.get_weights(): kernel, bias, kernel, bias...
+        return cls(list(zip(weights[::2], weights[1::2])), **kwargs)
+
+    def set_weights(self, weights):
+        for i, (kernel, bias) in enumerate(zip(weights[::2], weights[1::2])):
+            self.kernels[i][:] = kernel
+            self.biases[i][:] = bias
+
+    def _allocate(self, batch_size):
+        buffers = [np.empty((batch_size, kernel.shape[1]), dtype=np.float32) for kernel in self.kernels]
+        if self.dueling_type:
+            buffers.append(np.empty((batch_size, self.nb_actions), dtype=np.float32))
+        self._buffers[batch_size] = buffers
+        return buffers
+
+    def predict(self, states):
+        # Q-values of a batch of states, each flattened like the Flatten
+        # input layer does. The result is reused by the next call
+        x = np.asarray(states, dtype=np.float32).reshape(len(states), self.input_size)
+        buffers = self._buffers.get(len(x)) or self._allocate(len(x))
+        for kernel, bias, activation, out in zip(self.kernels, self.biases, self.activations, buffers):
+            np.dot(x, kernel, out=out)
+            out += bias
+            if activation == 'relu':
+                np.maximum(out, 0.0, out=out)
+            elif activation == 'sigmoid':
+                np.negative(out, out=out)
+                np.exp(out, out=out)
+                out += 1.0
+                np.reciprocal(out, out=out)
+            elif activation == 'tanh':
+                np.tanh(out, out=out)
+            x = out
+        if not self.dueling_type:
+            return x
+        q = buffers[-1]
+        advantages = x[:, 1:]
+        if self.dueling_type == 'avg':
+            np.subtract(advantages, advantages.mean(axis=1, keepdims=True), out=q)
+        elif self.dueling_type == 'max':
+            np.subtract(advantages, advantages.max(axis=1, keepdims=True), out=q)
+        else:
+            q[:] = advantages
+        q += x[:, :1]
+        return q
+
+    def act(self, states):
+        # Greedy actions of a batch of states
+        return np.argmax(self.predict(states), axis=1)
+
+class NumpyAgent:
+    # Greedy policy on a QNetwork standing in for DQNAgent.forward() and
+    # DQNAgent.test(): it keeps the last `window_length` observations of
+    # the episode like keras-rl's memory does, zeros before its start
+    def __init__(self, network, window_length=1):
+        self.network = network
+        self.window_length = window_length
+        self.state = None
+
+    def reset_states(self):
+        self.state = None
+
+    def forward(self, observation):
+        observation = np.asarray(observation, dtype=np.float32)
+        if self.state is None:
+            self.state = np.zeros((1, self.window_length) + observation.shape, dtype=np.float32)
+        self.state[0, :-1] = self.state[0, 1:]
+        self.state[0, -1] = observation
+        return int(self.network.act(self.state)[0])
+
+    def test(self, env, nb_episodes=1, nb_max_episode_steps=None, visualize=True, verbose=1):
+        history = {'episode_reward': [], 'nb_steps': []}
+        for episode in range(nb_episodes):
+            self.reset_states()
+            observation = env.reset()
+            episode_reward, episode_step, done = 0.0, 0, False
+            while not done:
+                if visualize:
+                    env.render()
+                observation, reward, done, _ = env.step(self.forward(observation))
+                episode_reward += reward
+                episode_step += 1
+                if nb_max_episode_steps and episode_step >= nb_max_episode_steps:
+                    done = True
+            if verbose:
+                print('Episode {}: reward: {:.3f}, steps: {}'.format(episode + 1, episode_reward, episode_step))
+            history['episode_reward'].append(episode_reward)
+            history['nb_steps'].append(episode_step)
+        return history
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive an env with the Q-network of a weights file, without Keras")
+    parser.add_argument('weights', help="weights saved by DQNAgent.save_weights()")
+    parser.add_argument('--env', default='carsim-v0', help="gym id, its package gym_<name> gets imported")
+    parser.add_argument('--port', help="serial port of the car, for arduino-v0")
+    parser.add_argument('--frames', type=int, default=1, help="stack the last FRAMES observations like WrapThreeFrames")
+    parser.add_argument('--dueling', choices=['avg', 'max', 'naive'], help="dueling type the agent was built with")
+    parser.add_argument('--output-activation', default='linear', choices=ACTIVATIONS)
+    parser.add_argument('--episodes', type=int, default=5)
+    parser.add_argument('--max-steps', type=int, default=10000)
+    parser.add_argument('--render', action='store_true')
+    args = parser.parse_args()
+
+    import gym
+    importlib.import_module('gym_' + args.env.split('-')[0])
+    env = gym.make(args.env).unwrapped
+    if args.port:
+        env.connect_to(args.port)
+    if args.frames > 1:
+        from dqncar_common.wrappers import FrameStack
+        env = FrameStack(env, args.frames, fill=1.0)
+    network = QNetwork.load(args.weights, output_activation=args.output_activation, dueling_type=args.dueling)
+    NumpyAgent(network).test(env, nb_episodes=args.episodes, nb_max_episode_steps=args.max_steps, visualize=args.render)
+    env.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from time import perf_counter
+
+class Profiler:
+    # Per phase timers and counters of an env. A profiled call goes through
+    # start(), one lap() at the end of each phase, count() for its counters
+    # and stop(), which folds the call into the totals and returns its own
+    # figures for the info dict.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.seconds = {}
+        self.counters = {}
+        self._phases = {}
+        self._counts = {}
+        self._time = None
+
+    def start(self):
+        self._phases = {}
+        self._counts = {}
+        self._time = perf_counter()
+
+    def lap(self, phase):
+        now = perf_counter()
+        self._phases[phase] = self._phases.get(phase, 0.0) + now - self._time
+        self._time = now
+
+    def count(self, name, value=1):
+        self._counts[name] = self._counts.get(name, 0) + value
+
+    def stop(self, section):
+        self.calls[section] = self.calls.get(section, 0) + 1
+        seconds = self.seconds.setdefault(section, {})
+        for phase, elapsed in self._phases.items():
+            seconds[phase] = seconds.get(phase, 0.0) + elapsed
+        counters = self.counters.setdefault(section, {})
+        for name, value in self._counts.items():
+            counters[name] = counters.get(name, 0) + value
+        profile = dict(self._phases)
+        profile.update(self._counts)
+        return profile
+
+    def report(self):
+        # {section: {'calls', 'seconds', 'phases': {phase: {'seconds',
+        # 'mean_us', 'share'}}, 'counters': {name: mean per call}}}
+        report = {}
+        for section, calls in self.calls.items():
+            seconds = self.seconds[section]
+            total = sum(seconds.values())
+            report[section] = {
+                'calls': calls,
+                'seconds': total,
+                'phases': {phase: {'seconds': elapsed,
+                                   'mean_us': elapsed / calls * 1e6,
+                                   'share': elapsed / total if total else 0.0}
+                           for phase, elapsed in seconds.items()},
+                'counters': {name: value / float(calls) for name, value in self.counters[section].items()},
+            }
+        return report
+
+    def format_report(self):
+        lines = []
+        for section, stats in sorted(self.report().items()):
+            lines.append('{} ({} calls, {:.3f}s)'.format(section, stats['calls'], stats['seconds']))
+            for phase, phase_stats in sorted(stats['phases'].items(), key=lambda item: -item[1]['seconds']):
+                lines.append('  {:<16s} {:>10.1f}us {:>6.1%}'.format(phase, phase_stats['mean_us'], phase_stats['share']))
+            for name, mean in sorted(stats['counters'].items()):
+                lines.append('  {:<16s} {:>10.1f} per call'.format(name, mean))
+        return '\n'.join(lines)
@@ -0,0 +1,229 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import gym
+import numpy as np
+
+from gym import error
+
+# A log is a directory holding meta.json and chunk-000000.bin,
+# chunk-000001.bin... Each chunk is up to `chunk_size` fixed size records
+# of `dtype` appended one after the other without any header, so that a
+# chunk maps straight onto a numpy array. A record is the result of one
+# reset() (action -1) or step() of the env:
+#
+#   obs        the observation returned by the call
+#   action     the action of the step, -1 for a reset
+#   reward     0 for a reset
+#   done
+#   time       time.time() when the call started
+#   latency    seconds spent in the call
+#   episode    counts the resets since the log was created
+#
+# Only whole records count, what a crash leaves after the last one is
+# dropped when the log is opened again.
+FORMAT_VERSION = 1
+META = 'meta.json'
+CHUNK = 'chunk-{:06d}.bin'
+
+def record_dtype(obs_shape, obs_dtype=np.float32):
+    return np.dtype([
+        ('obs', obs_dtype, tuple(obs_shape)),
+        ('action', np.int32),
+        ('reward', np.float32),
+        ('done', np.bool_),
+        ('time', np.float64),
+        ('latency', np.float32),
+        ('episode', np.uint32),
+    ])
+
+def _read_meta(path):
+    with open(os.path.join(path, META)) as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise error.Error("Transition log {} has format version {}, expected {}".format(path, meta['version'], FORMAT_VERSION))
+    # json turns the tuples of the dtype description into lists
+    meta['dtype'] = np.dtype([(field[0], field[1], tuple(field[2])) if len(field) == 3 else tuple(field)
+                              for field in meta['dtype']])
+    return meta
+
+def _chunk_paths(path):
+    names = sorted(name for name in os.listdir(path) if name.startswith('chunk-') and name.endswith('.bin'))
+    return [os.path.join(path, name) for name in names]
+
+class TransitionLog:
+    # Appends records to a log. append() only fills an in-memory buffer,
+    # full buffers are written by a background thread so that the caller
+    # never waits on the disk
+    def __init__(self, path, obs_shape, obs_dtype=np.float32, chunk_size=1 << 16,
+                 buffer_size=1024, metadata=None):
+        self.path = path
+        self.dtype = record_dtype(obs_shape, obs_dtype)
+        if os.path.exists(os.path.join(path, META)):
+            meta = _read_meta(path)
+            if meta['dtype'] != self.dtype:
+                raise error.Error("Transition log {} holds records of another shape: {}".format(path, meta['dtype']))
+            chunk_size = meta['chunk_size']
+        else:
+            os.makedirs(path, exist_ok=True)
+            meta = {
+                'version': FORMAT_VERSION,
+                'dtype': np.lib.format.dtype_to_descr(self.dtype),
+                'chunk_size': chunk_size,
+                'created': time.time(),
+                'metadata': metadata or {},
+            }
+            with open(os.path.join(path, META), 'w') as f:
+                json.dump(meta, f, indent=2)
+        self.chunk_size = chunk_size
+        self.chunk, self.chunk_records, self.episode = self._recover()
+
+        self._buffer = np.zeros(buffer_size, self.dtype)
+        self._count = 0
+        self._buffers = queue.Queue()
+        # What stopped the writer thread, raised again to the caller
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        self.closed = False
+        atexit.register(self.close)
+
+    def _recover(self):
+        # Continues after the last whole record of an existing log
+        chunks = _chunk_paths(self.path)
+        if not chunks:
+            return 0, 0, 0
+        last = chunks[-1]
+        records = os.path.getsize(last) // self.dtype.itemsize
+        with open(last, 'r+b') as f:
+            f.truncate(records * self.dtype.itemsize)
+        episode = 0
+        if records:
+            tail = np.memmap(last, dtype=self.dtype, mode='r', offset=(records - 1) * self.dtype.itemsize, shape=(1,))
+            episode = int(tail['episode'][0])
+            del tail
+        return len(chunks) - 1, records, episode
+
+    def append(self, obs, action, reward, done, started, latency):
+        self._check()
+        if action < 0:
+            self.episode += 1
+        self._buffer[self._count] = (obs, action, reward, done, started, latency, self.episode)
+        self._count += 1
+        if self._count == len(self._buffer):
+            self._swap()
+
+    def _swap(self):
+        self._buffers.put(self._buffer[:self._count])
+        self._buffer = np.zeros(len(self._buffer), self.dtype)
+        self._count = 0
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        # Waits until everything appended so far is on disk
+        if self._count:
+            self._swap()
+        self._buffers.join()
+        self._check()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        try:
+            self.flush()
+        finally:
+            self._buffers.put(None)
+            self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            records = self._buffers.get()
+            if records is None:
+                self._buffers.task_done()
+                return
+            try:
+                # After a failure the buffers are dropped, the caller gets the error
+                if self._error is None:
+                    self._write(records)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._buffers.task_done()
+
+    def _write(self, records):
+        while len(records):
+            if self.chunk_records == self.chunk_size:
+                self.chunk += 1
+                self.chunk_records = 0
+            room = self.chunk_size - self.chunk_records
+            with open(os.path.join(self.path, CHUNK.format(self.chunk)), 'ab') as f:
+                f.write(records[:room].tobytes())
+            self.chunk_records += len(records[:room])
+            records = records[room:]
+
+class TransitionLogReader:
+    # Maps the chunks of a log read-only, records are read without copies
+    def __init__(self, path):
+        self.path = path
+        meta = _read_meta(path)
+        self.dtype = meta['dtype']
+        self.metadata = meta['metadata']
+        self.chunks = []
+        for chunk in _chunk_paths(path):
+            records = os.path.getsize(chunk) // self.dtype.itemsize
+            if records:
+                self.chunks.append(np.memmap(chunk, dtype=self.dtype, mode='r', shape=(records,)))
+        self._starts = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        chunk = np.searchsorted(self._starts, index, side='right') - 1
+        return self.chunks[chunk][index - self._starts[chunk]]
+
+    def records(self):
+        # All the records in one array, this one copies
+        if not self.chunks:
+            return np.zeros(0, self.dtype)
+        return np.concatenate(self.chunks)
+
+class TransitionRecorder(gym.Wrapper):
+    # Logs every reset() and step() of the wrapped env to a TransitionLog.
+    # Appending to the log costs a few microseconds, the disk is only
+    # touched by the writer thread
+    def __init__(self, env, path, chunk_size=1 << 16, buffer_size=1024, metadata=None):
+        super(TransitionRecorder, self).__init__(env)
+        self.log = TransitionLog(path, env.observation_space.shape, chunk_size=chunk_size,
+                                 buffer_size=buffer_size, metadata=metadata)
+
+    def reset(self, **kwargs):
+        started = time.time()
+        t = time.perf_counter()
+        obs = self.env.reset(**kwargs)
+        self.log.append(obs, -1, 0.0, False, started, time.perf_counter() - t)
+        return obs
+
+    def step(self, action):
+        started = time.time()
+        t = time.perf_counter()
+        obs, reward, done, info = self.env.step(action)
+        self.log.append(obs, action, reward, done, started, time.perf_counter() - t)
+        return obs, reward, done, info
+
+    def close(self):
+        self.log.close()
+        return self.env.close()
@@ -0,0 +1,37 @@
+import gym
+import numpy as np
+from gym import spaces
+
+class FrameStack(gym.Wrapper):
+    # Observations of the last `k` steps, oldest first, flattened. Each frame
+    # is written twice in a float32 ring of 2*k frames so that the last k
+    # are always contiguous: the observation is a view on the ring, valid
+    # until the next step, nothing is allocated per step.
+    #
+    # reset() starts the history over, filled with `fill` or, when None,
+    # with the first observation.
+    def __init__(self, env, k=3, fill=None):
+        super(FrameStack, self).__init__(env)
+        self.k = k
+        self.fill = fill
+        space = env.observation_space
+        self.observation_space = spaces.Box(low=np.tile(space.low, k), high=np.tile(space.high, k), dtype=np.float32)
+        self.frames = np.empty((2*k,) + space.shape, dtype=np.float32)
+        self.head = 0
+        self._views = [self.frames[h:h+k].reshape(-1) for h in range(k)]
+
+    def _push(self, obs):
+        self.frames[self.head] = obs
+        self.frames[self.head + self.k] = obs
+        self.head = (self.head + 1) % self.k
+        return self._views[self.head]
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self.frames[:] = obs if self.fill is None else self.fill
+        self.head = 0
+        return self._push(obs)
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        return self._push(obs), reward, done, info
@@ -0,0 +1,9 @@
+from setuptools import setup
+
+setup(name='dqncar_common',
+      version='0.0.1',
+      packages=['dqncar_common'],
+      install_requires=['gym', 'numpy'],  # Code shared by the simulator and the car
+      # memory and checkpoint build on keras-rl, numpy_policy reads .h5f weights with h5py
+      extras_require={'training': ['keras-rl', 'h5py']}
+)
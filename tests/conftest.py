@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The packages and scripts of the steps, importable without installing them.
+# The last ones win, Step-3's main.py over Step-4's
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ('Step-4-TrainingOverBLE/training', 'dqncar-common', 'Step-3-DeepQLearning/gym-carsim',
+             'Step-4-TrainingOverBLE/training/gym-arduino', 'Step-3-DeepQLearning'):
+    path = os.path.join(ROOT, path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture(autouse=True)
+def carsim_cache(tmp_path, monkeypatch):
+    # Compiled scenarios and distance fields go to the test's directory,
+    # not to the user's ~/.cache/gym_carsim
+    monkeypatch.setenv('GYM_CARSIM_CACHE', str(tmp_path / 'carsim_cache'))
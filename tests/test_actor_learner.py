@@ -0,0 +1,51 @@
+import multiprocessing
+
+import numpy as np
+
+from actor_learner import TransitionRing
+
+class ListMemory:
+    def __init__(self):
+        self.entries = []
+
+    def append(self, observation, action, reward, terminal):
+        self.entries.append((float(observation[0]), action, reward, terminal))
+
+def act(ring, steps, first):
+    # One episode the way the actors write it: each step then the last
+    # observation, with the rewards first, first+1...
+    stop = [False]
+    for i in range(steps):
+        assert ring.push(np.full(2, first + i), i % 3, stop)
+        ring.finish(float(first + i), i == steps - 1)
+    assert ring.push(np.full(2, first + steps), 0, stop)
+    ring.commit()
+
+def test_drain():
+    ring = TransitionRing(multiprocessing.get_context(), 8, (2,))
+    memory = ListMemory()
+    assert ring.drain(memory) == (0, [])
+
+    act(ring, 3, 0)
+    act(ring, 1, 10)
+    assert ring.drain(memory) == (4, [0.0 + 1.0 + 2.0, 10.0])
+    assert memory.entries == [(0.0, 0, 0.0, False), (1.0, 1, 1.0, False), (2.0, 2, 2.0, True), (3.0, 0, 0.0, False),
+                              (10.0, 0, 10.0, True), (11.0, 0, 0.0, False)]
+
+    # Around the end of the ring, an episode still being written stays there
+    act(ring, 5, 20)
+    stop = [False]
+    ring.push(np.full(2, 30), 0, stop)
+    ring.finish(30.0, False)
+    del memory.entries[:]
+    assert ring.drain(memory) == (5, [20.0 + 21.0 + 22.0 + 23.0 + 24.0])
+    assert [entry[0] for entry in memory.entries] == [20.0, 21.0, 22.0, 23.0, 24.0, 25.0]
+    assert ring.drain(memory) == (0, [])
+
+def test_push_gives_up_on_a_full_ring_once_stopped():
+    ring = TransitionRing(multiprocessing.get_context(), 4, (2,))
+    stop = [False]
+    for i in range(4):
+        assert ring.push(np.zeros(2), 0, stop)
+    stop[0] = True
+    assert not ring.push(np.zeros(2), 0, stop)
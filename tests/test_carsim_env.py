@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pytest
+
+from gym_carsim.envs import CarSimEnv
+from gym_carsim.envs.carsim_env import FRAME_TIME
+
+MODES = [('numpy', 'pymunk'), ('pymunk', 'pymunk'), ('numpy', 'sdf')]
+
+def play(env, actions):
+    # Observations, rewards and dones of `actions`, resetting after a crash
+    trajectory = []
+    for action in actions:
+        observation, reward, done, _ = env.step(action)
+        trajectory.append((observation.copy(), reward, done))
+        if done:
+            trajectory.append((env.reset().copy(), 0.0, False))
+    return trajectory
+
+def assert_same(a, b):
+    assert len(a) == len(b)
+    for (obs_a, reward_a, done_a), (obs_b, reward_b, done_b) in zip(a, b):
+        assert np.array_equal(obs_a, obs_b)
+        assert reward_a == reward_b and done_a == done_b
+
+@pytest.mark.parametrize('sensing, collision', MODES)
+def test_state_round_trip(sensing, collision):
+    env = CarSimEnv(headless=True, sensing=sensing, collision=collision)
+    env.seed(0)
+    env.reset()
+    rng = np.random.RandomState(0)
+    for action in rng.randint(3, size=5):
+        env.step(action)
+    state = env.get_state()
+    observation = env.car.read_sensors().copy()
+    actions = rng.randint(3, size=200)
+    trajectory = play(env, actions)
+    assert any(done for _, _, done in trajectory)
+
+    # Back in time, then in another env of the same scenario
+    assert np.array_equal(env.set_state(state), observation)
+    assert np.array_equal(env.get_state(), state)
+    assert_same(play(env, actions), trajectory)
+    other = CarSimEnv(headless=True, sensing=sensing, collision=collision)
+    other.seed(1)
+    other.reset()
+    assert np.array_equal(other.set_state(state), observation)
+    assert_same(play(other, actions), trajectory)
+
+def test_start_states():
+    env = CarSimEnv(headless=True)
+    env.seed(0)
+    env.reset()
+    state = env.get_state()
+    states = env.start_states(5)
+    assert np.array_equal(env.get_state(), state)
+    # The pops go on from the pool like they would have from the env
+    reference = CarSimEnv(headless=True)
+    reference.seed(0)
+    reference.reset()
+    for start in states:
+        reference.reset()
+        assert np.array_equal(reference.get_state(), start)
+
+@pytest.mark.parametrize('sensing, collision', MODES)
+def test_action_repeat(sensing, collision):
+    # A step of action_repeat=3 is three steps of the same action, cut by a crash
+    repeated = CarSimEnv(headless=True, sensing=sensing, collision=collision, action_repeat=3)
+    single = CarSimEnv(headless=True, sensing=sensing, collision=collision)
+    for env in (repeated, single):
+        env.seed(0)
+        env.reset()
+    crashes = 0
+    for action in np.random.RandomState(0).randint(3, size=100):
+        observation, reward, done, _ = repeated.step(action)
+        total = 0.0
+        for _ in range(3):
+            single_observation, single_reward, single_done, _ = single.step(action)
+            total += single_reward
+            if single_done:
+                break
+        assert np.array_equal(observation, single_observation)
+        assert reward == total and done == single_done
+        assert np.array_equal(repeated.get_state(), single.get_state())
+        if done:
+            crashes += 1
+            repeated.reset()
+            single.reset()
+    assert crashes > 0
+
+def wall(tmp_path, y):
+    # A bare map with a wall across it at `y`
+    path = str(tmp_path / 'wall.json')
+    with open(path, 'w') as f:
+        json.dump({'width': 400, 'height': 400, 'circles': [], 'segments': [[0, y, 400, y, 1]],
+                   'pop_sites': [[200, 100]], 'pop_spread': 1}, f)
+    return path
+
+@pytest.mark.parametrize('substeps', [1, 2, 5])
+def test_substeps_stop_the_car_at_the_wall(tmp_path, substeps):
+    # Driving straight at the wall, the car crashes in the substep that makes
+    # it touch, overlapping it by less than a substep of travel
+    env = CarSimEnv(headless=True, sensing='pymunk', scenario=wall(tmp_path, 302.3), substeps=substeps)
+    env.reset()
+    env.set_state(np.concatenate([[200.0, 100.0, 0.0, 0.0, 50.0, 0.0, 0.0], env.get_state()[7:]]))
+    steps = 0
+    done = False
+    while not done:
+        _, _, done, _ = env.step(2)
+        steps += 1
+    front = env.car.body.position.y + env.car.height / 2.0
+    travel = env.car.velocity * FRAME_TIME / substeps
+    assert 0.0 <= front - (302.3 - 1.0) < travel
+    # Whatever the substeps, the crash ends the same step
+    assert steps == int(np.ceil((302.3 - 1.0 - 125.0) / (env.car.velocity * FRAME_TIME)))
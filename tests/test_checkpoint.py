@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rl')
+
+from dqncar_common.checkpoint import Checkpoint, checkpoints
+from dqncar_common.memory import NumpyMemory
+
+class Weights:
+    # Stands in for a keras model or optimizer
+    def __init__(self, rng, *shapes):
+        self.weights = [np.array(rng.rand(*shape)) for shape in shapes]
+
+    def get_weights(self):
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights):
+        self.weights = [np.array(w) for w in weights]
+
+class Agent:
+    def __init__(self, seed):
+        rng = np.random.RandomState(seed)
+        self.model = Weights(rng, (3, 4), (4,))
+        self.target_model = Weights(rng, (3, 4), (4,))
+        self.trainable_model = Weights(rng)
+        self.trainable_model.optimizer = Weights(rng, (), (3, 4))
+        self.memory = NumpyMemory(50, window_length=1)
+        for _ in range(20 + seed):
+            self.memory.append(rng.rand(3), rng.randint(3), rng.rand(), rng.rand() < 0.1)
+        self.step = 0
+
+def assert_same_weights(a, b):
+    assert len(a.get_weights()) == len(b.get_weights())
+    for x, y in zip(a.get_weights(), b.get_weights()):
+        assert np.array_equal(x, y)
+
+def test_save_and_resume(tmp_path):
+    directory = str(tmp_path / 'checkpoints')
+    agent = Agent(0)
+    checkpoint = Checkpoint(directory)
+    checkpoint.model = agent
+    checkpoint.episode = 7
+    np.random.seed(3)
+    checkpoint.save(1234, wait=True)
+    checkpoint.close()
+    expected = np.random.rand(5)
+
+    resumed = Agent(1)
+    other = Checkpoint(directory)
+    other.model = resumed
+    assert other.resume(resumed) == 1234
+    assert other.episode == 7
+    for name in ('model', 'target_model'):
+        assert_same_weights(getattr(resumed, name), getattr(agent, name))
+    assert_same_weights(resumed.trainable_model.optimizer, agent.trainable_model.optimizer)
+    saved, loaded = agent.memory.get_state(), resumed.memory.get_state()
+    assert sorted(saved) == sorted(loaded)
+    for key in saved:
+        assert np.array_equal(saved[key], loaded[key])
+    # The random state goes on where it was saved
+    assert np.array_equal(np.random.rand(5), expected)
+    # fit() counts from 0 again, the first episode puts the step back
+    other.on_episode_begin(0)
+    assert resumed.step == 1234
+
+def test_resume_without_checkpoint(tmp_path):
+    assert Checkpoint(str(tmp_path / 'none')).resume(Agent(0)) is None
+
+def test_interval_and_prune(tmp_path):
+    directory = str(tmp_path / 'checkpoints')
+    agent = Agent(0)
+    checkpoint = Checkpoint(directory, interval=10, keep=3)
+    checkpoint.model = agent
+    for step in range(25):
+        agent.step = step
+        checkpoint.on_step_end(step)
+    checkpoint.close()
+    # Steps 10 and 20, unless the second one came while the first was written
+    assert len(checkpoints(directory)) + checkpoint.skipped == 2
+    for step in (30, 40, 50, 60):
+        checkpoint.save(step, wait=True)
+    checkpoint.close()
+    assert [os.path.basename(path) for path in checkpoints(directory)] == [
+        'checkpoint-000000040.npz', 'checkpoint-000000050.npz', 'checkpoint-000000060.npz']
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+def test_keep_at_least_one(tmp_path):
+    with pytest.raises(ValueError):
+        Checkpoint(str(tmp_path), keep=0)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from gym_carsim.envs import CarSimEnv
+from gym_carsim.envs.carsim_env import FRAME_TIME
+from gym_carsim.envs.collision import DistanceField, validate_against_pymunk
+
+# Largest fraction of poses where the distance field and pymunk may disagree
+MAX_DISAGREEMENT = 0.005
+
+@pytest.mark.parametrize('collision', ['pymunk', 'sdf'])
+def test_field_agrees_with_pymunk(collision):
+    env = CarSimEnv(headless=True, collision=collision)
+    assert 1.0 - validate_against_pymunk(env, nb_poses=2000) <= MAX_DISAGREEMENT
+
+def test_field_agrees_with_pymunk_near_obstacles():
+    # Car centers at most a half diagonal and a bit from an obstacle
+    env = CarSimEnv(headless=True)
+    assert 1.0 - validate_against_pymunk(env, nb_poses=2000, max_distance=35.0) <= 2 * MAX_DISAGREEMENT
+
+def test_point_distance_matches_distance():
+    env = CarSimEnv(headless=True, collision='sdf')
+    field = env.distance_field
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-10, env.width + 10, 500), rng.uniform(-10, env.height + 10, 500)
+    assert np.array_equal(field.distance(x, y), [field.point_distance(*point) for point in zip(x, y)])
+
+def test_distance_field_of_shapes():
+    field = DistanceField.from_shapes([[50, 50, 10]], [[0, 80, 100, 80, 1]], 100, 100, resolution=1.0)
+    assert field.distance(50, 50) == pytest.approx(-10.0)
+    assert field.distance(50, 30) == pytest.approx(10.0)
+    assert field.distance(20, 80) == pytest.approx(-1.0)
+    assert field.box_collides(50, 38, 0.0, 10, 10)
+    assert not field.box_collides(50, 30, 0.0, 10, 10)
+
+def test_sdf_steps_the_car_without_the_space():
+    env = CarSimEnv(headless=True, collision='sdf', substeps=3)
+    env.seed(0)
+    env.reset()
+    env.space.step = None
+    body = env.car.body
+    position = np.array(body.position)
+    env.step(2)
+    assert np.allclose(body.position, position + np.array(body.velocity) * FRAME_TIME)
+
+def test_sdf_crashes_like_pymunk():
+    # Same episodes with either collision mode, crashes within a frame
+    lengths = {}
+    for collision in ('pymunk', 'sdf'):
+        env = CarSimEnv(headless=True, collision=collision)
+        env.seed(0)
+        rng = np.random.RandomState(0)
+        env.reset()
+        lengths[collision] = []
+        steps = 0
+        while len(lengths[collision]) < 10:
+            _, _, done, _ = env.step(rng.randint(3))
+            steps += 1
+            if done:
+                lengths[collision].append(steps)
+                steps = 0
+                env.reset()
+    assert np.abs(np.subtract(lengths['pymunk'], lengths['sdf'])).max() <= 1
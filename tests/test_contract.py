@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from gym import error, spaces
+
+from dqncar_common.contract import check_env, check_observation
+
+STEPS = 200
+
+def carsim(**kwargs):
+    from gym_carsim.envs import CarSimEnv
+    env = CarSimEnv(headless=True, **kwargs)
+    env.seed(0)
+    return env
+
+def three_frames():
+    from wrappers import WrapThreeFrames
+    return WrapThreeFrames(carsim())
+
+def arduino(protocol, n_sensors, copy_obs, reader=False):
+    from gym_arduino.envs import ArduinoEnv, SimulatedArduino
+    env = ArduinoEnv(n_sensors=n_sensors, protocol=protocol, copy_obs=copy_obs)
+    env.connect_to(SimulatedArduino(n_sensors=n_sensors, env=carsim(), seed=0))
+    if reader:
+        env.start_reader()
+    return env
+
+def replay(directory, copy_obs):
+    from dqncar_common.transition_log import TransitionLog
+    from gym_arduino.envs import ArduinoReplayEnv
+    log = TransitionLog(str(directory), (5,))
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        log.append(rng.rand(5), -1, 0.0, False, 0.0, 0.0)
+        steps = rng.randint(5, 30)
+        for i in range(steps):
+            log.append(rng.rand(5), rng.randint(3), 0.5, i == steps - 1, 0.0, 0.0)
+    log.close()
+    env = ArduinoReplayEnv(str(directory), copy_obs=copy_obs)
+    env.seed(0)
+    return env
+
+@pytest.mark.parametrize('copy_obs', [False, True])
+@pytest.mark.parametrize('collision', ['pymunk', 'sdf'])
+@pytest.mark.parametrize('sensing', ['numpy', 'pymunk'])
+def test_carsim(sensing, collision, copy_obs):
+    env = carsim(sensing=sensing, collision=collision, copy_obs=copy_obs, substeps=2, action_repeat=2)
+    check_env(env, STEPS)
+    env.close()
+
+def test_three_frames():
+    env = three_frames()
+    check_env(env, STEPS)
+    env.close()
+
+@pytest.mark.parametrize('copy_obs', [False, True])
+@pytest.mark.parametrize('protocol, n_sensors, reader', [('ascii', 5, False), ('binary', 3, False), ('binary', 3, True)])
+def test_arduino(protocol, n_sensors, reader, copy_obs):
+    env = arduino(protocol, n_sensors, copy_obs, reader)
+    check_env(env, STEPS)
+    env.close()
+
+@pytest.mark.parametrize('copy_obs', [False, True])
+def test_replay(tmp_path, copy_obs):
+    env = replay(tmp_path, copy_obs)
+    check_env(env, STEPS)
+    env.close()
+
+@pytest.mark.parametrize('copy_obs', [False, True])
+def test_vec_env(copy_obs):
+    from gym_carsim.envs import CarSimVecEnv
+    env = CarSimVecEnv(8, substeps=2, action_repeat=2, copy_obs=copy_obs)
+    env.seed(0)
+    space = spaces.Box(low=0.0, high=1.0, shape=(8, 3), dtype=np.float32)
+    rng = np.random.RandomState(0)
+    previous = env.reset()
+    check_observation(space, previous, 'reset()')
+    for _ in range(STEPS):
+        observations, _, _, _ = env.step(rng.randint(3, size=8))
+        check_observation(space, observations, 'step()')
+        # Without copy_obs every step hands out the same buffer
+        assert np.shares_memory(previous, observations) != copy_obs
+        previous = observations
+
+def test_reused_buffer():
+    env = carsim()
+    first = env.reset()
+    second, _, _, _ = env.step(2)
+    assert first is second
+
+@pytest.mark.parametrize('observation', [
+    [0.5, 0.5, 0.5],
+    np.full(3, 0.5),
+    np.full(4, 0.5, dtype=np.float32),
+    np.array(['0.5', '0.5', '0.5']),
+])
+def test_check_observation_rejects(observation):
+    space = spaces.Box(low=0.0, high=1.0, shape=(3,), dtype=np.float32)
+    with pytest.raises(error.Error):
+        check_observation(space, observation)
@@ -0,0 +1,20 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from dqncar_common.numpy_policy import QNetwork
+from export_arduino import QuantizedNetwork, check_c, quantize_inputs
+
+def network(dueling_type, seed=0):
+    rng = np.random.RandomState(seed)
+    sizes = [9, 16, 16, 3 + (1 if dueling_type else 0)]
+    layers = [(rng.normal(0, 0.5, (n_in, n_out)), rng.normal(0, 0.1, n_out)) for n_in, n_out in zip(sizes, sizes[1:])]
+    return QNetwork(layers, dueling_type=dueling_type)
+
+@pytest.mark.skipif(shutil.which('cc') is None, reason="no C compiler")
+@pytest.mark.parametrize('dueling_type', [None, 'avg', 'max', 'naive'])
+def test_c_build_matches_the_emulator(dueling_type):
+    observations = np.random.RandomState(1).rand(500, 9)
+    quantized = QuantizedNetwork(network(dueling_type), observations)
+    assert check_c(quantized, quantized.header(), quantize_inputs(observations)) == 0
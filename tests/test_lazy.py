@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Run in a fresh interpreter, the test session has imported everything already
+SCRIPT = '''import json, sys
+import {package}
+before = sorted(name for name in sys.modules if name.startswith('{package}.'))
+pymunk = 'pymunk' in sys.modules
+names = dir({package})
+value = getattr({package}, '{name}')
+try:
+    getattr({package}, 'Nothing')
+    missing = False
+except AttributeError:
+    missing = True
+namespace = {{}}
+exec('from {package} import *', namespace)
+print(json.dumps({{
+    'before': before,
+    'pymunk': pymunk,
+    'dir': [name for name in names if not name.startswith('_')],
+    'module': value.__module__,
+    'cached': vars({package})['{name}'] is value,
+    'missing': missing,
+    'star': sorted(name for name in namespace if not name.startswith('_')),
+}}))
+'''
+
+def run(package, name):
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(package=package, name=name)], env=environ,
+                            stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode().splitlines()[-1])
+
+@pytest.mark.parametrize('package, name, module, names', [
+    ('gym_carsim.envs', 'CarSimVecEnv', 'gym_carsim.envs.vec_env', ['CarSimEnv', 'CarSimSubprocVecEnv', 'CarSimVecEnv']),
+    ('gym_arduino.envs', 'ArduinoReplayEnv', 'gym_arduino.envs.replay_env',
+     ['ArduinoEnv', 'ArduinoReplayEnv', 'SimulatedArduino']),
+])
+def test_envs_are_imported_on_first_use(package, name, module, names):
+    result = run(package, name)
+    assert result['before'] == []
+    assert not result['pymunk']
+    assert set(names) <= set(result['dir'])
+    assert result['module'] == module
+    assert result['cached']
+    assert result['missing']
+    assert result['star'] == names
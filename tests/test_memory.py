@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('rl')
+from rl.memory import SequentialMemory
+
+from dqncar_common.memory import NumpyMemory, SumTree
+
+def fill(memories, steps=300, seed=0):
+    rng = np.random.RandomState(seed)
+    for _ in range(steps):
+        observation = rng.rand(3).astype(np.float32)
+        action, reward, terminal = rng.randint(3), rng.rand(), rng.rand() < 0.1
+        for memory in memories:
+            memory.append(observation, action, reward, terminal)
+
+def test_sum_tree():
+    tree = SumTree(5)
+    assert tree.capacity == 8
+    tree.update(np.arange(5), [1.0, 0.0, 2.0, 3.0, 0.5])
+    assert tree.total == pytest.approx(6.5)
+    assert np.array_equal(tree[[0, 2, 4]], [1.0, 2.0, 0.5])
+    # Slot 0 covers [0, 1), slot 2 [1, 3), slot 3 [3, 6) and slot 4 [6, 6.5)
+    values = [0.0, 0.99, 1.0, 2.99, 3.0, 5.99, 6.0, 6.49]
+    assert np.array_equal(tree.find(values), [0, 0, 2, 2, 3, 3, 4, 4])
+    tree.update([3], [0.0])
+    assert tree.total == pytest.approx(3.5)
+    assert np.array_equal(tree.find([3.0]), [4])
+
+@pytest.mark.parametrize('prioritized', [False, True])
+@pytest.mark.parametrize('ignore_episode_boundaries', [False, True])
+@pytest.mark.parametrize('window_length', [1, 4])
+def test_matches_sequential_memory(window_length, ignore_episode_boundaries, prioritized):
+    # 300 transitions through 100 entries, the ring has wrapped around
+    kwargs = dict(window_length=window_length, ignore_episode_boundaries=ignore_episode_boundaries)
+    memory = NumpyMemory(100, prioritized=prioritized, **kwargs)
+    reference = SequentialMemory(100, **kwargs)
+    fill([memory, reference])
+    assert memory.nb_entries == reference.nb_entries
+
+    np.random.seed(0)
+    idxs, _ = memory._draw(256)
+    np.random.seed(0)
+    state0, actions, rewards, state1, terminal1, weights = memory.sample_batch(256)
+    assert np.all(idxs >= window_length + 1) and np.all(idxs < memory.nb_entries)
+    assert not memory.terminals[memory._slots(idxs - 2)].any()
+
+    for i, experience in enumerate(reference.sample(256, batch_idxs=idxs - 1)):
+        assert np.array_equal(state0[i], experience.state0)
+        assert np.array_equal(state1[i], experience.state1)
+        assert actions[i] == experience.action
+        assert rewards[i] == np.float32(experience.reward)
+        assert terminal1[i] == experience.terminal1
+
+def test_priorities():
+    memory = NumpyMemory(100, prioritized=True, window_length=1)
+    fill([memory])
+    np.random.seed(0)
+    memory.sample_batch(32)
+    favourite = memory.last_slots[0]
+    slots = memory._slots(np.arange(memory.window_length, memory.nb_entries - 1))
+    memory.update_priorities(np.where(slots == favourite, 1e3, 1e-3), slots)
+    memory.sample_batch(32)
+    assert np.mean(memory.last_slots == favourite) > 0.9
@@ -0,0 +1,46 @@
+import pytest
+
+def carsim():
+    from gym_carsim.envs import CarSimEnv
+    env = CarSimEnv(headless=True)
+    env.seed(0)
+    return env
+
+def test_carsim():
+    env = carsim()
+    profiler = env.enable_profiling()
+    env.reset()
+    _, _, _, info = env.step(2)
+    assert {'events', 'physics', 'sensing'} <= set(info['profile'])
+    assert profiler.report()['step']['calls'] == 1
+    env.disable_profiling()
+    _, _, _, info = env.step(2)
+    assert 'profile' not in info
+
+@pytest.mark.parametrize('protocol, n_sensors, reader', [('ascii', 5, False), ('binary', 3, False), ('binary', 3, True)])
+def test_arduino(protocol, n_sensors, reader):
+    from gym_arduino.envs import ArduinoEnv, SimulatedArduino
+    env = ArduinoEnv(n_sensors=n_sensors, protocol=protocol)
+    env.connect_to(SimulatedArduino(n_sensors=n_sensors, env=carsim(), seed=0))
+    if reader:
+        env.start_reader()
+    profiler = env.enable_profiling()
+    env.reset()
+    for action in (0, 1, 2):
+        _, _, _, info = env.step(action)
+    # The pipelined calls go through the same timers
+    env.step_async(2)
+    _, _, _, info = env.step_wait()
+    expected = {'write', 'caller', 'wait', 'bytes_written', 'bytes_read'}
+    if not reader:
+        # The reader thread decodes the answers, not step_wait()
+        expected.add('parse')
+    assert set(info['profile']) == expected
+    assert info['profile']['bytes_read'] > 0
+    report = profiler.report()
+    assert report['step']['calls'] == 4
+    assert report['reset']['calls'] == 1
+    env.disable_profiling()
+    _, _, _, info = env.step(2)
+    assert 'profile' not in info
+    env.close()
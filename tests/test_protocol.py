@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from gym import error
+
+from gym_arduino.envs import protocol
+
+class ScriptedPort:
+    # Serial port handing out `chunks` one read at a time, None being a read
+    # that times out with nothing
+    def __init__(self, chunks):
+        self.data = b''
+        self.chunks = list(chunks)
+
+    def read(self, size):
+        while len(self.data) < size and self.chunks:
+            chunk = self.chunks.pop(0)
+            if chunk is None:
+                break
+            self.data += chunk
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+def frames(count, n_sensors=3):
+    rng = np.random.RandomState(0)
+    return [protocol.encode_frame(seq, rng.rand(n_sensors), float(seq), 0) for seq in range(count)]
+
+def test_frame_cut_by_timeout():
+    sent = frames(3)
+    port = ScriptedPort([sent[0], sent[1][:7], None, sent[1][7:] + sent[2]])
+    codec = protocol.FrameCodec(3)
+    assert codec.read_frame(port) == sent[0]
+    with pytest.raises(error.Error):
+        codec.read_frame(port)
+    # The first 7 bytes of the frame were kept, nothing is resynced on
+    assert codec.read_frame(port) == sent[1]
+    assert codec.read_frame(port) == sent[2]
+    assert codec.bytes_dropped == 0
+
+def test_resync_on_garbage_and_corruption():
+    sent = frames(3)
+    corrupted = bytearray(sent[1])
+    corrupted[8] ^= 0xFF
+    port = ScriptedPort([b'\x00\xa5garbage' + sent[0], bytes(corrupted), b'\xa5', sent[2]])
+    codec = protocol.FrameCodec(3)
+    assert codec.read_frame(port) == sent[0]
+    assert codec.read_frame(port) == sent[2]
+    assert codec.bytes_dropped == len(b'\x00\xa5garbage') + len(sent[1]) + 1
+
+def test_decode():
+    codec = protocol.FrameCodec(3)
+    observation = np.zeros(3, dtype=np.float32)
+    reward, flags, seq = codec.decode(protocol.encode_frame(7, [0.25, 0.5, 1.0], -0.8, protocol.FLAG_DONE), observation)
+    assert np.allclose(observation, [0.25, 0.5, 1.0])
+    assert (seq, flags) == (7, protocol.FLAG_DONE)
+    assert reward == pytest.approx(-0.8)
+
+@pytest.mark.parametrize('n_sensors, expected', [(5, 'ascii'), (3, 'auto')])
+def test_default_protocol(n_sensors, expected):
+    from gym_arduino.envs import ArduinoEnv
+    assert ArduinoEnv(n_sensors=n_sensors).protocol == expected
@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+import pymunk
+import pytest
+
+from gym_carsim.envs import CarSimEnv
+from gym_carsim.envs.raycast import RayCaster
+
+WIDTH, HEIGHT = 400, 300
+POSES = 300
+
+def scenario(tmp_path, circles=(), segments=()):
+    path = tmp_path / 'world.json'
+    with open(str(path), 'w') as f:
+        json.dump({'width': WIDTH, 'height': HEIGHT, 'circles': [list(c) for c in circles],
+                   'segments': [list(s) for s in segments], 'pop_sites': [[WIDTH/2, HEIGHT/2]], 'pop_spread': 10}, f)
+    return str(path)
+
+def random_circles(rng, n=40):
+    return np.column_stack([rng.uniform(0, WIDTH, n), rng.uniform(0, HEIGHT, n), rng.uniform(5, 30, n)])
+
+def random_segments(rng, n=20):
+    a = np.column_stack([rng.uniform(0, WIDTH, n), rng.uniform(0, HEIGHT, n)])
+    b = a + rng.uniform(-150, 150, (n, 2))
+    # Horizontal and vertical ones too, flat bounding boxes are their own case
+    b[:5, 1] = a[:5, 1]
+    b[5:10, 0] = a[5:10, 0]
+    return np.column_stack([a, b, rng.uniform(1, 6, n)])
+
+def add_polys(env, rng, n=20):
+    # Boxes that are not sensed, the rays have to go through them
+    for _ in range(n):
+        box = pymunk.Poly(env.space.static_body, [(x + rng.uniform(0, WIDTH), y + rng.uniform(0, HEIGHT))
+                                                  for x, y in [(0, 0), (30, 0), (30, 20), (0, 20)]])
+        env.space.add(box)
+
+def pymunk_distances(space, a, b):
+    # The distance of each ray to its closest sensed hit, the same query as
+    # UltrasonicSensor._cast_ray
+    distances = np.hypot(*(b - a).T)
+    for i in range(len(a)):
+        for hit in space.segment_query(tuple(a[i]), tuple(b[i]), 1.0, pymunk.ShapeFilter()):
+            if hasattr(hit.shape, 'is_sensed'):
+                distances[i] = min(distances[i], np.hypot(*(np.array(hit.point) - a[i])))
+    return distances
+
+def poses(rng, n=POSES):
+    return zip(rng.uniform(0, WIDTH, n), rng.uniform(0, HEIGHT, n), rng.uniform(-np.pi, np.pi, n))
+
+def compare(path, rng, polys=False):
+    numpy_env = CarSimEnv(headless=True, scenario=path, sensing='numpy')
+    pymunk_env = CarSimEnv(headless=True, scenario=path, sensing='pymunk')
+    if polys:
+        add_polys(numpy_env, np.random.RandomState(1))
+        add_polys(pymunk_env, np.random.RandomState(1))
+    hits = 0
+    for x, y, angle in poses(rng):
+        for env in (numpy_env, pymunk_env):
+            env.car.body.position = (x, y)
+            env.car.body.angle = angle
+        observation = numpy_env.car.read_sensors()
+        a, b = numpy_env.car.last_rays
+        expected = pymunk_distances(pymunk_env.space, a, b)
+        assert np.allclose(numpy_env.car.ray_caster.cast(a, b), expected, rtol=0, atol=1e-6)
+        assert np.allclose(observation, pymunk_env.car.read_sensors(), rtol=0, atol=1e-6)
+        hits += np.sum(expected < np.hypot(*(b - a).T) - 1e-9)
+    return hits
+
+def test_circles(tmp_path):
+    rng = np.random.RandomState(0)
+    assert compare(scenario(tmp_path, circles=random_circles(rng)), rng) > 0
+
+def test_segments(tmp_path):
+    rng = np.random.RandomState(0)
+    assert compare(scenario(tmp_path, segments=random_segments(rng)), rng) > 0
+
+def test_polys_are_not_sensed(tmp_path):
+    rng = np.random.RandomState(0)
+    assert compare(scenario(tmp_path), rng, polys=True) == 0
+    rng = np.random.RandomState(0)
+    assert compare(scenario(tmp_path, circles=random_circles(rng), segments=random_segments(rng)), rng, polys=True) > 0
+
+def test_from_space_matches_scenario():
+    env = CarSimEnv(headless=True, sensing='pymunk')
+    caster = RayCaster.from_space(env.space)
+    assert np.array_equal(np.sort(caster.circles, axis=0), np.sort(env.scenario.circles, axis=0))
+    assert np.array_equal(np.sort(caster.segments, axis=0), np.sort(env.scenario.segments, axis=0))
+
+@pytest.mark.parametrize('shape', ['circle', 'segment'])
+@pytest.mark.parametrize('gap', [-0.5, 0.0, 0.5, 1.5])
+def test_max_range(tmp_path, shape, gap):
+    # An obstacle ahead of the middle sensor, its surface `gap` past the end
+    # of the straight ahead ray
+    env = CarSimEnv(headless=True, sensing='pymunk')
+    car = env.car
+    sensor = car.sensors[1]
+    x, y = WIDTH/2, 50.0
+    # Sensors sit one unit ahead of the car, distances are measured to the surface
+    front = y + car.height/2.0 + 1.0 + sensor.range + gap
+    if shape == 'circle':
+        circles, segments = [(x, front + 10.0, 10.0)], []
+    else:
+        circles, segments = [], [(0.0, front + 2.0, WIDTH, front + 2.0, 2.0)]
+    path = scenario(tmp_path, circles=circles, segments=segments)
+    numpy_env = CarSimEnv(headless=True, scenario=path, sensing='numpy')
+    pymunk_env = CarSimEnv(headless=True, scenario=path, sensing='pymunk')
+    observations = []
+    for env in (numpy_env, pymunk_env):
+        env.car.body.position = (x, y)
+        env.car.body.angle = 0.0
+        observations.append(env.car.read_sensors().copy())
+    assert np.allclose(observations[0], observations[1], rtol=0, atol=1e-6)
+    if gap > 0.0:
+        assert np.all(observations[0] == 1.0)
+    elif gap < 0.0:
+        assert observations[0][1] == pytest.approx(1.0 + gap / sensor.range, abs=1e-6)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from gym import error
+
+from dqncar_common.transition_log import TransitionLog
+from gym_arduino.envs import ArduinoReplayEnv
+
+# (steps, index of the done step or None) of each recorded episode
+EPISODES = [
+    (3, 3),         # crashed
+    (0, None),      # a reset without any step, skipped
+    (2, None),      # cut short by the next reset
+    (5, 2),         # steps logged after the crash are dropped
+    (2, 2),
+]
+
+def record(path, episodes, first=0):
+    # The observations count the records, so that each one can be told apart
+    log = TransitionLog(path, (5,), chunk_size=4, buffer_size=3)
+    n = first
+    for steps, done in episodes:
+        log.append(np.full(5, n), -1, 0.0, False, 0.0, 0.0)
+        n += 1
+        for i in range(1, steps + 1):
+            log.append(np.full(5, n), i % 3, float(n), i == done, 0.0, 0.0)
+            n += 1
+    log.close()
+
+def expected(episodes, first=0):
+    # Records played by each episode, and whether it ends truncated
+    played = []
+    n = first
+    for steps, done in episodes:
+        stop = done if done is not None else steps
+        if stop:
+            played.append((list(range(n, n + stop + 1)), done is None))
+        n += steps + 1
+    return played
+
+def play(env):
+    obs = env.reset()
+    records = [int(obs[0])]
+    done = False
+    while not done:
+        obs, reward, done, info = env.step(0)
+        records.append(int(obs[0]))
+        assert reward == obs[0]
+        assert info['action'] == (len(records) - 1) % 3
+    with pytest.raises(error.ResetNeeded):
+        env.step(0)
+    return records, info.get('TimeLimit.truncated', False)
+
+def test_episodes(tmp_path):
+    first, second = str(tmp_path / 'first'), str(tmp_path / 'second')
+    record(first, EPISODES)
+    record(second, EPISODES[:1], first=100)
+    env = ArduinoReplayEnv([first, second], mode='sequential')
+    episodes = expected(EPISODES) + expected(EPISODES[:1], first=100)
+    assert len(env.episodes) == len(episodes)
+    # Twice over, the second pass starts again from the first episode
+    assert [play(env) for _ in range(2 * len(episodes))] == 2 * episodes
+
+def test_shuffle_plays_every_episode_once_per_pass(tmp_path):
+    path = str(tmp_path / 'log')
+    record(path, EPISODES * 3)
+    env = ArduinoReplayEnv(path)
+    env.seed(0)
+    episodes = expected(EPISODES * 3)
+    for _ in range(2):
+        played = [play(env) for _ in range(len(episodes))]
+        assert sorted(played) == sorted(episodes)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from gym_carsim.envs.subproc_vec_env import CarSimSubprocVecEnv
+
+def test_close_after_a_worker_died():
+    venv = CarSimSubprocVecEnv(num_envs=3, seed=0)
+    venv.reset()
+    venv.processes[1].kill()
+    venv.processes[1].join()
+    venv.close()
+    assert venv.closed
+    assert not any(process.is_alive() for process in venv.processes)
+
+def test_close_while_stepping():
+    venv = CarSimSubprocVecEnv(num_envs=2, seed=0)
+    venv.reset()
+    venv.step_async(np.zeros(2, dtype=np.int64))
+    venv.close()
+    assert not any(process.is_alive() for process in venv.processes)
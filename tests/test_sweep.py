@@ -0,0 +1,74 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+import sweep
+
+SPEC = {'grid': {'lr': [1e-3, 5e-4], 'hidden': [[16, 16], [32]]}, 'base': {'nb_steps': 100, 'lr': 1.0},
+        'repeats': 2, 'seed': 1}
+
+def test_grid():
+    jobs = sweep.expand(SPEC)
+    assert [name for name, _, _ in jobs] == ['job-{:04d}'.format(i) for i in range(8)]
+    # Every combination, repeated, with the grid winning over the base
+    points = [(params['hidden'], params['lr']) for _, _, params in jobs]
+    assert points == [(hidden, lr) for hidden in ([16, 16], [32]) for lr in (1e-3, 5e-4) for _ in range(2)]
+    assert all(params['nb_steps'] == 100 for _, _, params in jobs)
+    assert len({seed for _, seed, _ in jobs}) == 8
+    assert sweep.expand(SPEC) == jobs
+    assert sweep.expand(dict(SPEC, seed=2)) != jobs
+
+def test_random():
+    spec = {'random': {'lr': {'log_uniform': [1e-4, 1e-2]}, 'gamma': {'uniform': [0.9, 0.99]},
+                       'batch_size': {'int': [16, 18]}, 'hidden': [[16], [32]]}, 'samples': 50}
+    jobs = sweep.expand(spec)
+    assert len(jobs) == 50
+    for _, _, params in jobs:
+        assert 1e-4 <= params['lr'] <= 1e-2 and 0.9 <= params['gamma'] <= 0.99
+        assert params['hidden'] in ([16], [32])
+    assert {params['batch_size'] for _, _, params in jobs} == {16, 17, 18}
+    with pytest.raises(ValueError):
+        sweep.expand({'random': {'lr': {'normal': [0, 1]}}, 'samples': 1})
+    with pytest.raises(ValueError):
+        sweep.expand({'base': {}})
+
+def fake_job(job):
+    # What run_job leaves behind, without training anything
+    name, seed, params, directory, options = job
+    with open(os.path.join(directory, 'runs'), 'a') as f:
+        f.write('run\n')
+    with open(os.path.join(directory, 'curve.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['episode', 'step', 'episode_reward', 'nb_episode_steps'])
+        writer.writeheader()
+        writer.writerow({'episode': 0, 'step': 10, 'episode_reward': params['lr'], 'nb_episode_steps': 10})
+    result = {'job': name, 'seed': seed, 'duration': 1.0, 'test_reward_mean': params['lr'],
+              'test_reward_std': 0.0, 'test_steps_mean': 10.0, 'test_rewards': [params['lr']]}
+    sweep._write_json(os.path.join(directory, 'result.json'), result)
+    return result
+
+def run_sweep(monkeypatch, tmp_path, spec):
+    path = str(tmp_path / 'spec.json')
+    with open(path, 'w') as f:
+        json.dump(spec, f)
+    monkeypatch.setattr(sweep, 'run_job', fake_job)
+    monkeypatch.setattr(sys, 'argv', ['sweep.py', path, '--directory', str(tmp_path / 'sweep'),
+                                      '--processes', '2', '--start-method', 'fork'])
+    sweep.main()
+
+def test_resume(monkeypatch, tmp_path):
+    run_sweep(monkeypatch, tmp_path, SPEC)
+    # As if the sweep had been stopped before the last job ended
+    last = tmp_path / 'sweep' / 'job-0007'
+    os.remove(str(last / 'result.json'))
+    run_sweep(monkeypatch, tmp_path, SPEC)
+    runs = {name: (tmp_path / 'sweep' / name / 'runs').read_text().count('run') for name, _, _ in sweep.expand(SPEC)}
+    expected = {name: 1 for name in runs}
+    expected['job-0007'] = 2
+    assert runs == expected
+    with open(str(tmp_path / 'sweep' / 'results.csv')) as f:
+        assert [row['job'] for row in csv.DictReader(f)] == sorted(runs)
+    with pytest.raises(SystemExit):
+        run_sweep(monkeypatch, tmp_path, dict(SPEC, seed=2))
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from dqncar_common.transition_log import CHUNK, TransitionLog, TransitionLogReader
+
+def write(log, steps, seed=0):
+    # Episodes of 1 to 9 steps, each one after its reset
+    rng = np.random.RandomState(seed)
+    expected = []
+    while len(expected) < steps:
+        length = rng.randint(1, 10)
+        for i in range(length + 1):
+            record = (rng.rand(3).astype(np.float32), -1 if i == 0 else rng.randint(3), 0.0 if i == 0 else rng.rand(),
+                      i == length, rng.rand(), rng.rand())
+            log.append(*record)
+            expected.append(record)
+    return expected
+
+def check(path, expected):
+    reader = TransitionLogReader(path)
+    records = reader.records()
+    assert len(reader) == len(records) == len(expected)
+    assert np.array_equal(records['obs'], np.array([r[0] for r in expected]))
+    columns = list(zip(*expected))
+    for field, values in zip(('action', 'reward', 'done', 'time', 'latency'), columns[1:]):
+        assert np.array_equal(records[field], np.array(values, dtype=records.dtype[field]))
+    assert np.array_equal(records['episode'], np.cumsum(records['action'] < 0))
+    assert np.array_equal(reader[-1], records[-1])
+    assert np.array_equal(reader[len(reader) // 2], records[len(reader) // 2])
+
+def test_round_trip_across_chunks(tmp_path):
+    path = str(tmp_path / 'log')
+    log = TransitionLog(path, (3,), chunk_size=7, buffer_size=5)
+    expected = write(log, 100)
+    log.close()
+    assert len(os.listdir(path)) == 1 + (len(expected) + 6) // 7
+    check(path, expected)
+
+def test_reopen_drops_a_torn_record(tmp_path):
+    path = str(tmp_path / 'log')
+    log = TransitionLog(path, (3,), chunk_size=7, buffer_size=5)
+    expected = write(log, 30)
+    log.close()
+    # Half a record left by a crash in the middle of a write
+    last = sorted(name for name in os.listdir(path) if name.startswith('chunk-'))[-1]
+    with open(os.path.join(path, last), 'ab') as f:
+        f.write(b'\0' * (log.dtype.itemsize // 2))
+    log = TransitionLog(path, (3,))
+    assert log.chunk_size == 7
+    expected += write(log, 30, seed=1)
+    log.close()
+    check(path, expected)
+
+def test_writer_error_reaches_the_caller(tmp_path):
+    log = TransitionLog(str(tmp_path), (3,), buffer_size=4)
+    # A directory where the first chunk should go, the writer can not open it
+    os.mkdir(os.path.join(str(tmp_path), CHUNK.format(0)))
+    for i in range(4):
+        log.append(np.zeros(3), -1 if i == 0 else 0, 0.0, False, 0.0, 0.0)
+    with pytest.raises(IsADirectoryError):
+        log.flush()
+    with pytest.raises(IsADirectoryError):
+        log.append(np.zeros(3), 0, 0.0, False, 0.0, 0.0)
+    with pytest.raises(IsADirectoryError):
+        log.close()
+    assert not log._writer.is_alive()
+    # Closed once and for all, the atexit hook has nothing left to do
+    log.close()
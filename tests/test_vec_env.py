@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from gym_carsim.envs import CarSimEnv, CarSimVecEnv
+
+def sync(env, venv, i):
+    # Puts the single car where car `i` of the vector env is
+    body = env.car.body
+    body.position = tuple(venv.positions[i])
+    body.angle = venv.angles[i]
+    body.velocity = tuple(venv.velocities[i])
+    body.angular_velocity = 0.0
+    env.car.is_crashed = False
+    env.car.clearance = 0.0
+    env.car.forget_contacts()
+    return env.car.read_sensors().copy()
+
+@pytest.mark.parametrize('substeps, action_repeat', [(1, 1), (4, 3)])
+def test_matches_single_envs(substeps, action_repeat):
+    n = 16
+    venv = CarSimVecEnv(num_envs=n, substeps=substeps, action_repeat=action_repeat)
+    venv.seed(0)
+    envs = [CarSimEnv(headless=True, substeps=substeps, action_repeat=action_repeat) for _ in range(n)]
+    observations = venv.reset()
+    for i, env in enumerate(envs):
+        assert np.allclose(sync(env, venv, i), observations[i], rtol=0, atol=1e-6)
+
+    rng = np.random.RandomState(0)
+    crashes = 0
+    for _ in range(100):
+        actions = rng.randint(3, size=n)
+        observations, rewards, dones, infos = venv.step(actions)
+        for i, env in enumerate(envs):
+            observation, reward, done, _ = env.step(actions[i])
+            assert done == dones[i]
+            assert reward == rewards[i]
+            if done:
+                crashes += 1
+                assert np.allclose(observation, infos[i]['terminal_observation'], rtol=0, atol=1e-6)
+                # The vector env popped the car again, so does the single one
+                assert np.allclose(sync(env, venv, i), observations[i], rtol=0, atol=1e-6)
+            else:
+                assert np.allclose(observation, observations[i], rtol=0, atol=1e-6)
+                assert np.allclose(env.car.body.position, venv.positions[i], rtol=0, atol=1e-6)
+    assert crashes > 0
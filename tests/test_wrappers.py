@@ -0,0 +1,91 @@
+from collections import deque
+
+import gym
+import numpy as np
+import pytest
+from gym import spaces
+
+from dqncar_common.wrappers import FrameStack
+from wrappers import VecFrameStack, WrapThreeFrames
+
+class CountingEnv(gym.Env):
+    # Observes (episode, step) and gets done every `length` steps
+    def __init__(self, length=7):
+        self.length = length
+        self.observation_space = spaces.Box(low=0.0, high=1000.0, shape=(2,), dtype=np.float32)
+        self.action_space = spaces.Discrete(3)
+        self.episode = 0
+
+    def reset(self):
+        self.episode += 1
+        self.t = 0
+        return np.array([self.episode, self.t], dtype=np.float32)
+
+    def step(self, action):
+        self.t += 1
+        return np.array([self.episode, self.t], dtype=np.float32), 0.0, self.t == self.length, {}
+
+class CountingVecEnv:
+    # CountingEnvs of different lengths, reset on done like the vector envs,
+    # the last observation of an episode going to info['terminal_observation']
+    def __init__(self, lengths):
+        self.envs = [CountingEnv(length) for length in lengths]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    def reset(self):
+        return np.array([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        observations, rewards, dones, infos = [], [], [], []
+        for env in self.envs:
+            obs, reward, done, info = env.step(0)
+            if done:
+                info['terminal_observation'] = obs
+                obs = env.reset()
+            observations.append(obs)
+            rewards.append(reward)
+            dones.append(done)
+            infos.append(info)
+        return np.array(observations), np.array(rewards), np.array(dones), infos
+
+def stacked(frames):
+    return np.concatenate(list(frames)).astype(np.float32)
+
+@pytest.mark.parametrize('fill', [None, 1.0])
+@pytest.mark.parametrize('k', [1, 3, 4])
+def test_frame_stack(k, fill):
+    env = FrameStack(CountingEnv(), k, fill=fill)
+    assert env.observation_space.shape == (2*k,)
+    for _ in range(3):
+        obs = env.reset()
+        frames = deque([obs[-2:].copy() if fill is None else np.full(2, fill)] * k, maxlen=k)
+        frames.append(obs[-2:].copy())
+        assert np.array_equal(obs, stacked(frames))
+        done = False
+        # 7 steps, the ring of 2*k frames wraps around several times
+        while not done:
+            obs, _, done, _ = env.step(0)
+            frames.append(obs[-2:].copy())
+            assert np.array_equal(obs, stacked(frames))
+
+def test_wrap_three_frames_starts_from_nothing_in_sight():
+    obs = WrapThreeFrames(CountingEnv()).reset()
+    assert np.array_equal(obs, [1.0, 1.0, 1.0, 1.0, 1.0, 0.0])
+
+def test_vec_frame_stack():
+    k = 3
+    venv = VecFrameStack(CountingVecEnv([2, 5]), k)
+    singles = [FrameStack(CountingEnv(length), k) for length in (2, 5)]
+    obs = venv.reset()
+    assert np.array_equal(obs, [env.reset() for env in singles])
+    for _ in range(12):
+        obs, _, dones, infos = venv.step(np.zeros(2, dtype=int))
+        for i, env in enumerate(singles):
+            expected, _, done, _ = env.step(0)
+            assert dones[i] == done
+            if done:
+                assert np.array_equal(infos[i]['terminal_observation'], expected)
+                expected = env.reset()
+            assert np.array_equal(obs[i], expected)